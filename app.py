@@ -6,23 +6,71 @@ YouTube → MP3 (Flask) — Safe Boot Build
 - Birleşik (alternative + standard) strateji boru hattı.
 """
 
+import io
 import os
 import re
+import sys
 import time
+import copy
+import uuid
+import queue
 import shutil
+import heapq
+import hashlib
+import bisect
+import json
 import random
+import fcntl
+import stat
+import sqlite3
+import resource
+import tempfile
+import mimetypes
+import zipfile
+import threading
+import importlib.util
+from collections import deque, OrderedDict
+from contextlib import contextmanager, nullcontext
+import subprocess
+from urllib.parse import quote as url_quote, urlsplit
+from concurrent.futures import ThreadPoolExecutor, Future, FIRST_COMPLETED, wait, as_completed
 from typing import Optional, Dict, Any, List, Tuple
 
-from flask import Flask, request, send_from_directory, render_template_string, jsonify, redirect, url_for
+_BOOT_T0 = time.perf_counter()
+from flask import (Flask, Response, request, send_file, render_template_string, jsonify, redirect,
+                   url_for, stream_with_context, g)
 
-# ---- Safe import for yt_dlp ----
-YTDLP_AVAILABLE = True
-try:
-    from yt_dlp import YoutubeDL
-    from yt_dlp.utils import DownloadError
-except Exception as e:
-    YTDLP_AVAILABLE = False
-    _YTDLP_IMPORT_ERROR = str(e)
+# Açılış profili (sn): flask ve yt_dlp import'u, modül yükleme, servislerin başlatılması ve ilk
+# isteğin süresi. /health "boot" ve ytmp3_boot_seconds ile okunur.
+BOOT: Dict[str, float] = {"flask_import_s": round(time.perf_counter() - _BOOT_T0, 3)}
+
+# ---- Lazy import for yt_dlp ----
+# yt_dlp'nin import'u worker açılışının en pahalı kısmıdır; burada yalnızca kurulu olup olmadığına
+# bakılır. Modül load_ytdlp() ile bir kez yüklenir: açılışta arka plan iş parçacığında, --preload
+# ile master'da fork'tan önce ya da en geç ilk kullanımda. Yükleme hatası uygulamayı düşürmez.
+YTDLP_AVAILABLE = importlib.util.find_spec("yt_dlp") is not None
+_YTDLP_IMPORT_ERROR = "" if YTDLP_AVAILABLE else "No module named 'yt_dlp'"
+YoutubeDL = DownloadError = None
+_ytdlp_lock = threading.Lock()
+
+def load_ytdlp() -> bool:
+    global YoutubeDL, DownloadError, YTDLP_AVAILABLE, _YTDLP_IMPORT_ERROR
+    if YoutubeDL is not None or not YTDLP_AVAILABLE:
+        return YTDLP_AVAILABLE
+    with _ytdlp_lock:
+        if YoutubeDL is None and YTDLP_AVAILABLE:
+            t0 = time.perf_counter()
+            try:
+                from yt_dlp.utils import DownloadError as _download_error
+                from yt_dlp import YoutubeDL as _youtube_dl
+            except Exception as e:
+                YTDLP_AVAILABLE, _YTDLP_IMPORT_ERROR = False, str(e)
+                print(f"[boot] yt-dlp import failed: {e}")
+            else:
+                DownloadError, YoutubeDL = _download_error, _youtube_dl
+                BOOT["yt_dlp_import_s"] = round(time.perf_counter() - t0, 3)
+                print(f"[boot] yt-dlp imported in {BOOT['yt_dlp_import_s']}s")
+    return YTDLP_AVAILABLE
 
 # --------- Config ----------
 DOWNLOAD_DIR = os.path.abspath(os.environ.get("DOWNLOAD_DIR", "/var/data"))
@@ -39,7 +87,132 @@ PROXY = (
     or os.environ.get("PROXY")
 )
 
-download_sessions: Dict[str, List[float]] = {}
+# Kimlik havuzu: çerez kavanozları ve proxy'ler. YTDLP_COOKIES ve YTDLP_PROXIES virgülle ayrılmış
+# liste alır (çerez tarafında dizin verilirse içindeki *.txt dosyaları); "direct" proxy'siz çıkıştır.
+COOKIE_PATHS = [p.strip() for p in re.split(r"[,%s]" % re.escape(os.pathsep), os.environ.get("YTDLP_COOKIES", "")) if p.strip()] + [
+    "/etc/secrets/cookies.txt",
+    "/etc/secrets/COOKIES.txt",
+    "/etc/secrets/youtube-cookies.txt",
+    "/app/cookies.txt",
+    "./cookies.txt",
+]
+PROXY_LIST = list(dict.fromkeys(
+    [p.strip() for p in re.split(r"[,\s]+", os.environ.get("YTDLP_PROXIES", "")) if p.strip()] + ([PROXY] if PROXY else [])))
+IDENTITY_HALF_LIFE = float(os.environ.get("IDENTITY_HALF_LIFE", "3600"))      # sn
+IDENTITY_COOLDOWN = float(os.environ.get("IDENTITY_COOLDOWN", "900"))         # sn, ilk işaretlenmede
+IDENTITY_MAX_COOLDOWN = float(os.environ.get("IDENTITY_MAX_COOLDOWN", "14400"))  # sn, art arda işaretlenmede üst sınır
+IDENTITY_RELOAD = float(os.environ.get("IDENTITY_RELOAD", "60"))              # sn, çerez dosyası değişiklik kontrolü
+COOKIE_UPLOAD_MAX = 1024 * 1024
+
+# YouTube istek bütçesi (makine geneli, dakikada deneme): genel, player_client başına, proxy başına
+GOVERNOR_GLOBAL_RPM = float(os.environ.get("GOVERNOR_GLOBAL_RPM", "60"))
+GOVERNOR_CLIENT_RPM = float(os.environ.get("GOVERNOR_CLIENT_RPM", "20"))
+GOVERNOR_PROXY_RPM = float(os.environ.get("GOVERNOR_PROXY_RPM", "30"))
+GOVERNOR_MIN_PRESSURE = float(os.environ.get("GOVERNOR_MIN_PRESSURE", "0.1"))  # bot/429 sonrası en düşük hız çarpanı
+GOVERNOR_RECOVERY = float(os.environ.get("GOVERNOR_RECOVERY", "300"))          # sn, çarpanın 1'e dönüş yarı ömrü
+GOVERNOR_PARK_AFTER = float(os.environ.get("GOVERNOR_PARK_AFTER", "2"))        # sn; daha uzun beklemede iş park edilir
+GOVERNOR_MAX_INLINE_WAIT = float(os.environ.get("GOVERNOR_MAX_INLINE_WAIT", "15"))  # sn; işe bağlı olmayan istekler
+
+# IP başına token bucket: RATE_LIMIT_COUNT'lık patlama, RATE_LIMIT_WINDOW'da tamamen dolar.
+# Durum aynı makinedeki tüm gunicorn worker'larınca paylaşılan bir SQLite (WAL) dosyasındadır.
+# Not: iş durumu süreç içinde olduğundan şu an tek worker çalışır (bkz. Dockerfile); süreçler arası
+# paylaşım ancak birden fazla worker'a dönülürse işe yarar. Tek süreçte de doğru ve ucuzdur.
+RATE_LIMIT_COUNT = max(1, int(os.environ.get("RATE_LIMIT_COUNT", "3")))
+RATE_LIMIT_WINDOW = float(os.environ.get("RATE_LIMIT_WINDOW", "600"))  # sn
+RATE_LIMIT_DB = os.environ.get("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "ytmp3-ratelimit.sqlite3"))
+# Önümüzdeki güvenilir ters proxy sayısı (Render: 1). İstemci IP'si X-Forwarded-For'un sağdan
+# bu kadarıncı halkasıdır; soldaki halkaları istemci kendisi yazabilir. 0 = başlıklara güvenme.
+TRUSTED_PROXIES = max(0, int(os.environ.get("TRUSTED_PROXIES", "1")))
+RATE_LIMIT_MSG = f"Rate limit aşıldı. {int(RATE_LIMIT_WINDOW // 60)} dakika içinde en fazla {RATE_LIMIT_COUNT} indirme."
+
+# Dosya adı şablonu (DOWNLOAD_DIR'e göreli). Her indirme önce kendine ait
+# DOWNLOAD_DIR/.dl-XXXX dizinine yazar, bitince dosya DOWNLOAD_DIR'e taşınır.
+OUTTMPL = "%(title).90s [%(id)s].%(ext)s"
+WORKDIR_PREFIX = ".dl-"
+
+# yt-dlp önbelleği (player JS'ten türetilen imza/nsig verisi, EJS çözücü betikleri) kalıcı diskte,
+# tüm worker'larda ortaktır. yt-dlp dosyaları geçici dosya + rename ile atomik yazar; eşzamanlı
+# okuyan yarım dosya görmez. "off" kapatır. YTDLP_WARMUP_URL doluysa her worker açılışta bu video
+# için bir kez metadata çeker; player verisi ilk kullanıcı isteğinden önce önbelleğe girer.
+_cache_dir = os.environ.get("YTDLP_CACHE_DIR", os.path.join(DOWNLOAD_DIR, ".yt-dlp-cache")).strip()
+YTDLP_CACHE_DIR = False if _cache_dir.lower() in ("", "off", "0", "false", "no") else os.path.abspath(_cache_dir)
+YTDLP_WARMUP_URL = os.environ.get("YTDLP_WARMUP_URL", "").strip()
+YTDLP_SHARED_PLAYERS = 4  # süreç içinde paylaşılan en fazla player JS sürümü (her biri ~2-3 MB)
+
+# Çıktı profili (istek başına): "mp3-<kbps>" / "opus-<kbps>" yeniden kodlar, "remux" kodlamadan
+# m4a/opus/ogg kabına kopyalar, "source" kaynak dosyayı olduğu gibi bırakır. Varsayılan bitrate'teki
+# MP3 eski adını ("<başlık> [<id>].mp3") korur; diğer bitrate'ler "<başlık> [<id>].128k.mp3" olarak
+# saklanır. Opus adı her zaman bitrate taşır ("<başlık> [<id>].128k.opus"), kaynak .opus ile karışmaz.
+MP3_BITRATES = (128, 192, 256, 320)
+DEFAULT_MP3_BITRATE = 192
+OPUS_BITRATES = (64, 96, 128, 160)
+DEFAULT_OPUS_BITRATE = 128
+ENCODED_OUTPUT_RE = re.compile(r"mp3-(?:%s)|opus-(?:%s)" % ("|".join(map(str, MP3_BITRATES)),
+                                                           "|".join(map(str, OPUS_BITRATES))))
+DEFAULT_OUTPUT = os.environ.get("DEFAULT_OUTPUT", "").strip().lower() or f"mp3-{DEFAULT_MP3_BITRATE}"
+if not (DEFAULT_OUTPUT in ("remux", "source") or ENCODED_OUTPUT_RE.fullmatch(DEFAULT_OUTPUT)):
+    print(f"[CFG] invalid DEFAULT_OUTPUT={DEFAULT_OUTPUT!r}; using mp3-{DEFAULT_MP3_BITRATE}")
+    DEFAULT_OUTPUT = f"mp3-{DEFAULT_MP3_BITRATE}"
+# Tek geçişte kodlanan ek profiller, ör. "mp3-128,mp3-320,opus-128": bir video kodlanırken istenen
+# profil ile birlikte bunlardan önbellekte olmayanlar da aynı ffmpeg sürecinde üretilir (kaynak bir
+# kez indirilir, bir kez çözülür). Sonraki istekler ağa ve yeniden kodlamaya gitmeden önbellekten döner.
+RENDITIONS = [r.strip().lower() for r in os.environ.get("RENDITIONS", "").split(",") if r.strip()]
+if any(not ENCODED_OUTPUT_RE.fullmatch(r) for r in RENDITIONS):
+    print(f"[CFG] ignoring invalid RENDITIONS entries: {[r for r in RENDITIONS if not ENCODED_OUTPUT_RE.fullmatch(r)]}")
+RENDITIONS = list(dict.fromkeys(r for r in RENDITIONS if ENCODED_OUTPUT_RE.fullmatch(r)))
+
+# /download servis modu: "" (Python/sendfile), "x-sendfile" (Apache/lighttpd) ya da
+# "x-accel" (nginx internal location: DOWNLOAD_ACCEL_PREFIX -> DOWNLOAD_DIR).
+DOWNLOAD_OFFLOAD = os.environ.get("DOWNLOAD_OFFLOAD", "").strip().lower()
+DOWNLOAD_ACCEL_PREFIX = os.environ.get("DOWNLOAD_ACCEL_PREFIX", "/_protected_downloads").rstrip("/")
+DOWNLOAD_MAX_AGE = int(os.environ.get("DOWNLOAD_MAX_AGE", "3600"))
+
+# İş kuyruğu: indirmeler request thread'inde değil, sınırlı bir worker havuzunda koşar.
+JOB_WORKERS = max(1, int(os.environ.get("JOB_WORKERS", "2")))
+JOB_QUEUE_DEPTH = max(1, int(os.environ.get("JOB_QUEUE_DEPTH", "16")))
+JOB_TIMEOUT = float(os.environ.get("JOB_TIMEOUT", "900"))   # sn, iş başına (0 = sınırsız)
+JOB_TTL = float(os.environ.get("JOB_TTL", "3600"))          # biten işler bu kadar saklanır
+JOB_EVENT_BUFFER = 200                                       # iş başına saklanan son olay sayısı
+
+# Sunucu modu (Dockerfile/render.yaml: WORKER_CLASS). "gthread": her bağlantı bir OS iş parçacığı
+# tutar. "gevent": gunicorn worker'ı modülleri monkey-patch'ler, her bağlantı bir greenlet olur;
+# yüzlerce boşta/yavaş bağlantı (SSE, /stream, /download) ucuzdur. yt-dlp ve ffmpeg işi her iki
+# modda da route'larda değil iş kuyruğu ve kodlama havuzu worker'larında koşar; gevent'te bunlar
+# greenlet'tir ve soket G/Ç'si, ffmpeg boruları ve beklemeler hub'ı bloklamaz. (Gerçek iş
+# parçacığına taşımak olmaz: gevent'in subprocess'i yalnızca ana döngüde çalışır, yt-dlp de onu kullanır.)
+def _gevent_patched() -> bool:
+    monkey = sys.modules.get("gevent.monkey")
+    return bool(monkey and monkey.is_module_patched("socket"))
+
+GREEN = _gevent_patched()
+SERVER_MODE = "gevent" if GREEN else "gthread"
+
+# PRELOAD=1 (yalnızca gthread; Dockerfile gunicorn'a --preload verir): modül ve yt_dlp master'da
+# bir kez yüklenir, worker'lar fork ile hazır gelir (copy-on-write). Arka plan servisleri
+# fork'tan sonra her worker'da başlar. gevent worker'ı fork'tan sonra monkey-patch yaptığından
+# orada preload kullanılmaz.
+PRELOAD = (os.environ.get("PRELOAD", "0").lower() in ("1","true","yes","on")
+           and os.environ.get("WORKER_CLASS", "gthread") == "gthread")
+
+# /jobs/<id>/events (SSE): her bağlantı en fazla SSE_MAX_DURATION sn açık kalır, sonra tarayıcı
+# Last-Event-ID ile kaldığı yerden yeniden bağlanır. Eşzamanlı akış sayısı SSE_MAX_STREAMS ile
+# sınırlıdır; sınır dolunca sayfa /jobs/<id> yoklamasına düşer. gevent modunda akış bir greenlet'tir,
+# varsayılan sınır yüksektir. gthread'de her akış bir worker thread'ini tutacağından varsayılan 0'dır:
+# SSE kapalı, sayfa doğrudan yoklar (204 döner, tarayıcı yeniden bağlanmaz).
+SSE_MAX_STREAMS = max(0, int(os.environ.get("SSE_MAX_STREAMS") or ("500" if GREEN else "0")))
+SSE_MAX_DURATION = float(os.environ.get("SSE_MAX_DURATION", "25"))
+
+# /batch: link listesi ya da playlist tek bir işte, BATCH_CONCURRENCY paralellikle indirilir.
+# Toplu iş rate limit'ten tek hak düşer; öğe sayısı BATCH_MAX_ITEMS ile sınırlıdır.
+BATCH_CONCURRENCY = max(1, int(os.environ.get("BATCH_CONCURRENCY", "2")))
+BATCH_MAX_ITEMS = max(1, int(os.environ.get("BATCH_MAX_ITEMS", "25")))
+BATCH_TIMEOUT = float(os.environ.get("BATCH_TIMEOUT", "7200"))  # sn, tüm toplu iş için
+
+# MP3 kodlama havuzu: indirme iş parçacıklarından ayrı, çekirdek başına bir ffmpeg (0 = kapalı,
+# kodlama eskisi gibi indirmeyi yapan iş parçacığında yt-dlp postprocessor'ı ile yapılır)
+TRANSCODE_WORKERS = max(0, int(os.environ.get("TRANSCODE_WORKERS") or (os.cpu_count() or 1)))
+TRANSCODE_QUEUE_DEPTH = max(1, int(os.environ.get("TRANSCODE_QUEUE_DEPTH", str(max(TRANSCODE_WORKERS, 1) * 4))))
+TRANSCODE_SHORT_FIRST = float(os.environ.get("TRANSCODE_SHORT_FIRST", "10"))  # sn bekleme / tahmini CPU sn
 
 # --------- HTML Shell ---------
 HTML_SHELL = r"""<!doctype html>
@@ -49,20 +222,22 @@ HTML_SHELL = r"""<!doctype html>
   <meta name="viewport" content="width=device-width,initial-scale=1">
   <title>YouTube → MP3</title>
   <style>
-    :root { --bg:#fff; --fg:#111; --muted:#6b7280; --primary:#111; --ok:#0a7; --err:#d32f2f; --okbg:#e8f5e8; --errbg:#ffebee; }
-    body{font-family:system-ui,Segoe UI,Roboto,Arial,sans-serif;max-width:780px;margin:32px auto;padding:0 16px;line-height:1.5;color:var(--fg);background:var(--bg)}
-    h2{margin:8px 0 16px}
-    input[type=text]{width:100%;padding:12px;border:1px solid #cbd5e1;border-radius:10px;box-sizing:border-box}
-    .row{display:flex;gap:8px;align-items:center;flex-wrap:wrap;margin-top:12px}
-    input[type=file]{flex:1}
-    button,a.btn{padding:10px 16px;border:0;border-radius:10px;background:var(--primary);color:#fff;cursor:pointer;text-decoration:none;display:inline-block;box-sizing:border-box}
-    button[disabled],a.btn.disabled{opacity:.6;pointer-events:none}
-    .msg{margin-top:14px;white-space:pre-wrap}
-    .ok{background:var(--okbg);color:#14532d;padding:12px;border-radius:8px}
-    .err{background:var(--errbg);color:var(--err);padding:12px;border-radius:8px}
-    .note{margin-top:16px;font-size:.95em;color:var(--muted)}
-    .divider{height:1px;background:#e5e7eb;margin:20px 0}
-    .countdown{font-size:0.9em;color:#666;margin-top:8px}
+    :root {{ --bg:#fff; --fg:#111; --muted:#6b7280; --primary:#111; --ok:#0a7; --err:#d32f2f; --okbg:#e8f5e8; --errbg:#ffebee; }}
+    body{{font-family:system-ui,Segoe UI,Roboto,Arial,sans-serif;max-width:780px;margin:32px auto;padding:0 16px;line-height:1.5;color:var(--fg);background:var(--bg)}}
+    h2{{margin:8px 0 16px}}
+    input[type=text],textarea{{width:100%;padding:12px;border:1px solid #cbd5e1;border-radius:10px;box-sizing:border-box;font:inherit}}
+    details{{margin-top:16px}} summary{{cursor:pointer;color:var(--muted)}}
+    .row{{display:flex;gap:8px;align-items:center;flex-wrap:wrap;margin-top:12px}}
+    input[type=file]{{flex:1}}
+    button,a.btn{{padding:10px 16px;border:0;border-radius:10px;background:var(--primary);color:#fff;cursor:pointer;text-decoration:none;display:inline-block;box-sizing:border-box}}
+    button[disabled],a.btn.disabled{{opacity:.6;pointer-events:none}}
+    select{{padding:10px;border:1px solid #cbd5e1;border-radius:10px;background:#fff}}
+    .msg{{margin-top:14px;white-space:pre-wrap}}
+    .ok{{background:var(--okbg);color:#14532d;padding:12px;border-radius:8px}}
+    .err{{background:var(--errbg);color:var(--err);padding:12px;border-radius:8px}}
+    .note{{margin-top:16px;font-size:.95em;color:var(--muted)}}
+    .divider{{height:1px;background:#e5e7eb;margin:20px 0}}
+    .countdown{{font-size:0.9em;color:#666;margin-top:8px}}
   </style>
 </head>
 <body>
@@ -82,9 +257,33 @@ FORM_CONTENT = r"""
     <input type="text" name="url" placeholder="https://www.youtube.com/watch?v=..." value="{url}" required>
     <div class="row">
       <input type="file" name="cookies" accept=".txt">
+      <select name="output" title="Çıktı biçimi">
+        <option value="mp3-192">MP3 192k</option>
+        <option value="mp3-128">MP3 128k</option>
+        <option value="mp3-320">MP3 320k</option>
+        <option value="opus-128">Opus 128k</option>
+        <option value="remux">Dönüştürmeden (m4a/opus, hızlı)</option>
+        <option value="source">Orijinal dosya</option>
+      </select>
       <button type="submit" id="submitBtn">İndir</button>
+      <button type="submit" id="streamBtn" formaction="/stream" formmethod="get" formenctype="application/x-www-form-urlencoded" title="MP3/Opus kodlanırken iner">Anında indir (akış)</button>
     </div>
   </form>
+  <details>
+    <summary>Toplu / playlist indirme (ZIP)</summary>
+    <form method="post" action="/batch" style="margin-top:8px">
+      <textarea name="urls" rows="5" placeholder="Her satıra bir link ya da bir playlist linki (https://www.youtube.com/playlist?list=...)" required></textarea>
+      <div class="row">
+        <select name="output" title="Çıktı biçimi">
+          <option value="mp3-192">MP3 192k</option>
+          <option value="mp3-128">MP3 128k</option>
+          <option value="opus-128">Opus 128k</option>
+          <option value="remux">Dönüştürmeden (m4a/opus, hızlı)</option>
+        </select>
+        <button type="submit">ZIP olarak indir</button>
+      </div>
+    </form>
+  </details>
   {msg_block}
   <script>
     document.getElementById('downloadForm').addEventListener('submit', function(e) {{
@@ -92,6 +291,10 @@ FORM_CONTENT = r"""
       btn.disabled = true; btn.textContent = 'İndiriliyor...';
       setTimeout(() => {{ btn.disabled = false; btn.textContent = 'İndir'; }}, 30000);
     }});
+    // akış yalnızca kodlanan profiller (MP3/Opus) için; remux/orijinal normal indirmeyle gelir
+    const outSel = document.querySelector('#downloadForm select[name=output]');
+    const syncStream = () => {{ document.getElementById('streamBtn').disabled = !/^(mp3|opus)-/.test(outSel.value); }};
+    outSel.addEventListener('change', syncStream); syncStream();
   </script>
 """
 
@@ -115,67 +318,337 @@ DONE_CONTENT = r"""
         const a=document.createElement('a'); a.href=url; a.download=filename; a.style.display='none';
         document.body.appendChild(a); a.click(); a.remove();
         let s=3; const el=document.getElementById('countdown');
-        const tick=()=>{{ if(s>0){{ el.textContent=`${{s}} sn sonra ana sayfaya dönülecek...`; s--; setTimeout(tick,1000);} else {{ location.href='/'; }} }};
+        const tick=()=>{{ if(s>0){{ el.textContent=`${{s}} sn sonra ana sayfaya dönülecek...`; s--; setTimeout(tick,1000);}} else {{ location.href='/'; }} }};
         tick();
       }} catch(e) {{ alert('İndirme sırasında hata oluştu.'); }}
     }}
   </script>
 """
 
+JOB_CONTENT = r"""
+  <div class="msg ok" id="jobmsg">⏳ İndirme kuyruğa alındı...</div>
+  <div class="countdown" id="jobinfo"></div>
+  <p style="margin-top:12px">
+    <button id="cancelBtn" type="button">İptal et</button>
+    <a class="btn" href="/">Ana sayfa</a>
+  </p>
+  <script>
+    const jobId = '{job_id}';
+    const labels = {{queued:'⏳ Sırada bekliyor', running:'⬇️ İndiriliyor', done:'✅ İndirme tamamlandı',
+                     error:'❌ İndirme Hatası', cancelled:'🚫 İptal edildi', timeout:'⌛ Zaman aşımı'}};
+    const msg = document.getElementById('jobmsg'), info = document.getElementById('jobinfo');
+    const cancelBtn = document.getElementById('cancelBtn');
+    let job = {{state:'queued', progress:{{}}}}, finished = false;
+    cancelBtn.addEventListener('click', () => {{ fetch('/jobs/' + jobId + '/cancel', {{method:'POST'}}); cancelBtn.disabled = true; }});
+    const mb = b => (b / 1048576).toFixed(1) + ' MB';
+    function detail(p) {{
+      if (!p || !p.phase) return '';
+      if (p.phase === 'strategy') return '🔎 Deneniyor: ' + p.name;
+      if (p.phase === 'batch') return '📦 ' + p.done + '/' + p.total + ' tamamlandı' + (p.failed ? ' · ' + p.failed + ' hata' : '');
+      if (p.phase === 'transcode') return '⏳ Dönüştürme sırası bekleniyor' + (p.queued > 1 ? ' (' + p.queued + ' dosya sırada)' : '') + '...';
+      if (p.phase === 'parked') return '⏸️ YouTube yoğun; ' + Math.max(0, Math.round(p.until - Date.now() / 1000)) + ' sn sonra devam edilecek';
+      if (p.phase === 'dedup') return '🔁 Aynı video zaten indiriliyor, bekleniyor...';
+      if (p.phase === 'throughput') return '⬇️ İndirildi · ' + p.mbps + ' MB/s';
+      if (p.phase === 'postprocess') return '🎛️ Dönüştürülüyor (' + (p.postprocessor || 'ffmpeg') + ')...';
+      if (p.phase === 'download') {{
+        let t = p.percent != null ? p.percent + '%' : mb(p.downloaded_bytes || 0);
+        if (p.speed) t += ' · ' + mb(p.speed) + '/s';
+        if (p.eta != null) t += ' · kalan ' + p.eta + ' sn';
+        return '⬇️ ' + t;
+      }}
+      return '';
+    }}
+    function render() {{
+      if (finished) return;
+      msg.textContent = (job.cancel_requested && job.state === 'running') ? '🚫 İptal ediliyor...' : (labels[job.state] || job.state);
+      if (job.state === 'queued' && job.position) info.textContent = 'Kuyruk sırası: ' + job.position;
+      else if (job.state === 'running') info.textContent = detail(job.progress);
+      if (job.state === 'done') {{ finished = true; location.href = '/jobs/' + jobId + '/result'; return; }}
+      if (['error','cancelled','timeout'].includes(job.state)) {{
+        finished = true; msg.className = 'msg err'; if (job.error) msg.textContent += ': ' + job.error;
+        info.textContent = ''; cancelBtn.disabled = true;
+      }}
+    }}
+    function poll() {{
+      if (finished) return;
+      fetch('/jobs/' + jobId).then(r => r.json()).then(j => {{
+        if (j.error && !j.state) {{ finished = true; msg.className = 'msg err'; msg.textContent = '❌ ' + j.error; cancelBtn.disabled = true; return; }}
+        job = j; render(); setTimeout(poll, 2000);
+      }}).catch(() => setTimeout(poll, 4000));
+    }}
+    if (window.EventSource && {sse}) {{
+      const es = new EventSource('/jobs/' + jobId + '/events');
+      let opened = false;
+      es.onopen = () => {{ opened = true; }};
+      es.addEventListener('state', e => {{ const d = JSON.parse(e.data); job.state = d.state; if (d.error) job.error = d.error; if (['done','error','cancelled','timeout'].includes(d.state)) es.close(); render(); }});
+      ['strategy','parked','download','throughput','transcode','postprocess','dedup','batch'].forEach(k => es.addEventListener(k, e => {{
+        const d = JSON.parse(e.data); job.state = 'running'; job.progress = Object.assign({{}}, job.progress, d, {{phase: k}}); render();
+      }}));
+      es.onerror = () => {{ if (!opened || es.readyState === EventSource.CLOSED) {{ es.close(); poll(); }} opened = false; }};
+    }} else {{
+      poll();
+    }}
+  </script>
+"""
+
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB
+app.config['USE_X_SENDFILE'] = DOWNLOAD_OFFLOAD == "x-sendfile"
+
+# --------- Metrics ---------
+# /metrics için Prometheus metin formatında sayaç ve histogramlar. Ek bağımlılık yoktur; her
+# ölçüm bir kilit altında birkaç sözlük güncellemesidir, production'da açık kalabilir. Değerler
+# süreç içidir (gunicorn tek worker ile çalışır); anlık göstergeler kazıma sırasında hesaplanır.
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+_BUCKET_LABELS = ['le="%g"' % b for b in LATENCY_BUCKETS] + ['le="+Inf"']
+
+def _fmt_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+def _fmt_labels(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+    parts = ['%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+             for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta: Dict[str, Tuple[str, str]] = {}  # ad -> (tip, açıklama)
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._hists: Dict[str, Dict[tuple, List[float]]] = {}  # [kova sayıları..., toplam, adet]
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            h = self._hists.setdefault(name, {}).get(key)
+            if h is None:
+                h = self._hists[name][key] = [0.0] * (len(LATENCY_BUCKETS) + 2)
+            h[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1  # son kova = +Inf
+            h[-2] += value
+            h[-1] += 1
+
+    def render(self, gauges: Dict[str, Tuple[str, Dict[tuple, float]]]) -> str:
+        out: List[str] = []
+
+        def header(name: str, kind: str) -> None:
+            out.append(f"# HELP {name} {self._meta.get(name, (kind, name))[1]}")
+            out.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = {n: dict(s) for n, s in self._counters.items()}
+            hists = {n: {k: list(v) for k, v in s.items()} for n, s in self._hists.items()}
+        for name, series in sorted(counters.items()):
+            header(name, "counter")
+            out += [f"{name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in sorted(series.items())]
+        for name, series in sorted(hists.items()):
+            header(name, "histogram")
+            for k, h in sorted(series.items()):
+                cum = 0.0
+                for le, n in zip(_BUCKET_LABELS, h[:-2]):
+                    cum += n
+                    out.append(f"{name}_bucket{_fmt_labels(k, le)} {_fmt_value(cum)}")
+                out.append(f"{name}_sum{_fmt_labels(k)} {h[-2]:.6f}")
+                out.append(f"{name}_count{_fmt_labels(k)} {_fmt_value(h[-1])}")
+        for name, (help_text, series) in sorted(gauges.items()):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} gauge")
+            out += [f"{name}{_fmt_labels(k)} {_fmt_value(v)}" for k, v in sorted(series.items())]
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+metrics.describe("ytmp3_stage_seconds", "histogram",
+                 "Time spent per pipeline stage (queue_wait, governor, extract, backoff, download, transcode_wait, "
+                 "transcode_backpressure, postprocess, job, warmup).")
+metrics.describe("ytmp3_strategy_seconds", "histogram", "Metadata extraction latency per player client.")
+metrics.describe("ytmp3_strategy_attempts_total", "counter", "Strategy attempts by player client and result/error class.")
+metrics.describe("ytmp3_jobs_total", "counter", "Finished jobs by final state.")
+metrics.describe("ytmp3_job_requeue_full_total", "counter", "Parked jobs re-parked because the job queue was full.")
+metrics.describe("ytmp3_cache_requests_total", "counter", "Result cache lookups by outcome.")
+metrics.describe("ytmp3_rate_limited_total", "counter", "Requests rejected by the per-IP rate limiter.")
+metrics.describe("ytmp3_http_request_seconds", "histogram", "Flask handler time by endpoint (excludes streamed bodies).")
+metrics.describe("ytmp3_served_bytes_total", "counter", "Response body bytes handed out, by route.")
+metrics.describe("ytmp3_evictions_total", "counter", "Cache files removed, by reason.")
+metrics.describe("ytmp3_transcode_cpu_seconds_total", "counter", "ffmpeg CPU seconds spent on MP3/Opus encodes, by output.")
+metrics.describe("ytmp3_transcode_cpu_saved_seconds_total", "counter",
+                 "Estimated MP3 encode CPU seconds avoided by remux/source outputs.")
+metrics.describe("ytmp3_transcode_pool_total", "counter", "Transcode pool tasks by outcome.")
+metrics.describe("ytmp3_renditions_total", "counter", "Extra renditions encoded in the same ffmpeg pass, by output.")
+metrics.describe("ytmp3_identity_outcomes_total", "counter", "Attempt outcomes per identity kind (cookie/proxy).")
+metrics.describe("ytmp3_governor_waits_total", "counter", "Upstream budget waits, slept inline or parked.")
+metrics.describe("ytmp3_governor_backoffs_total", "counter", "Global upstream slow-downs triggered, by error class.")
+metrics.describe("ytmp3_journal_total", "counter", "Job journal events: resumed jobs, adopted partial downloads, removed orphans.")
+metrics.describe("ytmp3_info_cache_total", "counter", "Extracted-info cache lookups/stores by result and use (download/meta).")
+
+@contextmanager
+def timed(stage: str, **labels):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe("ytmp3_stage_seconds", time.perf_counter() - t0, stage=stage, **labels)
 
 # --------- Helpers ---------
+# Ortam yoklamaları süreç başına bir kez: ffmpeg PATH taraması modül yüklenirken, sürümü ilk
+# ihtiyaçta. (Çerez konumları IdentityPool'da çözülür; değişiklikler aralıklı stat ile izlenir.)
+FFMPEG_PATH = shutil.which("ffmpeg")
+_ffmpeg_version: Optional[str] = None
+
 def ffmpeg_available() -> bool:
-    return shutil.which("ffmpeg") is not None
+    return FFMPEG_PATH is not None
 
-def is_valid_youtube_url(url: str) -> bool:
+def ffmpeg_version() -> Optional[str]:
+    global _ffmpeg_version
+    if _ffmpeg_version is None and FFMPEG_PATH:
+        try:
+            out = subprocess.run([FFMPEG_PATH, "-version"], capture_output=True, text=True, timeout=10).stdout
+            m = re.search(r"version (\S+)", out)
+            _ffmpeg_version = m.group(1) if m else ""
+        except (OSError, subprocess.SubprocessError):
+            _ffmpeg_version = ""
+    return _ffmpeg_version or None
+
+# Özelden genele: ilk eşleşen kalıbın yakaladığı grup kanonik video ID'sidir.
+YOUTUBE_ID_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'(?:https?://)?(?:m\.)?youtube\.com/shorts/([A-Za-z0-9_-]{11})',
+    r'(?:https?://)?youtu\.be/([A-Za-z0-9_-]{11})',
+    r'(?:https?://)?(?:www\.)?(?:youtube|youtu|youtube-nocookie)\.(?:com|be)/'
+    r'(?:watch\?v=|embed/|v/|.+\?v=|shorts/)?([A-Za-z0-9_-]{11})(?:\S+)?',
+)]
+
+def extract_video_id(url: str) -> Optional[str]:
     if not url:
-        return False
+        return None
     if not url.startswith(('http://','https://')):
         url = 'https://' + url
-    patterns = [
-        r'(?:https?://)?(?:www\.)?(?:youtube|youtu|youtube-nocookie)\.(?:com|be)/'
-        r'(?:watch\?v=|embed/|v/|.+\?v=|shorts/)?([A-Za-z0-9_-]{11})(?:\S+)?',
-        r'(?:https?://)?(?:m\.)?youtube\.com/shorts/([A-Za-z0-9_-]{11})',
-        r'(?:https?://)?youtu\.be/([A-Za-z0-9_-]{11})'
-    ]
-    return any(re.search(p, url, re.IGNORECASE) for p in patterns)
+    for p in YOUTUBE_ID_PATTERNS:
+        m = p.search(url)
+        if m:
+            return m.group(1)
+    return None
+
+def is_valid_youtube_url(url: str) -> bool:
+    return extract_video_id(url) is not None
+
+def attachment_header(filename: str) -> str:
+    ascii_name = filename.encode("ascii", "ignore").decode().replace('"', "").replace("\\", "") or "audio"
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{url_quote(filename)}"
+
+def client_ip() -> str:
+    """Güvenilir proxy'nin eklediği X-Forwarded-For halkası (sağdan TRUSTED_PROXIES'inci), yoksa
+    X-Real-IP, yoksa soket adresi. TRUSTED_PROXIES=0 iken yalnızca soket adresi kullanılır."""
+    if not TRUSTED_PROXIES:
+        return request.remote_addr or ""
+    hops = [h.strip() for h in request.headers.get("X-Forwarded-For", "").split(",") if h.strip()]
+    if hops:
+        return hops[-min(TRUSTED_PROXIES, len(hops))]
+    return request.headers.get("X-Real-IP", "").strip() or (request.remote_addr or "")
+
+def _bucket_take(tokens: float, updated: float, now: float) -> Tuple[bool, float]:
+    refill = RATE_LIMIT_COUNT / RATE_LIMIT_WINDOW if RATE_LIMIT_WINDOW > 0 else float("inf")
+    tokens = min(float(RATE_LIMIT_COUNT), tokens + (now - updated) * refill)
+    if tokens >= 1.0:
+        return True, tokens - 1.0
+    return False, tokens
+
+class LocalSQLite:
+    """İş parçacığı başına bir SQLite (WAL) bağlantısı."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+
+    def reset_connections(self) -> None:
+        """Fork sonrası: ebeveyn süreçte açılmış bağlantılar çocukta kullanılmaz."""
+        self._local = threading.local()
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+class RateLimiter(LocalSQLite):
+    """O(1) token bucket. Boşta kalan anahtarlar (bucket'ı zaten dolmuş olanlar) periyodik
+    olarak silinir; SQLite kullanılamazsa süreç içi bir sözlüğe düşer."""
+
+    PRUNE_EVERY = 60.0
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._mem: Dict[str, Tuple[float, float]] = {}
+        self._mem_lock = threading.Lock()
+        self._last_prune = 0.0
+        self.shared = True
+        try:
+            self._db().execute("CREATE TABLE IF NOT EXISTS buckets "
+                               "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        except sqlite3.Error as e:
+            print(f"[ratelimit] SQLite unavailable ({e}); falling back to per-process limiter")
+            self.shared = False
+
+    def hit(self, key: str) -> bool:
+        now = time.time()
+        if self.shared:
+            try:
+                return self._hit_db(key, now)
+            except sqlite3.Error as e:
+                print(f"[ratelimit] db error: {e}")
+        return self._hit_mem(key, now)
+
+    def _hit_db(self, key: str, now: float) -> bool:
+        conn = self._db()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            ok, tokens = _bucket_take(*(row or (float(RATE_LIMIT_COUNT), now)), now)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            if now - self._last_prune > self.PRUNE_EVERY:
+                self._last_prune = now
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - RATE_LIMIT_WINDOW,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return ok
+
+    def _hit_mem(self, key: str, now: float) -> bool:
+        with self._mem_lock:
+            ok, tokens = _bucket_take(*self._mem.get(key, (float(RATE_LIMIT_COUNT), now)), now)
+            self._mem[key] = (tokens, now)
+            if now - self._last_prune > self.PRUNE_EVERY:
+                self._last_prune = now
+                for k in [k for k, (_, t) in self._mem.items() if t < now - RATE_LIMIT_WINDOW]:
+                    del self._mem[k]
+        return ok
+
+rate_limiter = RateLimiter(RATE_LIMIT_DB)
 
 def check_rate_limit(ip: str) -> bool:
     if not ip:
         return True
-    now = time.time()
-    sess = download_sessions.setdefault(ip, [])
-    sess[:] = [t for t in sess if now - t < 600]  # 10dk
-    if len(sess) >= 3:
-        return False
-    sess.append(now)
-    return True
-
-def ensure_cookiefile(refresh: bool = False) -> Optional[str]:
-    tmp = "/tmp/cookies.txt"
-    if refresh or not (os.path.exists(tmp) and os.path.getsize(tmp) > 0):
-        for src in [os.environ.get("YTDLP_COOKIES"),
-                    "/etc/secrets/cookies.txt",
-                    "/etc/secrets/COOKIES.txt",
-                    "/etc/secrets/youtube-cookies.txt",
-                    "/app/cookies.txt",
-                    "./cookies.txt"]:
-            if src and os.path.exists(src) and os.path.getsize(src) > 0:
-                try:
-                    shutil.copyfile(src, tmp)
-                    print(f"[cookie] copied {src} -> {tmp}")
-                    return tmp
-                except Exception as e:
-                    print(f"[cookie] copy failed {src}: {e}")
-        print("[cookie] not found")
-        return None
-    print("[cookie] using existing /tmp/cookies.txt")
-    return tmp
+    if rate_limiter.hit(ip):
+        return True
+    metrics.inc("ytmp3_rate_limited_total")
+    return False
 
-def build_opts(*, player_clients, cookiefile: Optional[str] = None, proxy: Optional[str] = PROXY,
-               postprocess: bool = True, use_po_token: bool = False, aggressive_bypass: bool = False) -> Dict[str, Any]:
+def build_opts(*, player_clients, identity: Optional["Identity"] = None,
+               postprocess: bool = True, use_po_token: bool = False, aggressive_bypass: bool = False,
+               output: str = DEFAULT_OUTPUT) -> Dict[str, Any]:
     if isinstance(player_clients, list):
         player_clients = ",".join(player_clients)
     assert isinstance(player_clients, str), "player_clients string olmalı"
@@ -186,18 +659,17 @@ def build_opts(*, player_clients, cookiefile: Optional[str] = None, proxy: Optio
     ]
     selected_ua = random.choice(user_agents)
     opts: Dict[str, Any] = {
-        "outtmpl": os.path.join(DOWNLOAD_DIR, "%(title).90s.%(ext)s"),
+        "paths": {"home": DOWNLOAD_DIR},
+        "outtmpl": OUTTMPL,
         "noplaylist": True,
         "quiet": True,
         "no_warnings": True,
-        "cachedir": False,
+        "cachedir": YTDLP_CACHE_DIR,
         "retries": 6 if aggressive_bypass else 4,
         "fragment_retries": 6 if aggressive_bypass else 4,
         "extractor_retries": 8,
-        "concurrent_fragment_downloads": 1 if aggressive_bypass else 2,
         "nocheckcertificate": True,
         "socket_timeout": 60 if aggressive_bypass else 45,
-        "http_chunk_size": 262144 if aggressive_bypass else 524288,
         "source_address": "0.0.0.0",
         "sleep_interval_requests": 2 if aggressive_bypass else 1,
         "max_sleep_interval": 8 if aggressive_bypass else 3,
@@ -224,17 +696,24 @@ def build_opts(*, player_clients, cookiefile: Optional[str] = None, proxy: Optio
         "ignore_no_formats_error": True,
         "ignoreerrors": False,
     }
+    fragments, chunk = (1, 262144) if aggressive_bypass else (2, 524288)
+    if DOWNLOAD_TUNING:
+        path = tuning_path(identity, player_clients)
+        fragments, chunk = download_tuner.choose(path, (fragments, chunk))
+        opts[TUNE_PARAM] = (path, (fragments, chunk))
+    opts.update(concurrent_fragment_downloads=fragments, http_chunk_size=chunk)
     if use_po_token:
         po_token = os.environ.get("YTDLP_PO_TOKEN")
         visitor_data = os.environ.get("YTDLP_VISITOR_DATA")
         if po_token and visitor_data:
             opts["extractor_args"]["youtube"]["po_token"] = f"{po_token}:{visitor_data}"
             print("[token] Using PO Token")
+    proxy = identity.proxy_url if identity else PROXY
     if proxy:
         opts["proxy"] = proxy
-        print(f"[proxy] {proxy[:24]}...")
-    if cookiefile and os.path.exists(cookiefile):
-        opts["cookiefile"] = cookiefile
+    jar = identity.jar() if identity else None
+    if jar is not None:
+        opts["cookiefile"] = jar
 
     force_client = os.environ.get("YTDLP_FORCE_CLIENT")
     if force_client:
@@ -242,12 +721,9 @@ def build_opts(*, player_clients, cookiefile: Optional[str] = None, proxy: Optio
         print(f"[debug] YTDLP_FORCE_CLIENT={force_client}")
 
     if postprocess and ffmpeg_available() and YTDLP_AVAILABLE:
-        opts["postprocessors"] = [{
-            "key": "FFmpegExtractAudio",
-            "preferredcodec": "mp3",
-            "preferredquality": "192",
-            "nopostoverwrites": False,
-        }]
+        pps = output_postprocessors(output)
+        if pps:
+            opts["postprocessors"] = pps
     return opts
 
 def choose_format(info: Dict[str, Any]) -> str:
@@ -271,355 +747,3338 @@ def choose_format(info: Dict[str, Any]) -> str:
     candidates.sort(key=lambda x: x[0], reverse=True)
     return candidates[0][1].get("format_id") or "bestaudio/best"
 
-# --------- Core Download ---------
-def run_download(url: str) -> str:
-    if not YTDLP_AVAILABLE:
-        raise RuntimeError("yt-dlp bulunamadı. Sunucu yöneticisine iletin: pip install -U yt-dlp\nDetay: " + _YTDLP_IMPORT_ERROR)
-    if not url:
-        raise ValueError("URL boş olamaz.")
-    if not is_valid_youtube_url(url):
-        raise ValueError("Geçerli bir YouTube URL'si giriniz.")
+def estimate_output_bytes(info: Dict[str, Any], fmt: str, output: str = DEFAULT_OUTPUT) -> int:
+    """İndirme sırasında diskte gereken yaklaşık alan: kaynak ses + çıktı (MP3/Opus ya da kopya)."""
+    f = next((x for x in info.get("formats") or [] if x.get("format_id") == fmt), None) or {}
+    src = f.get("filesize") or f.get("filesize_approx") or 0
+    if is_encoded(output):
+        return int(src + (info.get("duration") or 0) * output_kbps(output) * 1000 / 8)
+    return int(src * 2 if output == "remux" else src)
 
-    cookie = ensure_cookiefile(refresh=False)
-    cookie_refreshed = False
+def download_from_info(ydl, info: Dict[str, Any], fmt: str) -> None:
+    """Seçilen formatı zaten çıkarılmış info'ya uygular; indirme ve postprocess aynı YoutubeDL
+    üzerinden koşar, webpage/player response ikinci kez istenmez."""
+    ydl.params["format"] = fmt
+    ydl.format_selector = ydl.build_format_selector(fmt)
+    ydl.process_ie_result(info, download=True)
 
-    alternative_strategies = [
-        ("Emergency TV", ["tv"], False, True, 1, {"extractor_args": {"youtube": {"innertube_host": "youtubei.googleapis.com"}}}),
-        ("Web (Bypass)", ["web"], False, True, 2, {"extractor_args": {"youtube": {"skip": ["dash","hls"], "player_skip": ["configs"]}}}),
-        ("Android Testsuite", ["android_testsuite"], False, True, 3, {}),
-        ("iOS Safari", ["ios"], False, True, 4, {}),
-    ]
-    standard_strategies = [
-        ("Smart TV", ["tv"], False, True, 1, {}),
-        ("Android Creator", ["android_creator"], False, True, 2, {}),
-        ("Mobile Web", ["mweb"], False, True, 3, {}),
-        ("PO + Android", ["android"], True, True, 4, {}),
-        ("iOS Music", ["ios_music"], False, True, 5, {}),
-        ("TV Embedded", ["tv_embedded"], False, True, 6, {}),
-        ("Web Creator", ["web_creator"], False, True, 7, {}),
-    ]
-    strategies = alternative_strategies + standard_strategies
+# --------- Output Modes ---------
+# İstek başına çıktı profili ve dönüştürmeden kaçınma. En ucuz yol seçilir: önbellekte uygun dosya
+# varsa o; MP3 istenip yalnızca kaynak/remux dosyası varsa ağa çıkmadan yerelde kodlanır; remux ve
+# source hiç kodlama yapmaz. Kaçınılan kodlamanın CPU maliyeti ölçülen MP3 kodlama hızından
+# (CPU sn / ses sn) tahmin edilip raporlanır.
+TRANSCODE_CPU_PER_AUDIO_S = 0.025  # ölçüm birikene kadar kullanılan tahmin
+REMUX_EXTS = ("m4a", "opus", "ogg")
+SOURCE_EXTS = ("m4a", "webm", "opus", "ogg")
 
-    last_err: Optional[Exception] = None
+transcode_stats: Dict[str, float] = {"transcoded": 0, "avoided": 0, "cpu_s": 0.0, "audio_s": 0.0, "saved_cpu_s": 0.0}
+_transcode_lock = threading.Lock()
 
-    for idx, (name, clients, use_po, aggr, base_delay, extra_opts) in enumerate(strategies, start=1):
-        if idx > 1:
-            delay = base_delay + (idx * 0.6) + random.uniform(0.4, 1.2)
-            time.sleep(delay)
-        try:
-            # Extract
-            opts_info = build_opts(player_clients=clients, cookiefile=cookie, postprocess=False,
-                                   use_po_token=use_po, aggressive_bypass=aggr)
-            for k,v in extra_opts.items():
-                if isinstance(v, dict) and isinstance(opts_info.get(k), dict):
-                    opts_info[k].update(v)
-                else:
-                    opts_info[k] = v
-
-            with YoutubeDL(opts_info) as y1:
-                info = y1.extract_info(url, download=False)
-                if not info:
-                    raise DownloadError("Video metadata extraction failed")
-                if info.get("is_live"):
-                    raise DownloadError("Live streams are not supported")
-                availability = info.get("availability")
-                if availability in {"private","premium_only","subscriber_only","needs_auth","unavailable"}:
-                    raise DownloadError(f"Video is not accessible: {availability}")
-                if info.get("age_limit", 0) > 0 and not cookie:
-                    pass
-                fmt = choose_format(info)
-
-            # Download
-            time.sleep(1.5 + idx*0.2)
-            opts_dl = build_opts(player_clients=clients, cookiefile=cookie, postprocess=True,
-                                 use_po_token=use_po, aggressive_bypass=aggr)
-            for k,v in extra_opts.items():
-                if isinstance(v, dict) and isinstance(opts_dl.get(k), dict):
-                    opts_dl[k].update(v)
-                else:
-                    opts_dl[k] = v
-            opts_dl["format"] = fmt
-
-            files_before = set(os.listdir(DOWNLOAD_DIR)) if os.path.exists(DOWNLOAD_DIR) else set()
-            with YoutubeDL(opts_dl) as y2:
-                y2.download([url])
-            files_after = set(os.listdir(DOWNLOAD_DIR)) if os.path.exists(DOWNLOAD_DIR) else set()
-            new_files = sorted(list(files_after - files_before),
-                               key=lambda f: os.path.getmtime(os.path.join(DOWNLOAD_DIR, f)),
-                               reverse=True)
-            if new_files:
-                return new_files[0]
-
-            # Fallback name
-            title = "".join(c for c in (info.get("title") or "audio") if c.isalnum() or c in " ._-")[:50].strip()
-            ext = "mp3" if ffmpeg_available() else (info.get("ext") or "m4a")
-            return f"{title}.{ext}"
+def parse_output(value: Optional[str] = None, bitrate: Optional[Any] = None) -> str:
+    """"mp3", "mp3-128", "opus-96", "remux", "source" (+ isteğe bağlı bitrate) -> profil anahtarı."""
+    v = (value or "").strip().lower()
+    if not v:
+        v = "mp3" if bitrate else DEFAULT_OUTPUT
+    if v in ("remux", "copy", "passthrough"):
+        return "remux"
+    if v in ("source", "original"):
+        return "source"
+    m = re.fullmatch(r"(mp3|opus)(?:-(\d+)k?)?", v)
+    if not m:
+        raise ValueError(f"Geçersiz çıktı modu: {value} (mp3, opus, remux, source)")
+    codec = m.group(1)
+    rates, default = (MP3_BITRATES, DEFAULT_MP3_BITRATE) if codec == "mp3" else (OPUS_BITRATES, DEFAULT_OPUS_BITRATE)
+    try:
+        kbps = int(str(bitrate or m.group(2) or default).lower().rstrip("k"))
+    except ValueError:
+        kbps = 0
+    if kbps not in rates:
+        raise ValueError(f"Geçersiz {codec.upper()} bit hızı: {bitrate or m.group(2)} "
+                         f"(izinli: {', '.join(map(str, rates))})")
+    return f"{codec}-{kbps}"
 
-        except Exception as e:
-            last_err = e
-            err = str(e).lower()
-            if "failed to extract any player response" in err:
-                if not cookie_refreshed and idx <= 5:
-                    cookie = ensure_cookiefile(refresh=True)
-                    cookie_refreshed = True
-                    time.sleep(8 + idx * 2)
-            elif "sign in to confirm" in err or "bot" in err:
-                if not cookie_refreshed and idx <= 4:
-                    cookie = ensure_cookiefile(refresh=True)
-                    cookie_refreshed = True
-                    time.sleep(6 + random.uniform(1,3))
-            elif any(k in err for k in ["private","unavailable","removed","deleted"]):
-                break
-            elif any(k in err for k in ["rate","limit","quota","too many requests"]):
-                time.sleep(15 + idx*3 + random.uniform(5,10))
-            elif any(k in err for k in ["network","timeout","connection","resolve"]):
-                time.sleep(3 + random.uniform(1,2))
-            continue
+def output_from(data) -> str:
+    """İstek verisinden (form/JSON/query) profil: output|mode + isteğe bağlı bitrate."""
+    return parse_output(data.get("output") or data.get("mode"), data.get("bitrate"))
 
-    # Emergency (multi-client + PO)
-    if YTDLP_AVAILABLE:
-        try:
-            cookie2 = ensure_cookiefile(refresh=True) or cookie
-            opts_e = build_opts(player_clients=["tv","android","mweb"], cookiefile=cookie2, postprocess=False,
-                                use_po_token=True, aggressive_bypass=True)
-            with YoutubeDL(opts_e) as fx:
-                info = fx.extract_info(url, download=False)
-                fmt = choose_format(info) if info else "bestaudio/best"
-            time.sleep(2.0)
-            opts_edl = build_opts(player_clients=["tv","android","mweb"], cookiefile=cookie2, postprocess=True,
-                                  use_po_token=True, aggressive_bypass=True)
-            opts_edl["format"] = fmt
-            before = set(os.listdir(DOWNLOAD_DIR)) if os.path.exists(DOWNLOAD_DIR) else set()
-            with YoutubeDL(opts_edl) as fy:
-                fy.download([url])
-            after = set(os.listdir(DOWNLOAD_DIR)) if os.path.exists(DOWNLOAD_DIR) else set()
-            news = sorted(list(after - before), key=lambda f: os.path.getmtime(os.path.join(DOWNLOAD_DIR, f)), reverse=True)
-            if news:
-                return news[0]
-        except Exception:
-            pass
+def effective_output(output: str) -> str:
+    """ffmpeg yoksa her profil kaynağa düşer."""
+    return output if ffmpeg_available() else "source"
 
-    msg = str(last_err) if last_err else ("yt-dlp eksik" if not YTDLP_AVAILABLE else "Bilinmeyen hata")
-    low = msg.lower()
-    if not YTDLP_AVAILABLE:
-        hint = "\n\n[SETUP] Sunucuda yt-dlp kurulu değil: pip install -U yt-dlp"
-    elif "failed to extract any player response" in low:
-        hint = ("\n\n[FIX] PLAYER RESPONSE ERROR:"
-                "\n• yt-dlp güncelle"
-                "\n• Chrome'dan cookies.txt export edip yükle"
-                "\n• Residential proxy (YTDLP_PROXY)"
-                "\n• PO token (YTDLP_PO_TOKEN + YTDLP_VISITOR_DATA)")
-    elif "bot" in low or "sign in to confirm" in low:
-        hint = "\n\n[BOT] Doğrulama gerekiyor: taze cookies.txt + residential proxy"
-    elif any(k in low for k in ["private","unavailable"]):
-        hint = "\n\n[UNAVAIL] Video özel/kaldırılmış/geo-engelli olabilir."
-    elif any(k in low for k in ["rate","limit","quota"]):
-        hint = "\n\n[RATE] Limit aşıldı. 30-60 dk sonra tekrar deneyin."
-    else:
-        hint = "\n\n[GENERAL] URL/çerez/proxy ayarlarını kontrol edin; tekrar deneyin."
-    raise RuntimeError(f"Tüm bypass stratejileri başarısız. Son hata: {msg}{hint}")
+def is_encoded(output: str) -> bool:
+    """ffmpeg ile yeniden kodlanan profiller (mp3-*, opus-*)."""
+    return output.startswith(("mp3-", "opus-"))
 
-# --------- Flask Routes ---------
-@app.errorhandler(413)
-def too_large(e):
-    return jsonify(error="Dosya çok büyük. Maksimum 16MB."), 413
+def output_kbps(output: str) -> int:
+    return int(output.split("-", 1)[1])
 
-@app.errorhandler(500)
-def internal_error(e):
-    return jsonify(error="Sunucu hatası. Lütfen tekrar deneyin."), 500
+def output_postprocessors(output: str) -> List[Dict[str, Any]]:
+    if output == "source" or output.startswith("opus-"):
+        # Opus yt-dlp'ye bırakılmaz: kaynak zaten opus ise FFmpegExtractAudio akışı kopyalar ve
+        # bitrate uygulanmaz. Kaynak indirilip transcode_file ile kodlanır (bkz. download_and_locate).
+        return []
+    if output == "remux":
+        # "best": m4a/opus/ogg olduğu gibi kalır, webm içindeki opus/vorbis kodlanmadan kopyalanır
+        return [{"key": "FFmpegExtractAudio", "preferredcodec": "best", "nopostoverwrites": False}]
+    codec = output.split("-", 1)[0]
+    return [{"key": "FFmpegExtractAudio", "preferredcodec": codec, "preferredquality": str(output_kbps(output)),
+             "nopostoverwrites": False}]
 
-@app.get("/health")
-def health():
-    return jsonify(
-        ok=True,
-        yt_dlp=YTDLP_AVAILABLE,
-        yt_dlp_error=(None if YTDLP_AVAILABLE else _YTDLP_IMPORT_ERROR),
-        ffmpeg=ffmpeg_available(),
-        download_dir=DOWNLOAD_DIR,
-        proxy=bool(PROXY),
-        disk_free_gb=(shutil.disk_usage(DOWNLOAD_DIR).free // (1024**3)) if os.path.exists(DOWNLOAD_DIR) else 0
-    )
+def output_filename(filename: str, output: str) -> str:
+    """Bitrate'i dosya adına işler: "x [id].mp3" -> "x [id].128k.mp3" (varsayılan MP3 bitrate'i
+    hariç), "x [id].opus" -> "x [id].96k.opus"."""
+    if output.startswith("mp3-") and filename.endswith(".mp3") and output_kbps(output) != DEFAULT_MP3_BITRATE:
+        return f"{filename[:-4]}.{output_kbps(output)}k.mp3"
+    if output.startswith("opus-") and filename.endswith(".opus"):
+        return f"{filename[:-5]}.{output_kbps(output)}k.opus"
+    return filename
 
-@app.get("/cookie_check")
-def cookie_check():
-    path = "/tmp/cookies.txt"
-    if not os.path.exists(path):
-        for sp in ["/etc/secrets/cookies.txt","/etc/secrets/COOKIES.txt","/etc/secrets/youtube-cookies.txt","/app/cookies.txt","./cookies.txt"]:
-            if os.path.exists(sp):
-                try: shutil.copyfile(sp, path); break
-                except Exception as e: print(f"[cookie] copy failed {sp}: {e}")
-    if not os.path.exists(path):
-        return jsonify(ok=False, reason="cookies.txt yok"), 404
+def output_kinds(output: str) -> List[str]:
+    """Profili karşılayan önbellek türleri, tercih sırasıyla."""
+    if is_encoded(output):
+        return [output] if ffmpeg_available() else [output] + list(SOURCE_EXTS)
+    return list(REMUX_EXTS if output == "remux" else SOURCE_EXTS)
+
+def children_cpu() -> float:
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime
+
+def mp3_cpu_per_audio_s() -> float:
+    with _transcode_lock:
+        if transcode_stats["audio_s"] >= 60:
+            return transcode_stats["cpu_s"] / transcode_stats["audio_s"]
+    return TRANSCODE_CPU_PER_AUDIO_S
+
+def record_output(output: str, duration: float, cpu_s: float) -> float:
+    """Bir çıktının kodlama maliyetini kaydeder; kaçınılan CPU saniyesini döner."""
+    if is_encoded(output):
+        with _transcode_lock:
+            transcode_stats["transcoded"] += 1
+            transcode_stats["cpu_s"] += cpu_s
+            transcode_stats["audio_s"] += duration
+        metrics.inc("ytmp3_transcode_cpu_seconds_total", cpu_s, output=output)
+        return 0.0
+    if not ffmpeg_available():
+        return 0.0  # kodlama zaten mümkün değildi; tasarruf sayılmaz
+    saved = max(0.0, duration * mp3_cpu_per_audio_s() - cpu_s)
+    with _transcode_lock:
+        transcode_stats["avoided"] += 1
+        transcode_stats["saved_cpu_s"] += saved
+    metrics.inc("ytmp3_transcode_cpu_saved_seconds_total", saved, output=output)
+    return saved
+
+def wait_child(proc: subprocess.Popen, job: Optional["Job"] = None) -> float:
+    """Alt süreci iptali gözeterek bekler, returncode'u ayarlar ve CPU süresini (sn) döner. gthread
+    modunda wait4 ile süreç başına tam ölçülür; gevent çocukları SIGCHLD'de kendisi topladığından
+    (wait4 ECHILD verir) orada RUSAGE_CHILDREN farkı kullanılır, eşzamanlı kodlamalarda yaklaşıktır."""
+    if GREEN:
+        c0 = children_cpu()
+        while proc.poll() is None:
+            job_checkpoint(job)
+            time.sleep(0.2)
+        return max(0.0, children_cpu() - c0)
+    while True:
+        pid, status, ru = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            return ru.ru_utime + ru.ru_stime
+        job_checkpoint(job)
+        time.sleep(0.2)
+
+ENCODERS = {"mp3": ("libmp3lame", "mp3"), "opus": ("libopus", "opus")}  # codec -> (ffmpeg kodlayıcı, muxer)
+
+def claim_renditions(video_id: Optional[str], output: str) -> Dict[str, "_Flight"]:
+    """RENDITIONS'tan önbellekte olmayan ve başka bir işte kodlanmayan profilleri bu geçiş için
+    _inflight'a yazar; aynı anda gelen istekler yeni indirme başlatmak yerine bu geçişi bekler."""
+    claimed: Dict[str, _Flight] = {}
+    if not video_id or not ffmpeg_available():
+        return claimed
+    for r in RENDITIONS:
+        if r == output:
+            continue
+        with _cache_lock:
+            fn = result_cache.get(video_id, {}).get(r)
+            if f"{video_id}:{r}" in _inflight or (fn and fn in file_index):
+                continue
+            claimed[r] = _inflight[f"{video_id}:{r}"] = _Flight()
+    return claimed
+
+def release_renditions(video_id: Optional[str], extras: Dict[str, "_Flight"], error: BaseException) -> None:
+    """Kodlama geçişine ulaşamayan (kaynak inmedi, iş iptal edildi) talepleri bırakır; bekleyenler uyanır."""
+    for o, flight in extras.items():
+        if not flight.done.is_set():
+            _land_flight(f"{video_id}:{o}", flight, video_id, error=error)
+
+def transcode_file(src_filename: str, output: str, job: Optional["Job"] = None,
+                   extras: Optional[Dict[str, "_Flight"]] = None) -> str:
+    """Önbellekteki kaynak/remux dosyasından ağa çıkmadan istenen profili üretir; RENDITIONS'ta
+    eksik olan profiller (extras: çağıran kaynak inmeden önce talep ettiyse) de aynı ffmpeg
+    sürecinde kodlanır, kaynak bir kez çözülür. ffmpeg'in CPU süresi wait_child ile ölçülüp
+    çıktılara bölünür; iptalde süreç öldürülür."""
+    parsed = _cache_kind(src_filename)
+    video_id = parsed[0] if parsed else None
+    if extras is None:
+        extras = claim_renditions(video_id, output)
+    base = src_filename.rsplit(".", 1)[0]
+    targets = {o: output_filename(f"{base}.{o.split('-', 1)[0]}", o) for o in [output, *extras]}
+    src = os.path.join(DOWNLOAD_DIR, src_filename)
+    tag = uuid.uuid4().hex[:8]
+    parts = {o: os.path.join(DOWNLOAD_DIR, f"{t}.{tag}.part") for o, t in targets.items()}
+    cmd = [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-nostdin", "-y", "-i", src]
+    for o, part in parts.items():
+        encoder, muxer = ENCODERS[o.split("-", 1)[0]]
+        cmd += ["-map", "0:a:0", "-vn", "-c:a", encoder, "-b:a", f"{output_kbps(o)}k", "-f", muxer, part]
+    proc = None
+    # stderr geçici dosyaya: boru tamponu dolup ffmpeg bloklanmasın (wait_child çıkışı bekler, okumaz)
+    errlog = tempfile.TemporaryFile()
     try:
-        lines = []
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#"):
-                    lines.append(line)
-        keys_present = set(); youtube_lines = 0
-        for line in lines:
-            parts = line.split('\t')
-            if len(parts) >= 7:
-                domain = parts[0]; cname = parts[5]
-                if "youtube.com" in domain or ".youtube." in domain:
-                    youtube_lines += 1; keys_present.add(cname)
-        required = {"SID","__Secure-3PSID","SAPISID","APISID","HSID","SSID"}
-        important = {"CONSENT","VISITOR_INFO1_LIVE","YSC"}
-        return jsonify(
-            ok=True,
-            total_lines=len(lines),
-            youtube_domain_lines=youtube_lines,
-            required_found=sorted(list(required & keys_present)),
-            important_found=sorted(list(important & keys_present)),
-            missing_required=sorted(list(required - keys_present)),
-            missing_important=sorted(list(important - keys_present)),
-            file_size_bytes=os.path.getsize(path)
-        )
-    except Exception as e:
-        return jsonify(ok=False, reason=f"Cookie dosyası okunamıyor: {e}"), 500
+        reserve_space(os.path.getsize(src) * (len(targets) + 1))
+        job_event(job, "postprocess", postprocessor="ffmpeg", status="started", source=src_filename,
+                  outputs=list(targets))
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=errlog)
+        cpu = wait_child(proc, job)
+        if proc.returncode != 0:
+            errlog.seek(max(0, errlog.seek(0, os.SEEK_END) - 300))  # son satırlar asıl hatayı taşır
+            raise RuntimeError(f"ffmpeg dönüştürme hatası: {errlog.read().decode(errors='ignore').strip()}")
+        for o, part in parts.items():
+            os.replace(part, os.path.join(DOWNLOAD_DIR, targets[o]))
+    except BaseException as e:
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+            proc.wait()
+        for part in parts.values():
+            try: os.remove(part)
+            except OSError: pass
+        release_renditions(video_id, extras, e)
+        raise
+    finally:
+        errlog.close()
+    metrics.observe("ytmp3_stage_seconds", time.perf_counter() - t0, stage="postprocess")
+    share = cpu / len(targets)  # tek kod çözme; CPU çıktılara eşit bölünür
+    for o, target in targets.items():
+        entry = index_file(target)
+        record_output(o, (entry["size"] * 8 / (output_kbps(o) * 1000)) if entry else 0.0, share)
+    for o, flight in extras.items():
+        metrics.inc("ytmp3_renditions_total", output=o)
+        _land_flight(f"{video_id}:{o}", flight, video_id, result=targets[o])
+    job_event(job, "output", output=output, transcoded=True, local=True, renditions=list(extras),
+              cpu_s=round(cpu, 2), cpu_saved_s=0.0)
+    print(f"[output] {src_filename} -> {', '.join(targets.values())} ({cpu:.1f} CPU-s, one decode, no network)")
+    return targets[output]
 
-@app.route("/", methods=["GET","POST"])
-def index():
-    yt_note = ""
-    if not YTDLP_AVAILABLE:
-        yt_note = "<div class='msg err'>⚠️ Sunucuda yt-dlp kurulu değil. Yöneticiye iletin: <code>pip install -U yt-dlp</code></div>"
-    content_shell = HTML_SHELL.format(yt_note=yt_note)
+# --------- Transcode Pool ---------
+# MP3 kodlaması indirme iş parçacıklarından ayrılmıştır: indirme aşaması kaynak sesi (kodlamasız)
+# indirip dosyayı bu havuza bırakır ve bir sonraki işe geçer; ağ beklemesi ile kodlama üst üste
+# biner. Havuz TRANSCODE_WORKERS tane ffmpeg sürecini aynı anda koşturur (libmp3lame tek
+# çekirdek kullanır). Öncelik kısa kliplerdir; uzun bir dosya beklediği süre ölçüsünde öne geçer,
+# aç kalmaz. Kuyruk doluysa indirme aşaması bekler (backpressure), böylece diske dönüştürülmemiş
+# dosya yığılmaz.
+class _TranscodeTask:
+    def __init__(self, src: str, output: str, job: Optional["Job"], audio_s: float,
+                 extras: Optional[Dict[str, "_Flight"]] = None):
+        self.src, self.output, self.job, self.audio_s, self.extras = src, output, job, audio_s, extras
+        self.submitted = time.perf_counter()
+        self.future: Future = Future()
 
-    if request.method == "POST":
-        client_ip = request.environ.get('HTTP_X_FORWARDED_FOR',
-                        request.environ.get('HTTP_X_REAL_IP', request.remote_addr))
-        if not check_rate_limit(client_ip):
-            msg_html = '<div class="msg err">⏳ Rate limit aşıldı. 10 dakika içinde en fazla 3 indirme.</div>'
-            content = FORM_CONTENT.format(url="", msg_block=msg_html)
-            return render_template_string(content_shell.replace("<!--CONTENT-->", content)), 429
+class TranscodePool:
+    def __init__(self, workers: int, depth: int):
+        self.workers, self.depth = workers, depth
+        self._heap: List[Tuple[float, int, _TranscodeTask]] = []
+        self._seq = 0
+        self._running = 0
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
 
-        url = (request.form.get("url") or "").strip()
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0 and ffmpeg_available()
+
+    def _start(self) -> None:
+        # Lazy: gunicorn fork'undan sonra, ilk görev geldiğinde başlar.
+        self._threads[:] = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.workers:
+            t = threading.Thread(target=self._worker, name=f"transcode-{len(self._threads)}", daemon=True)
+            t.start()
+            self._threads.append(t)
 
-        uploaded = request.files.get("cookies")
-        if uploaded and uploaded.filename:
+    def submit(self, src_filename: str, output: str, job: Optional["Job"] = None,
+               extras: Optional[Dict[str, "_Flight"]] = None) -> Future:
+        """Dosyayı kodlama kuyruğuna ekler; kuyruk doluysa yer açılana kadar bekler.
+        Sonuç dosya adını taşıyan bir Future döner."""
+        entry = lookup_file(src_filename, touch=False)
+        audio_s = (entry["size"] / 16000) if entry else 0.0  # ~128 kbps kaynak varsayımı
+        task = _TranscodeTask(src_filename, output, job, audio_s, extras)
+        pin_file(src_filename)  # kuyrukta beklerken kota/TTL ile silinmesin
+        task.future.add_done_callback(lambda f: unpin_file(src_filename))
+        t0 = time.perf_counter()
+        with self._cond:
+            self._start()
             try:
-                data = uploaded.read()
-                if len(data) > 1024*1024:
-                    raise ValueError("Cookie dosyası 1MB'den büyük")
-                with open("/tmp/cookies.txt","wb") as f: f.write(data)
-            except Exception as e:
-                msg_html = f'<div class="msg err">❌ Cookie hatası: {e}</div>'
-                content = FORM_CONTENT.format(url=url, msg_block=msg_html)
-                return render_template_string(content_shell.replace("<!--CONTENT-->", content)), 400
+                while len(self._heap) >= self.depth:
+                    job_checkpoint(job)
+                    self._cond.wait(0.5)
+            except BaseException as e:
+                task.future.set_exception(e)  # pin'i bırakır
+                raise
+            self._seq += 1
+            # kısa-iş-önce + yaşlanma: tahmini CPU saniyesi, o kadar kat geç gelmiş sayılır
+            key = task.submitted + audio_s * mp3_cpu_per_audio_s() * TRANSCODE_SHORT_FIRST
+            heapq.heappush(self._heap, (key, self._seq, task))
+            self._cond.notify_all()
+        if time.perf_counter() - t0 > 0.01:
+            metrics.observe("ytmp3_stage_seconds", time.perf_counter() - t0, stage="transcode_backpressure")
+        job_event(job, "transcode", status="queued", source=src_filename, queued=len(self._heap))
+        return task.future
+
+    def _fail_cancelled(self) -> None:
+        """Kuyrukta beklerken iptal edilen/süresi dolan işlerin görevlerini hemen düşürür."""
+        keep = []
+        for item in self._heap:
+            try:
+                job_checkpoint(item[2].job)
+                keep.append(item)
+            except JobCancelled as e:
+                item[2].future.set_exception(e)
+                metrics.inc("ytmp3_transcode_pool_total", result="cancelled")
+        if len(keep) != len(self._heap):
+            heapq.heapify(keep)
+            self._heap = keep
+            self._cond.notify_all()
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    self._fail_cancelled()
+                    if self._heap:
+                        break
+                    self._cond.wait(1.0)
+                task = heapq.heappop(self._heap)[2]
+                self._running += 1
+                self._cond.notify_all()
+            metrics.observe("ytmp3_stage_seconds", time.perf_counter() - task.submitted, stage="transcode_wait")
+            try:
+                task.future.set_result(transcode_file(task.src, task.output, task.job, task.extras))
+                metrics.inc("ytmp3_transcode_pool_total", result="ok")
+            except BaseException as e:
+                task.future.set_exception(e)
+                metrics.inc("ytmp3_transcode_pool_total",
+                            result="cancelled" if isinstance(e, JobCancelled) else "error")
+            finally:
+                with self._cond:
+                    self._running -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {"workers": self.workers, "queue_depth": self.depth, "queued": len(self._heap),
+                    "running": self._running, "enabled": self.enabled}
+
+transcode_pool = TranscodePool(TRANSCODE_WORKERS, TRANSCODE_QUEUE_DEPTH)
+
+# --------- Job Queue ---------
+class JobCancelled(Exception):
+    """İş kullanıcı tarafından iptal edildi."""
+
+class JobTimeout(JobCancelled):
+    """İş JOB_TIMEOUT süresini aştı."""
+
+class JobQueueFull(RuntimeError):
+    """Kuyruk JOB_QUEUE_DEPTH sınırında."""
+
+class Job:
+    """Kuyruktaki tek bir indirme işi. İptal/timeout kooperatiftir: strateji sınırlarında,
+    backoff beklemelerinde ve yt-dlp progress hook'larında kontrol edilir."""
+
+    def __init__(self, fn, args: tuple, kwargs: Dict[str, Any], timeout: float = JOB_TIMEOUT,
+                 parent: Optional["Job"] = None, cookies: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+        self.timeout = timeout
+        self.parent = parent                # toplu işin öğesiyse üst iş
+        self.cookies = cookies              # yüklenen çerez metni; yalnızca bu iş (ve öğeleri) kullanır
+        self.children: List["Job"] = []     # toplu işin öğeleri
+        self.executor: Optional[ThreadPoolExecutor] = None  # toplu iş öğesinin koştuğu havuz (park dönüşü)
+        self.requeue_tries = 0              # park dönüşünde kuyruk dolu bulunma sayısı
+        self.state = "queued"  # queued | running | done | error | cancelled | timeout
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.result: Optional[str] = None
+        self.error: Optional[str] = None
+        self.cancel_event = threading.Event()
+        self.completion: Future = Future()  # iş bitince son durumla çözülür
+        self.progress: Dict[str, Any] = {}
+        self.events: "deque[Dict[str, Any]]" = deque(maxlen=JOB_EVENT_BUFFER)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._last_progress_emit = 0.0
+        self.emit("state", state=self.state)
+
+    @property
+    def terminal(self) -> bool:
+        return self.state not in ("queued", "running")
+
+    @property
+    def is_batch(self) -> bool:
+        return self.fn is run_batch
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def cancel(self) -> None:
+        self.cancel_event.set()
+        for child in list(self.children):
+            child.cancel()
+
+    def emit(self, kind: str, **data) -> None:
+        with self._cond:
+            self._seq += 1
+            event = {"seq": self._seq, "type": kind, "ts": time.time(), **data}
+            self.events.append(event)
+            if kind != "state":
+                self.progress = {**self.progress, "phase": kind, **data}
+            self._cond.notify_all()
+
+    def events_since(self, seq: int, timeout: float) -> List[Dict[str, Any]]:
+        with self._cond:
+            if self._seq <= seq and not self.terminal:
+                self._cond.wait(timeout)
+            return [e for e in self.events if e["seq"] > seq]
+
+    def on_progress(self, d: Dict[str, Any]) -> None:
+        self.checkpoint()
+        now = time.time()
+        status = d.get("status")
+        if status == "downloading" and now - self._last_progress_emit < 0.5:
+            return
+        self._last_progress_emit = now
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        done_bytes = d.get("downloaded_bytes") or 0
+        self.emit("download", status=status, downloaded_bytes=done_bytes, total_bytes=total,
+                  percent=round(100.0 * done_bytes / total, 1) if total else None,
+                  speed=d.get("speed"), eta=d.get("eta"))
+
+    def on_postprocess(self, d: Dict[str, Any]) -> None:
+        self.emit("postprocess", postprocessor=d.get("postprocessor"), status=d.get("status"))
+
+    def checkpoint(self) -> None:
+        if self.cancel_event.is_set():
+            raise JobCancelled("İş iptal edildi.")
+        if self.started and self.timeout and time.time() - self.started > self.timeout:
+            raise JobTimeout(f"İş {int(self.timeout)} sn içinde tamamlanamadı.")
+        if self.parent is not None:
+            self.parent.checkpoint()  # toplu işin kendi süre sınırı
+
+    def sleep(self, seconds: float) -> None:
+        end = time.time() + seconds
+        while True:
+            self.checkpoint()
+            remaining = end - time.time()
+            if remaining <= 0:
+                return
+            if self.started and self.timeout:
+                remaining = min(remaining, self.started + self.timeout - time.time() + 0.05)
+            self.cancel_event.wait(max(remaining, 0.0))
+
+    def to_dict(self) -> Dict[str, Any]:
+        d: Dict[str, Any] = {
+            "id": self.id,
+            "state": self.state,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "elapsed": ((self.finished or time.time()) - self.started) if self.started else 0.0,
+            "error": self.error,
+            "cancel_requested": self.cancel_event.is_set(),
+            "progress": self.progress,
+        }
+        if self.state == "queued":
+            d["position"] = job_queue_position(self)
+        if self.state == "done" and self.result:
+            d["filename"] = self.result
+            d["download_url"] = url_for("download", filename=self.result)
+        if self.is_batch:
+            d["items"] = [{"id": c.id, "url": c.args[0], "state": c.state, "filename": c.result,
+                           "error": c.error} for c in self.children]
+            d["zip_url"] = url_for("job_zip", job_id=self.id)
+        return d
+
+def job_sleep(job: Optional[Job], seconds: float) -> None:
+    """time.sleep yerine: iş iptal edilirse/süresi dolarsa hemen uyanır."""
+    with timed("backoff"):
+        if job is None:
+            time.sleep(seconds)
+        else:
+            job.sleep(seconds)
+
+def job_checkpoint(job: Optional[Job]) -> None:
+    if job is not None:
+        job.checkpoint()
+
+def job_event(job: Optional[Job], kind: str, **data) -> None:
+    if job is not None:
+        job.emit(kind, **data)
+
+def attach_job(opts: Dict[str, Any], job: Optional[Job]) -> Dict[str, Any]:
+    """yt-dlp hook'larını işe bağlar: ilerleme/ffmpeg olayları yayınlanır, iptal/timeout
+    indirmenin ortasında da uygulanır."""
+    if job is not None:
+        opts.setdefault("progress_hooks", []).append(job.on_progress)
+        opts.setdefault("postprocessor_hooks", []).append(job.on_postprocess)
+    return opts
+
+jobs: Dict[str, Job] = {}
+_jobs_lock = threading.Lock()
+_job_queue: "queue.Queue[Job]" = queue.Queue(maxsize=JOB_QUEUE_DEPTH)
+_job_threads: List[threading.Thread] = []
+
+def _finish_job(job: Job, result: Optional[str] = None, error: Optional[BaseException] = None) -> None:
+    if error is None:
+        job.result, job.state = result, "done"
+    elif isinstance(error, JobTimeout):
+        job.state, job.error = "timeout", str(error)
+    elif isinstance(error, JobCancelled):
+        job.state, job.error = "cancelled", str(error)
+    else:
+        job.state, job.error = "error", str(error)
+    job.finished = time.time()
+    journal.finish(job)
+    job.emit("state", state=job.state, error=job.error, filename=job.result)
+    metrics.inc("ytmp3_jobs_total", state=job.state, kind="batch" if job.is_batch else "single")
+    metrics.observe("ytmp3_stage_seconds", job.finished - job.started, stage="job")
+    print(f"[job] {job.id[:8]} {job.state} in {job.finished - job.started:.1f}s")
+    job.completion.set_result(job.state)
+
+def _run_job(job: Job) -> None:
+    """İşi çalıştırır. İş fonksiyonu bir Future dönerse (ör. kodlama havuzuna devredilen MP3)
+    iş o Future çözülünce biter; çağıran iş parçacığı beklemeden bir sonraki işe geçer."""
+    if job.cancel_event.is_set():
+        job.state, job.finished = "cancelled", time.time()
+        journal.finish(job)
+        job.emit("state", state=job.state)
+        job.completion.set_result(job.state)
+        return
+    if job.started is None:  # park dönüşünde süre sınırı baştan başlamaz
+        job.started = time.time()
+        metrics.observe("ytmp3_stage_seconds", job.started - job.created, stage="queue_wait")
+    job.state = "running"
+    job.emit("state", state=job.state)
+    try:
+        result = job.fn(*job.args, job=job, **job.kwargs)
+    except JobParked as e:
+        park_job(job, e.delay)
+        return
+    except Exception as e:
+        _finish_job(job, error=e)
+        return
+    if isinstance(result, Future):
+        result.add_done_callback(lambda f: _finish_job(job, None if f.exception() else f.result(), f.exception()))
+    else:
+        _finish_job(job, result)
 
+def _job_worker() -> None:
+    while True:
+        job = _job_queue.get()
         try:
-            filename = run_download(url)
-            return redirect(url_for("done", filename=filename))
+            _run_job(job)
         except Exception as e:
-            msg = str(e)
-            if len(msg) > 500: msg = msg[:497] + "..."
-            msg_html = f'<div class="msg err">❌ İndirme Hatası: {msg}</div>'
-            content = FORM_CONTENT.format(url=url, msg_block=msg_html)
-            return render_template_string(content_shell.replace("<!--CONTENT-->", content)), 400
+            print(f"[job] worker error: {e}")
+        finally:
+            _job_queue.task_done()
 
-    content = FORM_CONTENT.format(url="", msg_block="")
-    return render_template_string(HTML_SHELL.format(yt_note="")\
-                                  .replace("<!--CONTENT-->", content))
+# Park edilen işler: uyanma zamanına göre heap; "job-parker" vakti gelen (ya da beklerken iptal
+# edilen / süresi dolan) işleri kuyruğa geri koyar. Park süresince hiçbir iş parçacığı tutulmaz.
+# Toplu iş öğeleri ana kuyruğa değil kendi toplu işinin havuzuna döner (JOB_WORKERS'tan yer almaz);
+# ana kuyruk doluysa parker beklemez, iş artan aralıklarla (en fazla 30 sn) yeniden park edilir.
+_parked: List[Tuple[float, int, Job]] = []
+_parked_cond = threading.Condition()
+_parked_seq = 0
+_parker_threads: List[threading.Thread] = []
 
-@app.get("/done")
-def done():
-    filename = request.args.get("filename")
-    if not filename:
-        return redirect(url_for("index"))
-    file_path = os.path.join(DOWNLOAD_DIR, filename)
-    if not os.path.exists(file_path):
-        msg_html = '<div class="msg err">❌ Dosya bulunamadı. Lütfen tekrar indirin.</div>'
-        content = FORM_CONTENT.format(url="", msg_block=msg_html)
-        return render_template_string(HTML_SHELL.format(yt_note="").replace("<!--CONTENT-->", content)), 404
-    safe_filename = filename.replace("'", "\\'").replace('"','\\"')
-    content = DONE_CONTENT.format(filename=safe_filename)
-    return HTML_SHELL.format(yt_note="").replace("<!--CONTENT-->", content)
+def park_job(job: Job, delay: float) -> None:
+    wake = time.time() + delay
+    job.emit("parked", delay=round(delay, 1), until=wake)
+    with _parked_cond:
+        _push_parked(wake, job)
+        _parked_cond.notify()
+        _parker_threads[:] = [t for t in _parker_threads if t.is_alive()]
+        if not _parker_threads:
+            t = threading.Thread(target=_parker, name="job-parker", daemon=True)
+            t.start()
+            _parker_threads.append(t)
+    print(f"[job] {job.id[:8]} parked for {delay:.1f}s")
 
-@app.route("/download/<path:filename>")
-def download(filename):
-    if ".." in filename or "/" in filename or "\\" in filename:
-        return "Geçersiz dosya adı", 400
-    fp = os.path.join(DOWNLOAD_DIR, filename)
-    if not os.path.exists(fp): return "Dosya bulunamadı", 404
-    if not os.path.isfile(fp): return "Geçersiz dosya", 400
+def _park_interrupted(job: Job) -> bool:
     try:
-        return send_from_directory(DOWNLOAD_DIR, filename, as_attachment=True)
-    except Exception as e:
-        return "Dosya indirilemedi", 500
+        job.checkpoint()
+        return False
+    except JobCancelled:
+        return True
 
-# Force route (manuel client test)
-def run_download_with_clients(url: str, clients: List[str], *, use_po_token: bool = False, aggressive_bypass: bool = True) -> str:
-    if not YTDLP_AVAILABLE:
-        raise RuntimeError("yt-dlp eksik. 'pip install -U yt-dlp'")
-    if not is_valid_youtube_url(url):
-        raise ValueError("Geçerli bir YouTube URL'si giriniz.")
-    cookie = ensure_cookiefile(refresh=False)
-    from yt_dlp import YoutubeDL
-    from yt_dlp.utils import DownloadError
-    opts_info = build_opts(player_clients=clients, cookiefile=cookie, postprocess=False,
-                           use_po_token=use_po_token, aggressive_bypass=aggressive_bypass)
-    with YoutubeDL(opts_info) as y1:
-        info = y1.extract_info(url, download=False)
-        if not info: raise DownloadError("Video metadata extraction failed")
-        if info.get("is_live"): raise DownloadError("Live streams are not supported")
-        fmt = choose_format(info)
-    time.sleep(1.5)
-    opts_dl = build_opts(player_clients=clients, cookiefile=cookie, postprocess=True,
-                         use_po_token=use_po_token, aggressive_bypass=aggressive_bypass)
-    opts_dl["format"] = fmt
-    before = set(os.listdir(DOWNLOAD_DIR)) if os.path.exists(DOWNLOAD_DIR) else set()
-    with YoutubeDL(opts_dl) as y2:
-        y2.download([url])
-    after = set(os.listdir(DOWNLOAD_DIR)) if os.path.exists(DOWNLOAD_DIR) else set()
-    news = sorted(list(after - before), key=lambda f: os.path.getmtime(os.path.join(DOWNLOAD_DIR, f)), reverse=True)
-    if news: return news[0]
-    title = "".join(c for c in (info.get("title") or "audio") if c.isalnum() or c in " ._-")[:50].strip()
-    ext = "mp3" if ffmpeg_available() else (info.get("ext") or "m4a")
-    return f"{title}.{ext}"
+def _parker() -> None:
+    while True:
+        with _parked_cond:
+            now = time.time()
+            due = [item for item in _parked if item[0] <= now or _park_interrupted(item[2])]
+            for item in due:
+                _parked.remove(item)
+            heapq.heapify(_parked)
+            if not due:
+                _parked_cond.wait(min(1.0, _parked[0][0] - now) if _parked else 1.0)
+                continue
+        retry = [job for _, _, job in due if not _requeue(job)]
+        if retry:
+            with _parked_cond:
+                for job in retry:
+                    job.requeue_tries += 1
+                    _push_parked(time.time() + min(30.0, 0.5 * 2 ** job.requeue_tries), job)
+            metrics.inc("ytmp3_job_requeue_full_total", len(retry))
 
-@app.get("/force")
-def force():
-    url = (request.args.get("url") or "").strip()
-    if not url:
-        return jsonify(ok=False, error="url parametresi gerekli"), 400
-    clients = [c.strip() for c in (request.args.get("clients","tv").split(",")) if c.strip()]
-    use_po = (request.args.get("po","0").lower() in ("1","true","yes","on"))
-    aggr = (request.args.get("aggr","1").lower() in ("1","true","yes","on"))
+def _push_parked(wake: float, job: Job) -> None:
+    global _parked_seq
+    _parked_seq += 1
+    heapq.heappush(_parked, (wake, _parked_seq, job))
+
+def _requeue(job: Job) -> bool:
+    """Parktan dönen işi bloklamadan yeniden çalıştırır; ana kuyruk doluysa False."""
+    if job.executor is not None:
+        try:
+            job.executor.submit(_run_job, job)
+            return True
+        except RuntimeError:
+            job.executor = None  # toplu iş havuzu kapanmış; ana kuyruğa düşer
     try:
-        filename = run_download_with_clients(url, clients, use_po_token=use_po, aggressive_bypass=aggr)
-        return redirect(url_for("done", filename=filename))
-    except Exception as e:
-        return jsonify(ok=False, error=str(e)), 400
+        _job_queue.put_nowait(job)
+    except queue.Full:
+        return False
+    job.requeue_tries = 0
+    return True
 
-# Background cleanup
-def background_cleanup():
-    import threading, atexit
-    def worker():
-        while True:
-            try:
-                now = time.time(); cleaned = 0
-                if os.path.exists(DOWNLOAD_DIR):
-                    for fn in os.listdir(DOWNLOAD_DIR):
-                        fp = os.path.join(DOWNLOAD_DIR, fn)
-                        if os.path.isfile(fp) and now - os.path.getmtime(fp) > 7200:
-                            try: os.remove(fp); cleaned += 1
-                            except Exception: pass
-                time.sleep(1800)
-            except Exception:
-                time.sleep(1800)
-    threading.Thread(target=worker, daemon=True).start()
-    atexit.register(lambda: None)
-background_cleanup()
+def start_job_workers() -> None:
+    # Lazy: gunicorn fork'undan sonra, ilk iş geldiğinde başlar.
+    with _jobs_lock:
+        _job_threads[:] = [t for t in _job_threads if t.is_alive()]
+        while len(_job_threads) < JOB_WORKERS:
+            t = threading.Thread(target=_job_worker, name=f"job-worker-{len(_job_threads)}", daemon=True)
+            t.start()
+            _job_threads.append(t)
+
+def prune_jobs() -> None:
+    now = time.time()
+    with _jobs_lock:
+        for jid in [jid for jid, j in jobs.items() if j.finished and now - j.finished > JOB_TTL]:
+            jobs.pop(jid, None)
+
+def submit_job(fn, *args, job_timeout: float = JOB_TIMEOUT, cookies: Optional[str] = None, **kwargs) -> Job:
+    start_job_workers()
+    prune_jobs()
+    job = Job(fn, args, kwargs, timeout=job_timeout, cookies=cookies)
+    with _jobs_lock:
+        jobs[job.id] = job
+    journal.add(job)
+    try:
+        _job_queue.put_nowait(job)
+    except queue.Full:
+        with _jobs_lock:
+            jobs.pop(job.id, None)
+        journal.finish(job)
+        raise JobQueueFull(f"Sunucu meşgul: kuyrukta {JOB_QUEUE_DEPTH} iş var. Biraz sonra tekrar deneyin.")
+    return job
+
+def get_job(job_id: str) -> Optional[Job]:
+    with _jobs_lock:
+        return jobs.get(job_id)
+
+def job_queue_position(job: Job) -> int:
+    # gevent modunda queue.Queue mutex'siz gevent kuyruğudur; greenlet'ler arasında kopya zaten atomik.
+    with getattr(_job_queue, "mutex", None) or nullcontext():
+        pending = list(_job_queue.queue)
+    for pos, j in enumerate(pending, start=1):
+        if j is job:
+            return pos
+    return 0
+
+def job_stats() -> Dict[str, Any]:
+    with _jobs_lock:
+        states = [j.state for j in jobs.values()]
+    with _parked_cond:
+        parked = len(_parked)
+    return {
+        "workers": JOB_WORKERS,
+        "queue_depth": JOB_QUEUE_DEPTH,
+        "queued": _job_queue.qsize(),
+        "running": states.count("running") - parked,
+        "parked": parked,
+        "tracked": len(states),
+    }
+
+# --------- Job Journal ---------
+# Bitmemiş işler ve yarım indirmeler kalıcı diskte bir SQLite günlüğünde tutulur; restart/deploy
+# sonrası sahibi ölmüş kayıtlar devralınır. İşler aynı ID ile kuyruğa döner; aynı video ve format
+# indirilirken ölü sürecin çalışma dizini (.dl-XXXX, içinde yt-dlp'nin .part dosyası) yeniden
+# kullanılır, yt-dlp HTTP Range ile kaldığı yerden devam eder. Devralınmayan çalışma dizinleri
+# hemen silinir. Sahiplik: her süreç kendi kilit dosyasını flock ile tutar; kilit alınabiliyorsa
+# sahibi ölmüştür. Yüklenen çerezle gelen işler (çerez diske yazılmaz) günlüğe girmez.
+_journal_db = os.environ.get("JOB_JOURNAL_DB", os.path.join(DOWNLOAD_DIR, ".jobs.sqlite3")).strip()
+JOB_JOURNAL_DB = None if _journal_db.lower() in ("", "0", "off", "false", "no") else _journal_db
+JOB_JOURNAL_LOCKS = os.path.join(DOWNLOAD_DIR, ".journal")
+JOURNAL_KINDS = ("cached_download", "run_batch", "run_download_with_clients")  # devam ettirilebilen iş türleri
+ORPHAN_GRACE = 60.0        # sn; günlüğe yazılmamış çalışma dizini bu kadar eskiyse sahipsizdir
+ORPHAN_PART_GRACE = 600.0  # sn; kök dizindeki ffmpeg .part çıktıları (devam ettirilemez) için
+
+class JobJournal(LocalSQLite):
+    """jobs: bitmemiş üst düzey işler (tür, argümanlar, URL, video ID). partials: indirme çalışma
+    dizinleri (kök iş, video ID, format, strateji). Veritabanı hataları loglanır, işi durdurmaz."""
+
+    def __init__(self, path: Optional[str], lock_dir: str):
+        super().__init__(path or "")
+        self.enabled = bool(path)
+        self.lock_dir = lock_dir
+        self.resumed = 0
+        self._owner: Optional[Tuple[int, str, int]] = None  # (pid, belirteç, kilit fd)
+        self._owner_lock = threading.Lock()
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(lock_dir, exist_ok=True)
+            db = self._db()
+            db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT NOT NULL, "
+                       "payload TEXT NOT NULL, url TEXT, video_id TEXT, output TEXT, owner TEXT, "
+                       "created REAL NOT NULL, updated REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS partials (workdir TEXT PRIMARY KEY, root_id TEXT, "
+                       "url TEXT, video_id TEXT, fmt TEXT, strategy TEXT, owner TEXT, updated REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS partials_video ON partials (video_id, fmt)")
+        except (OSError, sqlite3.Error) as e:
+            print(f"[journal] unavailable ({e}); jobs will not survive restarts")
+            self.enabled = False
+
+    def _run(self, sql: str, params: tuple = ()) -> Optional[sqlite3.Cursor]:
+        try:
+            return self._db().execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"[journal] db error: {e}")
+            return None
+
+    def owner(self) -> str:
+        """Bu sürecin sahiplik belirteci. Kilit dosyası süreç yaşadıkça tutulur (fork'ta yenilenir)."""
+        pid = os.getpid()
+        if self._owner is None or self._owner[0] != pid:
+            with self._owner_lock:
+                if self._owner is None or self._owner[0] != pid:
+                    token = f"{pid}-{uuid.uuid4().hex[:8]}"
+                    fd = os.open(os.path.join(self.lock_dir, f"{token}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    self._owner = (pid, token, fd)
+        return self._owner[1]
+
+    def _alive(self, owner: Optional[str]) -> bool:
+        if not owner:
+            return False
+        if owner == self.owner():
+            return True
+        path = os.path.join(self.lock_dir, f"{owner}.lock")
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        finally:
+            os.close(fd)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return False
+
+    def add(self, job: "Job") -> None:
+        if not self.enabled or job.cookies or job.parent is not None or job.fn.__name__ not in JOURNAL_KINDS:
+            return
+        try:
+            payload = json.dumps({"args": list(job.args), "kwargs": job.kwargs, "timeout": job.timeout})
+        except (TypeError, ValueError):
+            return
+        url = job.args[0] if job.args and isinstance(job.args[0], str) else None
+        self._run("INSERT OR REPLACE INTO jobs (id, kind, payload, url, video_id, output, owner, created, updated) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                  (job.id, job.fn.__name__, payload, url, extract_video_id(url) if url else None,
+                   job.kwargs.get("output"), self.owner(), job.created, time.time()))
+
+    def finish(self, job: "Job") -> None:
+        """Biten işin kaydını ve (üst düzey işse) devralınıp kullanılmamış yarım indirmelerini siler."""
+        if not self.enabled or job.parent is not None:
+            return
+        self._run("DELETE FROM jobs WHERE id = ?", (job.id,))
+        cur = self._run("SELECT workdir FROM partials WHERE root_id = ?", (job.id,))
+        for (workdir,) in (cur.fetchall() if cur else []):
+            self._discard(workdir)
+
+    def claim_partial(self, video_id: str, fmt: str) -> Optional[str]:
+        """Aynı video ve format için sahibi ölmüş bir çalışma dizinini devralır."""
+        if not self.enabled:
+            return None
+        cur = self._run("SELECT workdir, owner FROM partials WHERE video_id = ? AND fmt = ? ORDER BY updated DESC",
+                        (video_id, fmt))
+        for workdir, owner in (cur.fetchall() if cur else []):
+            if self._alive(owner):
+                continue
+            claimed = self._run("UPDATE partials SET owner = ?, updated = ? WHERE workdir = ? AND owner IS ?",
+                                (self.owner(), time.time(), workdir, owner))
+            if claimed is None or claimed.rowcount != 1:
+                continue
+            if os.path.isdir(workdir):
+                metrics.inc("ytmp3_journal_total", event="adopted")
+                return workdir
+            self._discard(workdir)
+        return None
+
+    def track_partial(self, workdir: str, job: Optional["Job"], info: Dict[str, Any], fmt: str,
+                      strategy: Optional[str]) -> None:
+        if not self.enabled:
+            return
+        root = (job.parent or job) if job else None
+        self._run("INSERT OR REPLACE INTO partials (workdir, root_id, url, video_id, fmt, strategy, owner, updated) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                  (workdir, root.id if root else None, info.get("webpage_url"), info.get("id"), fmt, strategy,
+                   self.owner(), time.time()))
+
+    def drop_partial(self, workdir: str) -> None:
+        if self.enabled:
+            self._run("DELETE FROM partials WHERE workdir = ?", (workdir,))
+
+    def _discard(self, workdir: str) -> None:
+        shutil.rmtree(workdir, ignore_errors=True)
+        self.drop_partial(workdir)
+
+    def _restore(self, job_id: str, kind: str, payload: str, created: float) -> bool:
+        """İşi aynı ID ile kuyruğa koyar; kuyruk doluysa beklemeden False döner."""
+        data = json.loads(payload)
+        job = Job(globals()[kind], tuple(data["args"]), data["kwargs"], timeout=data["timeout"])
+        job.id, job.created = job_id, created
+        start_job_workers()
+        try:
+            _job_queue.put_nowait(job)
+        except queue.Full:
+            return False
+        job.emit("resumed")
+        with _jobs_lock:
+            jobs[job.id] = job
+        return True
+
+    def resume(self, sweep: bool = False) -> None:
+        """Sahibi ölmüş işleri devralıp kuyruğa koyar ve devralınan bir işe ait olmayan yarım
+        indirmeleri siler. sweep=True (açılışta bir kez): günlükte hiç olmayan eski çalışma
+        dizinleri ve .part dosyaları için DOWNLOAD_DIR de taranır; sonraki geçişler yalnızca
+        günlük satırlarına bakar, dizin taranmaz."""
+        if not self.enabled:
+            return
+        me = self.owner()
+        cur = self._run("SELECT id, kind, payload, owner, created FROM jobs")
+        live_roots = set()
+        for job_id, kind, payload, owner, created in (cur.fetchall() if cur else []):
+            if self._alive(owner):
+                live_roots.add(job_id)
+                continue
+            claimed = self._run("UPDATE jobs SET owner = ?, updated = ? WHERE id = ? AND owner IS ?",
+                                (me, time.time(), job_id, owner))
+            if claimed is None or claimed.rowcount != 1:
+                continue
+            try:
+                if kind not in JOURNAL_KINDS:
+                    raise ValueError(f"unknown kind {kind}")
+                restored = self._restore(job_id, kind, payload, created)
+            except Exception as e:
+                print(f"[journal] dropping job {job_id[:8]}: {e}")
+                self._run("DELETE FROM jobs WHERE id = ?", (job_id,))
+                continue
+            if not restored:
+                # kuyruk dolu: iş günlükte sahipsiz kalır, sonraki geçişte yeniden denenir
+                self._run("UPDATE jobs SET owner = NULL WHERE id = ?", (job_id,))
+                live_roots.add(job_id)  # yarım indirmeleri silinmesin
+                metrics.inc("ytmp3_journal_total", event="deferred")
+                print(f"[journal] job queue full; {job_id[:8]} stays journaled")
+                continue
+            live_roots.add(job_id)
+            self.resumed += 1
+            metrics.inc("ytmp3_journal_total", event="resumed")
+            print(f"[journal] resumed job {job_id[:8]} ({kind})")
+        cur = self._run("SELECT workdir, root_id, owner FROM partials")
+        tracked = set()
+        for workdir, root_id, owner in (cur.fetchall() if cur else []):
+            tracked.add(workdir)
+            if root_id not in live_roots and not self._alive(owner):
+                self._discard(workdir)
+                metrics.inc("ytmp3_journal_total", event="orphan_removed")
+                print(f"[journal] removed orphan {os.path.basename(workdir)}")
+        if sweep:
+            self._sweep_orphans(tracked)
+
+    def _sweep_orphans(self, tracked: set) -> None:
+        now = time.time()
+        try:
+            with os.scandir(DOWNLOAD_DIR) as it:
+                for de in it:
+                    if not (de.name.startswith(WORKDIR_PREFIX) or de.name.endswith(".part")):
+                        continue
+                    stale = now - de.stat().st_mtime
+                    if de.name.startswith(WORKDIR_PREFIX) and de.path not in tracked and stale > ORPHAN_GRACE:
+                        shutil.rmtree(de.path, ignore_errors=True)
+                    elif de.name.endswith(".part") and de.is_file() and stale > ORPHAN_PART_GRACE:
+                        os.remove(de.path)
+                    else:
+                        continue
+                    metrics.inc("ytmp3_journal_total", event="orphan_removed")
+                    print(f"[journal] removed orphan {de.name}")
+        except OSError as e:
+            print(f"[journal] scan failed: {e}")
+        try:
+            for fn in os.listdir(self.lock_dir):
+                if fn.endswith(".lock"):
+                    self._alive(fn[:-5])  # ölü süreçlerin kilit dosyalarını temizler
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.enabled:
+            return {"enabled": False}
+        counts = {}
+        for table in ("jobs", "partials"):
+            cur = self._run(f"SELECT COUNT(*) FROM {table}")
+            counts[table] = cur.fetchone()[0] if cur else None
+        return {"enabled": True, "resumed": self.resumed, **counts}
+
+journal = JobJournal(JOB_JOURNAL_DB, JOB_JOURNAL_LOCKS)
+
+# --------- File Index ---------
+# DOWNLOAD_DIR'deki dosyaların bellek içi indeksi. Servis sırasında varlık, boyut, ETag ve
+# Last-Modified buradan gelir; dizin yalnızca açılışta bir kez taranır, sonra her yazma, servis
+# ve silme indeksi günceller. Son erişime göre sıralı bir heap hem TTL süresi dolanları hem de
+# CACHE_MAX_BYTES kotası aşıldığında (LRU/LFU) atılacak dosyaları periyodik tarama olmadan verir.
+CACHE_TTL = float(os.environ.get("CACHE_TTL", "7200"))                  # sn, son erişimden itibaren
+CACHE_MAX_BYTES = int(float(os.environ.get("CACHE_MAX_GB", "4")) * 1024**3)
+CACHE_MIN_FREE_BYTES = int(float(os.environ.get("CACHE_MIN_FREE_MB", "256")) * 1024**2)
+CACHE_POLICY = os.environ.get("CACHE_POLICY", "lru").strip().lower()    # lru | lfu
+
+file_index: Dict[str, Dict[str, Any]] = {}
+_index_lock = threading.RLock()
+_index_loaded = False
+_expiry_heap: List[Tuple[float, int, str]] = []  # (last_access, version, filename); eskiler tembel atlanır
+_index_bytes = 0
+eviction_stats: Dict[str, int] = {"ttl": 0, "quota": 0, "disk": 0, "bytes": 0}
+
+def _file_entry(st: os.stat_result) -> Dict[str, Any]:
+    return {"size": st.st_size, "mtime": st.st_mtime, "last_access": st.st_mtime, "hits": 0,
+            "version": 0, "etag": f"{st.st_size:x}-{st.st_mtime_ns:x}"}
+
+def _put_entry(filename: str, entry: Dict[str, Any]) -> None:
+    global _index_bytes
+    old = file_index.get(filename)
+    if old is not None:
+        _index_bytes -= old["size"]
+        entry["hits"], entry["version"] = old["hits"], old["version"] + 1
+        entry["last_access"] = max(entry["last_access"], old["last_access"])
+    file_index[filename] = entry
+    _index_bytes += entry["size"]
+    heapq.heappush(_expiry_heap, (entry["last_access"], entry["version"], filename))
+
+def load_disk_index() -> None:
+    global _index_loaded
+    if _index_loaded:
+        return
+    entries: Dict[str, Dict[str, Any]] = {}
+    stale_workdirs: List[str] = []
+    try:
+        with os.scandir(DOWNLOAD_DIR) as it:
+            for de in it:
+                if de.name.startswith("."):
+                    if (not journal.enabled and de.name.startswith(WORKDIR_PREFIX)
+                            and time.time() - de.stat().st_mtime > JOB_TIMEOUT):
+                        stale_workdirs.append(de.path)
+                    continue  # uygulama durumu (.jobs.sqlite3, .info-cache, ...) önbellek dosyası değildir
+                if de.is_file() and not de.name.endswith(".part"):
+                    entries[de.name] = _file_entry(de.stat())
+    except OSError as e:
+        print(f"[index] scan failed: {e}")
+    with _index_lock:
+        if _index_loaded:
+            return
+        for fn, entry in entries.items():
+            if fn not in file_index:
+                _put_entry(fn, entry)
+        _index_loaded = True
+    for fn in entries:
+        _register_cached_name(fn)
+    for path in stale_workdirs:
+        shutil.rmtree(path, ignore_errors=True)  # yarıda kalmış çalışma dizini
+    print(f"[index] {len(entries)} files, {_index_bytes / 1024**2:.1f} MB")
+
+def index_file(filename: str) -> Optional[Dict[str, Any]]:
+    """Yalnızca DOWNLOAD_DIR'deki düz dosyalar; dot-dosyalar (günlük, önbellek dizinleri) hiç indekslenmez."""
+    if filename.startswith("."):
+        return None
+    try:
+        st = os.stat(os.path.join(DOWNLOAD_DIR, filename))
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        unindex_file(filename)
+        return None
+    entry = _file_entry(st)
+    entry["last_access"] = time.time()
+    with _index_lock:
+        _put_entry(filename, entry)
+    enforce_quota()
+    return entry
+
+def unindex_file(filename: str) -> None:
+    global _index_bytes
+    with _index_lock:
+        entry = file_index.pop(filename, None)
+        if entry is not None:
+            _index_bytes -= entry["size"]
+
+def touch_file(filename: str, entry: Dict[str, Any]) -> None:
+    with _index_lock:
+        entry["last_access"] = time.time()
+        entry["hits"] += 1
+        entry["version"] += 1
+        heapq.heappush(_expiry_heap, (entry["last_access"], entry["version"], filename))
+        if len(_expiry_heap) > 4 * len(file_index) + 64:
+            _expiry_heap[:] = [(e["last_access"], e["version"], fn) for fn, e in file_index.items()]
+            heapq.heapify(_expiry_heap)
+
+def servable_name(filename: str) -> bool:
+    """İndeks dışından kabul edilen adlar: gizli olmayan (uygulama durumu dot-dosyalardadır) ve
+    bilinen bir ses uzantılı."""
+    return not filename.startswith(".") and filename.rsplit(".", 1)[-1].lower() in CACHE_EXTS
+
+def lookup_file(filename: str, touch: bool = True) -> Optional[Dict[str, Any]]:
+    load_disk_index()
+    with _index_lock:
+        entry = file_index.get(filename)
+    if entry is None and servable_name(filename):
+        entry = index_file(filename)  # indeks dışında yazılmış olabilir
+    if entry is not None and touch:
+        touch_file(filename, entry)
+    return entry
+
+def evict_file(filename: str, reason: str) -> None:
+    entry = file_index.get(filename)
+    try:
+        os.remove(os.path.join(DOWNLOAD_DIR, filename))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"[evict] {filename}: {e}")
+        return
+    drop_cached_file(filename)
+    eviction_stats[reason] += 1
+    metrics.inc("ytmp3_evictions_total", reason=reason)
+    eviction_stats["bytes"] += entry["size"] if entry else 0
+    print(f"[evict] {reason}: {filename}")
+
+def _pop_oldest() -> Optional[Tuple[float, str]]:
+    """Heap'in tepesindeki geçerli (last_access, filename) çiftini çıkarır."""
+    while _expiry_heap:
+        last, version, fn = heapq.heappop(_expiry_heap)
+        entry = file_index.get(fn)
+        if entry is not None and entry["version"] == version:
+            return last, fn
+    return None
+
+# Kodlama kuyruğunda bekleyen kaynaklar (dosya -> referans sayısı); kota/TTL ile silinmezler.
+_pinned: Dict[str, int] = {}
+
+def pin_file(filename: str) -> None:
+    with _index_lock:
+        _pinned[filename] = _pinned.get(filename, 0) + 1
+
+def unpin_file(filename: str) -> None:
+    with _index_lock:
+        n = _pinned.pop(filename, 0) - 1
+        if n > 0:
+            _pinned[filename] = n
+
+def _next_victim() -> Optional[str]:
+    if CACHE_POLICY == "lfu":
+        candidates = [kv for kv in file_index.items() if kv[0] not in _pinned]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda kv: (kv[1]["hits"], kv[1]["last_access"]))[0]
+    skipped = []
+    try:
+        while True:
+            oldest = _pop_oldest()
+            if oldest is None:
+                return None
+            entry = file_index[oldest[1]]
+            skipped.append((entry["last_access"], entry["version"], oldest[1]))
+            if oldest[1] not in _pinned:
+                return oldest[1]
+    finally:
+        for item in skipped:
+            heapq.heappush(_expiry_heap, item)
+
+def _disk_free() -> int:
+    try:
+        return shutil.disk_usage(DOWNLOAD_DIR).free
+    except OSError:
+        return 0
+
+def reserve_space(nbytes: int = 0) -> None:
+    """Yeni bir indirme için yer açar: kota ve diskteki boş alan nbytes'ı karşılayana kadar
+    en az değerli dosyaları siler. Son 60 sn içinde dokunulan ve kodlama kuyruğunda bekleyen
+    (pin_file) dosyalara dokunulmaz."""
+    load_disk_index()
+    with _index_lock:
+        while file_index:
+            over_quota = _index_bytes + nbytes > CACHE_MAX_BYTES
+            low_disk = _disk_free() < nbytes + CACHE_MIN_FREE_BYTES
+            if not (over_quota or low_disk):
+                return
+            victim = _next_victim()
+            if victim is None or time.time() - file_index[victim]["last_access"] < 60:
+                return
+            evict_file(victim, "quota" if over_quota else "disk")
+
+def enforce_quota() -> None:
+    reserve_space(0)
+
+def expire_files() -> float:
+    """TTL'i dolan dosyaları siler; bir sonraki dolma anına kadar beklenecek süreyi döner."""
+    load_disk_index()
+    with _index_lock:
+        while True:
+            oldest = _pop_oldest()
+            if oldest is None:
+                return CACHE_TTL
+            last, fn = oldest
+            wait_s = last + CACHE_TTL - time.time()
+            if wait_s > 0:
+                heapq.heappush(_expiry_heap, (last, file_index[fn]["version"], fn))
+                return wait_s
+            if fn in _pinned:
+                # kodlama bekliyor: bir tam TTL sonra yeniden bakılır
+                heapq.heappush(_expiry_heap, (time.time(), file_index[fn]["version"], fn))
+                continue
+            evict_file(fn, "ttl")
+
+def disk_cache_stats() -> Dict[str, Any]:
+    return {
+        "policy": CACHE_POLICY,
+        "files": len(file_index),
+        "used_bytes": _index_bytes,
+        "quota_bytes": CACHE_MAX_BYTES,
+        "ttl_s": CACHE_TTL,
+        "evictions": dict(eviction_stats),
+    }
+
+# --------- Result Cache ---------
+# video ID -> {tür: DOWNLOAD_DIR içindeki bitmiş dosya}. Tür, dosya adından çıkar: "mp3-192",
+# "mp3-128", "opus-96", "m4a", "webm", ... Dosya adları "<başlık> [<id>][.<kbps>k].<ext>" biçiminde
+# olduğundan indeks açılışta bir kez diskten kurulabilir; isabet yt-dlp'yi hiç çağırmaz.
+CACHE_EXTS = ("mp3", "m4a", "webm", "opus", "ogg")
+_CACHED_NAME_RE = re.compile(r'\[([A-Za-z0-9_-]{11})\](?:\.(\d+)k)?\.(' + "|".join(CACHE_EXTS) + r')$')
+
+result_cache: Dict[str, Dict[str, str]] = {}
+_cache_lock = threading.Lock()
+
+class _Flight:
+    """Aynı video ve çıktı için süren tek indirme; takipçiler bunun bitmesini bekler."""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+_inflight: Dict[str, _Flight] = {}
+
+def _cache_kind(fn: str) -> Optional[Tuple[str, str]]:
+    """Dosya adı -> (video ID, tür)."""
+    m = _CACHED_NAME_RE.search(fn)
+    if not m:
+        return None
+    vid, kbps, ext = m.groups()
+    if ext == "mp3":
+        return vid, f"mp3-{kbps or DEFAULT_MP3_BITRATE}"
+    return vid, (f"opus-{kbps}" if ext == "opus" and kbps else ext)
+
+def _register_cached_name(fn: str) -> None:
+    parsed = _cache_kind(fn)
+    if not parsed:
+        return
+    with _cache_lock:
+        result_cache.setdefault(parsed[0], {})[parsed[1]] = fn
+
+def drop_cached_file(filename: str) -> None:
+    """Silinen/kaybolan dosyayı hem dosya indeksinden hem video ID önbelleğinden çıkarır."""
+    unindex_file(filename)
+    with _cache_lock:
+        for vid, kinds in list(result_cache.items()):
+            for kind in [k for k, fn in kinds.items() if fn == filename]:
+                kinds.pop(kind, None)
+            if not kinds:
+                result_cache.pop(vid, None)
+
+def cache_lookup(video_id: Optional[str], output: str = DEFAULT_OUTPUT) -> Optional[str]:
+    """Profili karşılayan önbellekteki dosya (output_kinds sırasıyla)."""
+    if not video_id:
+        return None
+    load_disk_index()
+    for kind in output_kinds(output):
+        with _cache_lock:
+            fn = result_cache.get(video_id, {}).get(kind)
+        if not fn:
+            continue
+        with _index_lock:
+            entry = file_index.get(fn)
+        if entry is None:
+            drop_cached_file(fn)
+            continue
+        touch_file(fn, entry)  # sıcak dosyalar TTL/LRU ile silinmesin
+        return fn
+    return None
+
+def cached_variants(video_id: Optional[str]) -> Dict[str, str]:
+    """Videonun önbellekteki tüm çıktıları: tür -> dosya adı."""
+    if not video_id:
+        return {}
+    load_disk_index()
+    with _cache_lock:
+        kinds = dict(result_cache.get(video_id, {}))
+    return {k: fn for k, fn in sorted(kinds.items()) if lookup_file(fn, touch=False)}
+
+def cache_store(video_id: str, filename: str) -> None:
+    if filename and lookup_file(filename, touch=False):
+        parsed = _cache_kind(filename)
+        kind = parsed[1] if parsed else filename.rsplit(".", 1)[-1]
+        with _cache_lock:
+            result_cache.setdefault(video_id, {})[kind] = filename
+
+def _land_flight(key: str, flight: _Flight, video_id: str, fut: Optional[Future] = None,
+                 result: Optional[str] = None, error: Optional[BaseException] = None) -> None:
+    """Lider indirmenin sonucunu önbelleğe yazar ve bekleyen takipçileri uyandırır."""
+    if fut is not None:
+        error = fut.exception()
+        result = None if error else fut.result()
+    if result:
+        cache_store(video_id, result)
+    flight.result, flight.error = result, error
+    with _cache_lock:
+        _inflight.pop(key, None)
+    flight.done.set()
+
+def cached_download(url: str, job: Optional[Job] = None, output: str = DEFAULT_OUTPUT):
+    """run_download'ın önbellekli hali: isabette dosyayı döner, aynı video/çıktı için süren bir
+    indirme varsa ona katılır (single-flight), MP3 istenip kaynak dosya önbellekteyse yerelde
+    kodlar, yoksa indirmeyi kendisi yapar. Kodlama havuzu açıksa MP3 için dosya adı yerine
+    kodlama bitince çözülen bir Future döner (bkz. _run_job)."""
+    output = effective_output(output)
+    video_id = extract_video_id(url)
+    if not video_id:
+        return run_download(url, job=job, output=output)
+    key = f"{video_id}:{output}"
+    while True:
+        hit = cache_lookup(video_id, output)
+        if hit:
+            print(f"[cache] hit {video_id} ({output})")
+            metrics.inc("ytmp3_cache_requests_total", result="hit")
+            return hit
+        with _cache_lock:
+            flight = _inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _inflight[key] = _Flight()
+        metrics.inc("ytmp3_cache_requests_total", result="miss" if leader else "dedup")
+        if leader:
+            # Ek profiller kaynak inmeden talep edilir: aynı videonun başka profilini isteyenler
+            # ayrı bir kod çözme başlatmak yerine bu geçişi bekler.
+            extras = claim_renditions(video_id, output) if is_encoded(output) else {}
+            try:
+                if is_encoded(output) and transcode_pool.enabled:
+                    # indirme aşaması yalnızca kaynağı getirir; kodlama havuzda, bu iş parçacığı serbest
+                    src = cached_download(url, job=job, output="source")
+                    fut = transcode_pool.submit(src, output, job, extras)
+                    fut.add_done_callback(lambda f: _land_flight(key, flight, video_id, f))
+                    fut.add_done_callback(lambda f: release_renditions(
+                        video_id, extras, f.exception() or RuntimeError("Kodlama yapılmadı.")))
+                    return fut
+                src = cache_lookup(video_id, "source") if is_encoded(output) else None
+                if not src and (output.startswith("opus-") or extras):
+                    # Opus ve çoklu profil tek ffmpeg geçişinde yerelde kodlanır: önce yalnızca kaynak
+                    src = cached_download(url, job=job, output="source")
+                result = transcode_file(src, output, job, extras) if src else run_download(url, job=job, output=output)
+            except BaseException as e:
+                release_renditions(video_id, extras, e)
+                _land_flight(key, flight, video_id, error=e)
+                raise
+            _land_flight(key, flight, video_id, result=result)
+            return result
+        print(f"[cache] waiting on in-flight download {video_id} ({output})")
+        job_event(job, "dedup", video_id=video_id)
+        while not flight.done.wait(0.5):
+            job_checkpoint(job)
+        if flight.result:
+            return flight.result
+        if isinstance(flight.error, JobCancelled):
+            continue  # lider iptal edildi; işi biz devralalım
+        raise RuntimeError(str(flight.error) if flight.error else "İndirme başarısız.")
+
+# --------- Strategy Scheduler ---------
+# (ad, player_clients, use_po_token, aggressive_bypass, base_delay, extra_opts)
+ALTERNATIVE_STRATEGIES = [
+    ("Emergency TV", ["tv"], False, True, 1, {"extractor_args": {"youtube": {"innertube_host": "youtubei.googleapis.com"}}}),
+    ("Web (Bypass)", ["web"], False, True, 2, {"extractor_args": {"youtube": {"skip": ["dash","hls"], "player_skip": ["configs"]}}}),
+    ("Android Testsuite", ["android_testsuite"], False, True, 3, {}),
+    ("iOS Safari", ["ios"], False, True, 4, {}),
+]
+STANDARD_STRATEGIES = [
+    ("Smart TV", ["tv"], False, True, 1, {}),
+    ("Android Creator", ["android_creator"], False, True, 2, {}),
+    ("Mobile Web", ["mweb"], False, True, 3, {}),
+    ("PO + Android", ["android"], True, True, 4, {}),
+    ("iOS Music", ["ios_music"], False, True, 5, {}),
+    ("TV Embedded", ["tv_embedded"], False, True, 6, {}),
+    ("Web Creator", ["web_creator"], False, True, 7, {}),
+]
+STRATEGIES = ALTERNATIVE_STRATEGIES + STANDARD_STRATEGIES
+EMERGENCY_CLIENTS = ["tv", "android", "mweb"]
+EMERGENCY_STRATEGY = ("Emergency", EMERGENCY_CLIENTS, True, True, 0, {})
+
+def strategy_by_name(name: Optional[str]) -> Optional[tuple]:
+    return next((st for st in STRATEGIES + [EMERGENCY_STRATEGY] if st[0] == name), None)
+
+STRATEGY_HALF_LIFE = float(os.environ.get("STRATEGY_HALF_LIFE", "1800"))  # sn; eski sonuçlar bu hızla unutulur
+STRATEGY_DEAD_AFTER = int(os.environ.get("STRATEGY_DEAD_AFTER", "3"))      # art arda bu kadar hata -> cooldown
+STRATEGY_COOLDOWN = float(os.environ.get("STRATEGY_COOLDOWN", "900"))      # sn
+
+# Videoya/IP'ye ait hatalar client'ı cezalandırmaz; yalnızca sayılır.
+NEUTRAL_ERROR_CLASSES = {"unavailable", "rate_limit", "network"}
+
+def classify_error(e: BaseException) -> str:
+    err = str(e).lower()
+    if "failed to extract any player response" in err:
+        return "player_response"
+    if "sign in to confirm" in err or "bot" in err:
+        return "bot"
+    if any(k in err for k in ["private","unavailable","removed","deleted"]):
+        return "unavailable"
+    if any(k in err for k in ["rate","limit","quota","too many requests"]):
+        return "rate_limit"
+    if any(k in err for k in ["network","timeout","connection","resolve"]):
+        return "network"
+    return "other"
+
+class StrategyScheduler:
+    """player_client başına zamanla sönümlenen başarı skoru + gecikme EWMA'sı tutar.
+    Stratejiler bu skora göre sıralanır; art arda düşen client'lar cooldown süresince atlanır.
+    Sönümleme skoru öncüle (0.5) geri çektiği için ölü client'lar zamanla yeniden denenir."""
+
+    PRIOR = 0.5
+    ALPHA = 0.3
+
+    def __init__(self, half_life: float, dead_after: int, cooldown: float):
+        self.half_life = half_life
+        self.dead_after = dead_after
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    @staticmethod
+    def key(clients) -> str:
+        return clients if isinstance(clients, str) else ",".join(clients)
+
+    def _entry(self, key: str) -> Dict[str, Any]:
+        return self._stats.setdefault(key, {
+            "score": self.PRIOR, "updated": 0.0, "latency": None,
+            "attempts": 0, "successes": 0, "failures": 0, "consecutive_failures": 0,
+            "errors": {}, "last_error": None, "last_used": None, "cooldown_until": 0.0,
+        })
+
+    def _score(self, e: Dict[str, Any], now: float) -> float:
+        if not e["updated"] or self.half_life <= 0:
+            return e["score"]
+        w = 0.5 ** ((now - e["updated"]) / self.half_life)
+        return self.PRIOR + (e["score"] - self.PRIOR) * w
+
+    def record(self, clients, ok: bool, latency: float, error_class: Optional[str] = None) -> None:
+        now = time.time()
+        metrics.inc("ytmp3_strategy_attempts_total", client=self.key(clients), result="ok" if ok else error_class)
+        metrics.observe("ytmp3_strategy_seconds", latency, client=self.key(clients))
+        with self._lock:
+            e = self._entry(self.key(clients))
+            e["attempts"] += 1
+            e["last_used"] = now
+            if not ok:
+                e["errors"][error_class] = e["errors"].get(error_class, 0) + 1
+                e["last_error"] = error_class
+                if error_class in NEUTRAL_ERROR_CLASSES:
+                    return
+            e["score"] = self._score(e, now) + self.ALPHA * ((1.0 if ok else 0.0) - self._score(e, now))
+            e["updated"] = now
+            e["latency"] = latency if e["latency"] is None else e["latency"] + self.ALPHA * (latency - e["latency"])
+            if ok:
+                e["successes"] += 1
+                e["consecutive_failures"] = 0
+                e["cooldown_until"] = 0.0
+            else:
+                e["failures"] += 1
+                e["consecutive_failures"] += 1
+                if e["consecutive_failures"] >= self.dead_after:
+                    e["cooldown_until"] = now + self.cooldown
+                    print(f"[sched] {self.key(clients)} cooling down for {int(self.cooldown)}s ({error_class})")
+
+    def _rank(self, key: str, now: float) -> float:
+        e = self._stats.get(key)
+        if not e:
+            return self.PRIOR
+        # Yavaş client'lara en fazla 0.1 puan ceza
+        penalty = min(e["latency"] or 0.0, 60.0) / 600.0
+        return self._score(e, now) - penalty
+
+    def order(self, strategies: List[tuple]) -> List[tuple]:
+        now = time.time()
+        with self._lock:
+            ranked = sorted(strategies, key=lambda st: -self._rank(self.key(st[1]), now))  # stable: eşitlikte sabit sıra
+            alive = [st for st in ranked
+                     if self._stats.get(self.key(st[1]), {}).get("cooldown_until", 0.0) <= now]
+        return alive or ranked  # hepsi soğuyorsa yine de hepsini dene
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            return {k: {
+                "score": round(self._score(e, now), 3),
+                "latency_s": round(e["latency"], 2) if e["latency"] is not None else None,
+                "attempts": e["attempts"],
+                "successes": e["successes"],
+                "failures": e["failures"],
+                "consecutive_failures": e["consecutive_failures"],
+                "errors": dict(e["errors"]),
+                "last_error": e["last_error"],
+                "last_used": e["last_used"],
+                "cooldown_remaining_s": max(0, int(e["cooldown_until"] - now)),
+            } for k, e in self._stats.items()}
+
+strategy_scheduler = StrategyScheduler(STRATEGY_HALF_LIFE, STRATEGY_DEAD_AFTER, STRATEGY_COOLDOWN)
+
+# --------- Download Tuning ---------
+# Fragman eşzamanlılığı ve HTTP chunk boyutu yol (proxy + player_client) başına ölçülen indirme
+# hızına göre ayarlanır. Başlangıç eski sabit değerlerdir; çoğu indirme o yolun en hızlı ayarını
+# kullanır, DOWNLOAD_TUNE_EXPLORE olasılıkla bir komşu ayar (bir adım yukarı/aşağı) denenir. Hız
+# sınırı, ağ hatası ya da 403 (upstream kısıtlaması) o ayarın skorunu yarıya indirir. Not: YouTube'un
+# düz HTTP formatlarında chunk boyutu, DASH/HLS formatlarında fragman eşzamanlılığı etkilidir.
+DOWNLOAD_TUNING = os.environ.get("DOWNLOAD_TUNING", "1").lower() in ("1","true","yes","on")
+TUNE_MAX_FRAGMENTS = max(1, int(os.environ.get("DOWNLOAD_TUNE_MAX_FRAGMENTS", "8")))
+TUNE_MIN_CHUNK_KB = max(64, int(os.environ.get("DOWNLOAD_TUNE_MIN_CHUNK_KB", "256")))
+TUNE_MAX_CHUNK_KB = max(TUNE_MIN_CHUNK_KB, int(os.environ.get("DOWNLOAD_TUNE_MAX_CHUNK_KB", "8192")))
+TUNE_EXPLORE = float(os.environ.get("DOWNLOAD_TUNE_EXPLORE", "0.2"))
+TUNE_MIN_BYTES = 256 * 1024  # daha küçük indirmeler hız ölçümü için fazla gürültülü
+TUNE_PARAM = "ytmp3_tuning"  # ydl.params içinde (yol, ayar); yt-dlp bilinmeyen anahtarı yok sayar
+
+def _doubling(lo: int, hi: int) -> List[int]:
+    vals = [lo]
+    while vals[-1] * 2 <= hi:
+        vals.append(vals[-1] * 2)
+    return vals
+
+def tuning_path(identity: Optional["Identity"], player_clients: str) -> str:
+    return f"{identity.proxy.key if identity and identity.proxy else 'direct'}|{player_clients}"
+
+class DownloadTuner:
+    """Yol başına (fragman, chunk) ayarlarının MB/s EWMA'sı. choose() en iyi ayarı ya da keşif için
+    bir komşusunu döner; record()/penalize() indirme sonucunu işler."""
+
+    ALPHA = 0.3
+
+    def __init__(self, fragments: List[int], chunks: List[int], explore: float):
+        self.fragments, self.chunks, self.explore = fragments, chunks, explore
+        self._lock = threading.Lock()
+        self._paths: Dict[str, Dict[Tuple[int, int], Dict[str, Any]]] = {}
+
+    def _snap(self, arm: Tuple[int, int]) -> Tuple[int, int]:
+        return (min(self.fragments, key=lambda v: abs(v - arm[0])), min(self.chunks, key=lambda v: abs(v - arm[1])))
+
+    def _neighbours(self, arm: Tuple[int, int]) -> List[Tuple[int, int]]:
+        fi, ci = self.fragments.index(arm[0]), self.chunks.index(arm[1])
+        out = []
+        for dfi, dci in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+            if 0 <= fi + dfi < len(self.fragments) and 0 <= ci + dci < len(self.chunks):
+                out.append((self.fragments[fi + dfi], self.chunks[ci + dci]))
+        return out
+
+    def _best(self, arms: Dict[Tuple[int, int], Dict[str, Any]]) -> Optional[Tuple[int, int]]:
+        return max(arms, key=lambda a: arms[a]["mbps"]) if arms else None
+
+    def choose(self, path: str, default: Tuple[int, int]) -> Tuple[int, int]:
+        with self._lock:
+            arms = self._paths.get(path) or {}
+            best = self._best(arms) or self._snap(default)
+            if not arms or random.random() >= self.explore:
+                return best
+            candidates = self._neighbours(best)
+            untried = [a for a in candidates if a not in arms]
+            if untried:
+                return random.choice(untried)
+            return min(candidates, key=lambda a: arms[a]["updated"]) if candidates else best
+
+    def record(self, path: str, arm: Tuple[int, int], nbytes: int, seconds: float) -> float:
+        mbps = nbytes / max(seconds, 1e-3) / 1e6
+        with self._lock:
+            a = self._paths.setdefault(path, {}).setdefault(arm, {"mbps": mbps, "samples": 0, "penalties": 0, "updated": 0.0})
+            a["mbps"] += self.ALPHA * (mbps - a["mbps"])
+            a["samples"] += 1
+            a["updated"] = time.time()
+        return mbps
+
+    def penalize(self, path: str, arm: Tuple[int, int], error_class: str) -> None:
+        with self._lock:
+            a = self._paths.setdefault(path, {}).setdefault(arm, {"mbps": 0.0, "samples": 0, "penalties": 0, "updated": 0.0})
+            a["mbps"] *= 0.5
+            a["penalties"] += 1
+            a["updated"] = time.time()
+        print(f"[tune] {path} {arm[0]}x{arm[1] // 1024}K penalized ({error_class})")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = {}
+            for path, arms in self._paths.items():
+                best = self._best(arms)
+                out[path] = {
+                    "best": {"fragments": best[0], "chunk_kb": best[1] // 1024, "mbps": round(arms[best]["mbps"], 3)},
+                    "settings": [{"fragments": a[0], "chunk_kb": a[1] // 1024, "mbps": round(e["mbps"], 3),
+                                  "samples": e["samples"], "penalties": e["penalties"], "updated": e["updated"]}
+                                 for a, e in sorted(arms.items())],
+                }
+            return out
+
+download_tuner = DownloadTuner(_doubling(1, TUNE_MAX_FRAGMENTS),
+                               [kb * 1024 for kb in _doubling(TUNE_MIN_CHUNK_KB, TUNE_MAX_CHUNK_KB)], TUNE_EXPLORE)
+
+# --------- Identity Pool ---------
+# YouTube'a çıkan her deneme bir kimlikle yapılır: bir çerez kavanozu + bir proxy. Kavanozlar
+# açılışta (ve kaynak dosya değişince) bir kez okunur, bellekte tutulur; her YoutubeDL kendi
+# bellek içi kopyasını alır (diskteki ortak dosyaya yazılmaz), YouTube'un döndürdüğü taze
+# çerezler kapanışta kavanoza geri işlenir. Kavanoz ve proxy'ler sönümlenen skorlarına göre
+# ağırlıklı sırayla (smooth weighted round-robin) dağıtılır; bot/rate-limit işareti alan üye
+# katlanarak uzayan bir cooldown'a girer. Kullanıcının yüklediği çerezler yalnızca kendi işinde
+# kullanılır, havuza girmez ve skorlanmaz.
+IDENTITY_FLAG_CLASSES = {"bot", "player_response", "rate_limit"}  # kimlik işaretlendi -> cooldown
+PROXY_ERROR_CLASSES = {"network"}                                 # yalnızca proxy'nin skoru düşer
+YOUTUBE_COOKIE_NAMES = {"SID", "__Secure-3PSID", "SAPISID", "APISID", "HSID", "SSID",
+                        "CONSENT", "VISITOR_INFO1_LIVE", "YSC"}
+
+def parse_cookie_text(text: str) -> Dict[str, Any]:
+    """Netscape cookies.txt özeti; geçerli satır yoksa ValueError."""
+    lines = [l.strip() for l in text.splitlines() if l.strip() and not l.startswith("#")]
+    names = set()
+    youtube_lines = 0
+    for line in lines:
+        parts = line.split("\t")
+        if len(parts) >= 7 and ("youtube.com" in parts[0] or ".youtube." in parts[0]):
+            youtube_lines += 1
+            names.add(parts[5])
+    if not any(len(l.split("\t")) >= 7 for l in lines):
+        raise ValueError("Netscape biçiminde (cookies.txt) çerez satırı bulunamadı")
+    return {"total_lines": len(lines), "youtube_domain_lines": youtube_lines,
+            "names": sorted(names & YOUTUBE_COOKIE_NAMES)}
+
+class _JarIO(io.StringIO):
+    """yt-dlp'ye dosya yerine verilen bellek içi cookies.txt. yt-dlp kapanışta kavanozu buraya
+    geri yazar (truncate(0) + write); absorb() güncel içeriği havuz üyesine işler."""
+
+    def __init__(self, text: str, member: Optional["PoolMember"] = None):
+        super().__init__(text)
+        self.member = member
+
+    def truncate(self, size=None):
+        self.seek(0)
+        return super().truncate(size)
+
+    def absorb(self) -> None:
+        if self.member is not None and self.member.kind == "cookie":
+            text = self.getvalue()
+            if "\t" in text:
+                self.member.value = text
+
+class PoolMember:
+    def __init__(self, kind: str, key: str, value: Optional[str], source: Optional[str] = None):
+        self.kind, self.key, self.value, self.source = kind, key, value, source
+        self.mtime = 0.0
+        self.summary: Dict[str, Any] = {}
+        self.score, self.updated, self.current = IdentityPool.PRIOR, 0.0, 0.0
+        self.successes = self.failures = self.flags = self.consecutive_flags = 0
+        self.cooldown_until = 0.0
+        self.last_error: Optional[str] = None
+        self.last_used: Optional[float] = None
+
+class Identity:
+    """Bir denemenin kimliği: çerez üyesi (havuzdan ya da yüklenen) + proxy üyesi."""
+
+    def __init__(self, cookie: Optional[PoolMember], proxy: Optional[PoolMember]):
+        self.cookie, self.proxy = cookie, proxy
+
+    @property
+    def proxy_url(self) -> Optional[str]:
+        return self.proxy.value if self.proxy else None
+
+    @property
+    def label(self) -> str:
+        return f"{self.cookie.key if self.cookie else 'no-cookie'} @ {self.proxy.key if self.proxy else 'direct'}"
+
+    def jar(self) -> Optional[_JarIO]:
+        return _JarIO(self.cookie.value, self.cookie) if self.cookie and self.cookie.value else None
+
+def _proxy_label(proxy: Optional[str]) -> str:
+    if not proxy or proxy == "direct":
+        return "direct"
+    u = urlsplit(proxy if "://" in proxy else f"http://{proxy}")
+    return f"{u.scheme}://{u.hostname}:{u.port}" if u.port else f"{u.scheme}://{u.hostname}"  # parola görünmez
+
+class IdentityPool:
+    PRIOR = 0.5
+    ALPHA = 0.3
+    MIN_WEIGHT = 0.05
+
+    def __init__(self, half_life: float, cooldown: float, max_cooldown: float):
+        self.half_life, self.cooldown, self.max_cooldown = half_life, cooldown, max_cooldown
+        self._lock = threading.Lock()
+        self.cookies: Dict[str, PoolMember] = {}   # kaynak yolu -> üye
+        self.proxies: List[PoolMember] = []
+        self._checked = 0.0
+
+    def _cookie_files(self) -> List[str]:
+        files: List[str] = []
+        for path in COOKIE_PATHS:
+            if os.path.isdir(path):
+                files += sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".txt"))
+            elif os.path.isfile(path):
+                files.append(path)
+        return list(dict.fromkeys(os.path.abspath(f) for f in files))
+
+    def reload(self, force: bool = False) -> None:
+        """Kaynak çerez dosyalarını yalnızca değiştiklerinde yeniden okur (IDENTITY_RELOAD aralıkla stat)."""
+        now = time.time()
+        if not force and now - self._checked < IDENTITY_RELOAD:
+            return
+        self._checked = now
+        if not self.proxies:
+            self.proxies = [PoolMember("proxy", _proxy_label(p), None if p == "direct" else p)
+                            for p in PROXY_LIST] or [PoolMember("proxy", "direct", None)]
+        for path in self._cookie_files():
+            try:
+                st = os.stat(path)
+                member = self.cookies.get(path)
+                if member is not None and member.mtime == st.st_mtime:
+                    continue
+                if st.st_size == 0:
+                    continue
+                with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                    text = f.read()
+                summary = parse_cookie_text(text)
+            except (OSError, ValueError) as e:
+                print(f"[identity] cookie jar skipped {path}: {e}")
+                continue
+            key = f"{os.path.basename(path)}#{hashlib.sha1(text.encode()).hexdigest()[:6]}"
+            if member is None:
+                member = self.cookies[path] = PoolMember("cookie", key, text, path)
+            else:
+                member.key, member.value = key, text  # dosya yenilendi: skor geçmişi korunur
+            member.mtime, member.summary = st.st_mtime, summary
+            print(f"[identity] cookie jar {key}: {summary['youtube_domain_lines']} youtube lines")
+
+    def _score(self, m: PoolMember, now: float) -> float:
+        if not m.updated or self.half_life <= 0:
+            return m.score
+        return self.PRIOR + (m.score - self.PRIOR) * 0.5 ** ((now - m.updated) / self.half_life)
+
+    def _pick(self, members: List[PoolMember], exclude: Optional[PoolMember], now: float) -> Optional[PoolMember]:
+        """Smooth weighted round-robin: ağırlık = sönümlenmiş skor; cooldown'dakiler atlanır,
+        hepsi soğuyorsa en erken açılacak olan seçilir."""
+        if not members:
+            return None
+        alive = [m for m in members if m.cooldown_until <= now and m is not exclude] or \
+                [m for m in members if m.cooldown_until <= now]
+        if not alive:
+            return min(members, key=lambda m: m.cooldown_until)
+        weights = [max(self._score(m, now), self.MIN_WEIGHT) for m in alive]
+        for m, w in zip(alive, weights):
+            m.current += w
+        chosen = max(alive, key=lambda m: m.current)
+        chosen.current -= sum(weights)
+        chosen.last_used = now
+        return chosen
+
+    def acquire(self, job: Optional["Job"] = None, exclude: Optional[Identity] = None) -> Identity:
+        """Bir sonraki kimlik. İşe yüklenmiş çerez varsa kavanoz yerine o kullanılır (yalnızca proxy
+        havuzdan gelir). exclude: az önce işaretlenen kimlik; mümkünse başka üyeler seçilir."""
+        uploaded = job_cookies(job)
+        with self._lock:
+            self.reload()
+            now = time.time()
+            proxy = self._pick(self.proxies, exclude.proxy if exclude else None, now)
+            if uploaded is not None:
+                cookie = PoolMember("upload", "upload", uploaded)
+            else:
+                cookie = self._pick(list(self.cookies.values()), exclude.cookie if exclude else None, now)
+        ident = Identity(cookie, proxy)
+        print(f"[identity] {ident.label}")
+        return ident
+
+    def find(self, cookie_key: Optional[str], proxy_key: Optional[str]) -> Optional[Identity]:
+        """Anahtarları verilen kimlik (önbellekteki imzalı URL'ler ona bağlı). Üye artık yoksa ya da
+        soğuyorsa None: bilgi yeniden çıkarılmalıdır."""
+        with self._lock:
+            self.reload()
+            now = time.time()
+            proxy = next((m for m in self.proxies if m.key == proxy_key), None)
+            cookie = next((m for m in self.cookies.values() if m.key == cookie_key), None) if cookie_key else None
+        if proxy is None or proxy.cooldown_until > now:
+            return None
+        if cookie_key and (cookie is None or cookie.cooldown_until > now):
+            return None
+        return Identity(cookie, proxy)
+
+    def record(self, ident: Optional[Identity], ok: bool, error_class: Optional[str] = None) -> None:
+        upstream_governor.feedback(ok, error_class)  # her deneme sonucu ortak bütçeyi de ayarlar
+        if ident is None:
+            return
+        members = [m for m in (ident.cookie, ident.proxy) if m is not None and m.kind != "upload"]
+        if not ok and error_class in PROXY_ERROR_CLASSES:
+            members = [m for m in members if m.kind == "proxy"]
+        elif not ok and error_class not in IDENTITY_FLAG_CLASSES:
+            return  # videoya/koda ait hata: kimlik sorumlu değil
+        now = time.time()
+        with self._lock:
+            for m in members:
+                m.score = self._score(m, now) + self.ALPHA * ((1.0 if ok else 0.0) - self._score(m, now))
+                m.updated = now
+                if ok:
+                    m.successes += 1
+                    m.consecutive_flags = 0
+                    continue
+                m.failures += 1
+                m.last_error = error_class
+                if error_class in IDENTITY_FLAG_CLASSES:
+                    m.flags += 1
+                    m.consecutive_flags += 1
+                    cool = min(self.cooldown * 2 ** (m.consecutive_flags - 1), self.max_cooldown)
+                    m.cooldown_until = now + cool
+                    print(f"[identity] {m.kind} {m.key} flagged ({error_class}), cooling down {int(cool)}s")
+        for m in members:
+            metrics.inc("ytmp3_identity_outcomes_total", kind=m.kind, result="ok" if ok else error_class)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            self.reload()
+            return {
+                kind: {m.key: {
+                    "score": round(self._score(m, now), 3),
+                    "successes": m.successes,
+                    "failures": m.failures,
+                    "flags": m.flags,
+                    "last_error": m.last_error,
+                    "last_used": m.last_used,
+                    "cooldown_remaining_s": max(0, int(m.cooldown_until - now)),
+                    **({"youtube_cookies": m.summary.get("names", [])} if m.kind == "cookie" else {}),
+                } for m in members}
+                for kind, members in (("cookies", list(self.cookies.values())), ("proxies", self.proxies))}
+
+identity_pool = IdentityPool(IDENTITY_HALF_LIFE, IDENTITY_COOLDOWN, IDENTITY_MAX_COOLDOWN)
+
+def job_cookies(job: Optional["Job"]) -> Optional[str]:
+    """İşe (ya da toplu işteki üst işe) yüklenmiş çerez metni."""
+    while job is not None:
+        if job.cookies is not None:
+            return job.cookies
+        job = job.parent
+    return None
+
+def read_uploaded_cookies(data=None) -> Optional[str]:
+    """Formdaki "cookies" dosyası ya da JSON'daki "cookies" metni -> doğrulanmış metin
+    (yoksa None, bozuksa ValueError)."""
+    uploaded = request.files.get("cookies")
+    if uploaded and uploaded.filename:
+        raw = uploaded.read(COOKIE_UPLOAD_MAX + 1)
+    elif data is not None and isinstance(data.get("cookies"), str) and data["cookies"].strip():
+        raw = data["cookies"].encode()
+    else:
+        return None
+    if len(raw) > COOKIE_UPLOAD_MAX:
+        raise ValueError("Cookie dosyası 1MB'den büyük")
+    text = raw.decode("utf-8", errors="ignore")
+    parse_cookie_text(text)
+    return text
+
+# yt-dlp player JS kodunu ve sts/imza sonuçlarını YoutubeIE örneğinde tutar; her YoutubeDL (strateji
+# başına en az bir) bunları baştan indirip türetirdi. Sözlükler süreç içinde tüm örneklerce paylaşılır.
+_yt_code_cache: Dict[str, str] = {}
+_yt_player_cache: Dict[tuple, Any] = {}
+
+def share_player_cache(ydl) -> None:
+    if len(_yt_code_cache) > YTDLP_SHARED_PLAYERS:
+        _yt_code_cache.clear()
+    if len(_yt_player_cache) > 5000:
+        _yt_player_cache.clear()
+    try:
+        ie = ydl.get_info_extractor("Youtube")
+    except Exception:
+        return
+    if isinstance(getattr(ie, "_code_cache", None), dict) and isinstance(getattr(ie, "_player_cache", None), dict):
+        ie._code_cache, ie._player_cache = _yt_code_cache, _yt_player_cache
+
+def new_ydl(opts: Dict[str, Any]):
+    """YoutubeDL kurar; bellek içi çerez kavanozu varsa kapanışta taze çerezleri havuza işler."""
+    if not load_ytdlp():
+        raise RuntimeError("yt-dlp yüklenemedi: " + _YTDLP_IMPORT_ERROR)
+    ydl = YoutubeDL(opts)
+    share_player_cache(ydl)
+    jar = opts.get("cookiefile")
+    if isinstance(jar, _JarIO):
+        ydl.add_close_hook(jar.absorb)
+    return ydl
+
+# --------- Upstream Governor ---------
+# YouTube'a giden her deneme (extract) önce buradan bütçe alır: genel, player_client başına ve
+# proxy başına token bucket'lar. Durum hız sınırlayıcıyla aynı SQLite dosyasındadır, yani aynı
+# makinedeki tüm worker'lar tek bütçeyi paylaşır. 429 / "sign in to confirm" görülünce ortak
+# "baskı" katsayısı yarıya iner ve tüm bucket'ların dolma hızı onunla çarpılır; katsayı hatasız
+# geçen sürede GOVERNOR_RECOVERY yarı ömrüyle 1'e döner. Uzun bekleme gereken iş, iş parçacığını
+# tutmak yerine park edilir (JobParked) ve vakti gelince kuyruğa baştan girer.
+PRESSURE_KEY = "__pressure__"
+
+class JobParked(JobCancelled):
+    """İş yukarı akış bütçesini beklemek üzere park edildi; `delay` sn sonra yeniden başlar."""
+
+    def __init__(self, delay: float):
+        super().__init__(f"YouTube istek bütçesi dolu; {delay:.0f} sn sonra devam edilecek.")
+        self.delay = delay
+
+def _governor_budget(key: str) -> Optional[Tuple[float, float]]:
+    """Anahtar -> (sn başına dolma, kapasite); 0 dakikalık bütçe = sınırsız (None)."""
+    rpm = GOVERNOR_GLOBAL_RPM if key == "global" else \
+        GOVERNOR_CLIENT_RPM if key.startswith("client:") else GOVERNOR_PROXY_RPM
+    return (rpm / 60.0, max(1.0, rpm / 6.0)) if rpm > 0 else None
+
+class UpstreamGovernor(RateLimiter):
+    """RateLimiter'ın SQLite bağlantısını ve süreç içi yedeğini kullanan, çok anahtarlı ve
+    bloklamayan bütçe: reserve() ya hepsinden birer token alır ya da beklenecek süreyi döner."""
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        if self.shared:
+            try:
+                self._db().execute("CREATE TABLE IF NOT EXISTS upstream "
+                                   "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+            except sqlite3.Error as e:
+                print(f"[governor] SQLite unavailable ({e}); falling back to per-process budget")
+                self.shared = False
+        self._state: Dict[str, Tuple[float, float]] = {}
+
+    @staticmethod
+    def _pressure(row: Optional[Tuple[float, float]], now: float) -> float:
+        if not row:
+            return 1.0
+        p, updated = row
+        if GOVERNOR_RECOVERY <= 0:
+            return p
+        return 1.0 - (1.0 - p) * 0.5 ** ((now - updated) / GOVERNOR_RECOVERY)
+
+    def _transact(self, fn):
+        """fn(get, put) -> sonuç; SQLite'ta tek IMMEDIATE işlemde, yoksa süreç içi kilit altında."""
+        if self.shared:
+            try:
+                conn = self._db()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    result = fn(lambda k: conn.execute("SELECT tokens, updated FROM upstream WHERE key = ?",
+                                                       (k,)).fetchone(),
+                                lambda k, t, u: conn.execute("INSERT OR REPLACE INTO upstream (key, tokens, updated) "
+                                                             "VALUES (?, ?, ?)", (k, t, u)))
+                    conn.execute("COMMIT")
+                    return result
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except sqlite3.Error as e:
+                print(f"[governor] db error: {e}")
+        with self._mem_lock:
+            return fn(self._state.get, lambda k, t, u: self._state.__setitem__(k, (t, u)))
+
+    def reserve(self, keys: List[str]) -> float:
+        """Tüm anahtarlarda token varsa birer tane alır ve 0 döner; yoksa hiçbirinden almaz ve
+        en kısıtlı anahtarın dolmasına kalan süreyi döner."""
+        now = time.time()
+
+        def txn(get, put):
+            pressure = self._pressure(get(PRESSURE_KEY), now)
+            levels, wait_s = {}, 0.0
+            for key in keys:
+                budget = _governor_budget(key)
+                if budget is None:
+                    continue
+                rate, cap = budget[0] * pressure, budget[1]
+                row = get(key)
+                tokens = cap if row is None else min(cap, row[0] + (now - row[1]) * rate)
+                levels[key] = tokens
+                if tokens < 1.0:
+                    wait_s = max(wait_s, (1.0 - tokens) / rate)
+            for key, tokens in levels.items():
+                put(key, tokens - (1.0 if wait_s == 0 else 0.0), now)
+            return wait_s
+
+        return self._transact(txn)
+
+    def feedback(self, ok: bool, error_class: Optional[str] = None) -> None:
+        """Bot/429 işaretinde ortak baskıyı yarıya indirir (en fazla GOVERNOR_MIN_PRESSURE'a)."""
+        if ok or error_class not in IDENTITY_FLAG_CLASSES:
+            return
+        now = time.time()
+
+        def txn(get, put):
+            p = max(GOVERNOR_MIN_PRESSURE, self._pressure(get(PRESSURE_KEY), now) * 0.5)
+            put(PRESSURE_KEY, p, now)
+            return p
+
+        p = self._transact(txn)
+        metrics.inc("ytmp3_governor_backoffs_total", error_class=error_class)
+        print(f"[governor] {error_class}: upstream rate x{p:.2f}")
+
+    def pressure(self) -> float:
+        now = time.time()
+        return self._transact(lambda get, put: self._pressure(get(PRESSURE_KEY), now))
+
+upstream_governor = UpstreamGovernor(RATE_LIMIT_DB)
+
+def governor_keys(clients, ident: Optional[Identity]) -> List[str]:
+    return ["global", f"client:{StrategyScheduler.key(clients)}",
+            f"proxy:{ident.proxy.key if ident and ident.proxy else 'direct'}"]
+
+def governor_wait(job: Optional[Job], keys: List[str], max_wait: Optional[float] = None) -> None:
+    """Deneme öncesi bütçe: kısa beklemeler yerinde (iptal edilebilir) beklenir; uzunsa iş park
+    edilir. İşe bağlı olmayan çağrılar (ör. /stream) en fazla max_wait (varsayılan
+    GOVERNOR_MAX_INLINE_WAIT) bekler."""
+    limit = GOVERNOR_MAX_INLINE_WAIT if max_wait is None else max_wait
+    waited = 0.0
+    while True:
+        job_checkpoint(job)
+        wait_s = upstream_governor.reserve(keys)
+        if wait_s <= 0:
+            if waited:
+                metrics.observe("ytmp3_stage_seconds", waited, stage="governor")
+            return
+        metrics.inc("ytmp3_governor_waits_total", mode="park" if job is not None and wait_s >= GOVERNOR_PARK_AFTER else "inline")
+        if job is not None and wait_s >= GOVERNOR_PARK_AFTER:
+            raise JobParked(wait_s + random.uniform(0, 1))  # aynı anda uyanmasınlar
+        if job is None and waited + wait_s > limit:
+            raise RuntimeError("YouTube istek bütçesi şu an dolu; biraz sonra tekrar deneyin.")
+        job_sleep(job, wait_s)
+        waited += wait_s
+
+# --------- Info Cache ---------
+# Başarılı extract_info sonuçları video ID'sine göre bellekte (LRU) ve diskte (DOWNLOAD_DIR/.info-cache,
+# worker'lar arası ortak) saklanır. Kayıt kazanan stratejiyi (player client) ve kimliği (çerez/proxy)
+# tutar: imzalı format URL'leri çıkış IP'sine bağlıdır, indirme aynı kimlikle yapılır. Kayıt, URL'lerin
+# "expire" zamanından INFO_CACHE_MARGIN önce indirme için bayatlar; başlık/süre/format bilgisi
+# INFO_CACHE_TTL boyunca /info'dan sunulur. Yüklenen (kullanıcıya özel) çerezlerle alınanlar saklanmaz.
+INFO_CACHE_TTL = float(os.environ.get("INFO_CACHE_TTL", "21600"))           # sn
+INFO_CACHE_MAX = max(1, int(os.environ.get("INFO_CACHE_MAX", "256")))       # bellek içi kayıt
+INFO_CACHE_DISK_MAX = max(INFO_CACHE_MAX, int(os.environ.get("INFO_CACHE_DISK_MAX", "4096")))
+INFO_CACHE_MARGIN = 300  # sn; indirme/akış bu sürede tamamlanabilmeli
+INFO_MISS_BUDGET = float(os.environ.get("INFO_MISS_BUDGET", "20"))  # sn; /info önbellek ıskasında toplam süre
+INFO_MISS_ATTEMPTS = 2  # /info önbellek ıskasında denenen en fazla strateji
+INFO_CACHE_DIR = os.path.join(DOWNLOAD_DIR, ".info-cache")
+_INFO_DROP_KEYS = ("thumbnails", "automatic_captions", "subtitles", "heatmap", "description")
+_EXPIRE_RE = re.compile(r"[?&/]expire[=/](\d+)")
+
+def url_expiry(info: Dict[str, Any], fmt: str) -> Optional[float]:
+    """Seçilen formatın (yoksa tüm formatların en erken) imzalı URL son geçerlilik zamanı."""
+    fmts = info.get("formats") or []
+    chosen = [f for f in fmts if f.get("format_id") == fmt] or fmts
+    stamps = [int(m.group(1)) for m in (_EXPIRE_RE.search(f.get("url") or "") for f in chosen) if m]
+    return float(min(stamps)) if stamps else None
+
+class InfoCache:
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.path, self.max_entries, self.ttl = path, max_entries, ttl
+        self._lock = threading.Lock()
+        self._mem: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _file(self, video_id: str) -> str:
+        return os.path.join(self.path, f"{video_id}.json")
+
+    def _remember(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._mem[entry["id"]] = entry
+            self._mem.move_to_end(entry["id"])
+            while len(self._mem) > self.max_entries:
+                self._mem.popitem(last=False)
+
+    def store(self, info: Dict[str, Any], fmt: str, strategy: tuple, ident: Optional[Identity]) -> None:
+        video_id = info.get("id") or ""
+        if not re.fullmatch(r"[A-Za-z0-9_-]{11}", video_id):
+            return
+        if ident is not None and ident.cookie is not None and ident.cookie.kind == "upload":
+            return
+        try:
+            slim = {k: v for k, v in YoutubeDL.sanitize_info(info, remove_private_keys=True).items()
+                    if k not in _INFO_DROP_KEYS}
+            audio = [f for f in slim.get("formats") or [] if f.get("acodec") not in (None, "none")]
+            if audio:
+                slim["formats"] = audio  # choose_format yalnızca sesli formatlara bakar
+            now = time.time()
+            expires = url_expiry(slim, fmt)
+            entry = {"id": video_id, "info": slim, "fmt": fmt, "strategy": strategy[0], "clients": list(strategy[1]),
+                     "cookie": ident.cookie.key if ident and ident.cookie else None,
+                     "proxy": ident.proxy.key if ident and ident.proxy else None,
+                     "stored": now, "urls_expire": min(expires, now + self.ttl) if expires else now + self.ttl}
+            self._remember(entry)
+            os.makedirs(self.path, exist_ok=True)
+            tmp = f"{self._file(video_id)}.{uuid.uuid4().hex[:8]}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp, self._file(video_id))  # diğer worker'lar yarım dosya görmez
+        except Exception as e:
+            print(f"[info] store {video_id} failed: {e}")
+            return
+        metrics.inc("ytmp3_info_cache_total", result="store", use="extract")
+
+    def _load(self, video_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._file(video_id), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def get(self, video_id: Optional[str], for_download: bool = False) -> Optional[Dict[str, Any]]:
+        """for_download: imzalı URL'leri hâlâ geçerli olan kayıt; aksi halde TTL içindeki metadata."""
+        if not video_id:
+            return None
+        use = "download" if for_download else "meta"
+        with self._lock:
+            entry = self._mem.get(video_id)
+            if entry is not None:
+                self._mem.move_to_end(video_id)
+        if entry is None:
+            entry = self._load(video_id)
+            if entry is not None:
+                self._remember(entry)
+        now = time.time()
+        if entry is None or now - entry["stored"] > self.ttl:
+            if entry is not None:
+                self.drop(video_id)
+            metrics.inc("ytmp3_info_cache_total", result="miss", use=use)
+            return None
+        if for_download and entry["urls_expire"] - INFO_CACHE_MARGIN <= now:
+            metrics.inc("ytmp3_info_cache_total", result="stale", use=use)
+            return None
+        metrics.inc("ytmp3_info_cache_total", result="hit", use=use)
+        return entry
+
+    def drop(self, video_id: Optional[str]) -> None:
+        if not video_id:
+            return
+        with self._lock:
+            self._mem.pop(video_id, None)
+        try:
+            os.remove(self._file(video_id))
+        except OSError:
+            pass
+
+    def prune(self) -> None:
+        """Süresi dolan dosyaları ve INFO_CACHE_DISK_MAX üstündeki en eskileri siler (süpürücüden)."""
+        now = time.time()
+        files: List[Tuple[float, str]] = []
+        try:
+            with os.scandir(self.path) as it:
+                for de in it:
+                    mtime = de.stat().st_mtime
+                    if now - mtime > (3600 if de.name.endswith(".tmp") else self.ttl):
+                        os.remove(de.path)
+                    elif de.name.endswith(".json"):
+                        files.append((mtime, de.path))
+        except OSError:
+            return
+        for _, path in sorted(files)[:max(0, len(files) - INFO_CACHE_DISK_MAX)]:
+            try: os.remove(path)
+            except OSError: pass
+
+    def __len__(self) -> int:
+        return len(self._mem)
+
+info_cache = InfoCache(INFO_CACHE_DIR, INFO_CACHE_MAX, INFO_CACHE_TTL)
+
+def download_cached_info(entry: Dict[str, Any], job: Optional[Job] = None, output: str = DEFAULT_OUTPUT) -> Optional[str]:
+    """Önbellekteki info ile extract yapmadan (YouTube'a metadata isteği atmadan) indirir: aynı
+    strateji ve kimlik kullanılır. Kimlik soğuyorsa ya da indirme başarısızsa kayıt düşer, None döner."""
+    ident = identity_pool.find(entry["cookie"], entry["proxy"])
+    strategy = strategy_by_name(entry["strategy"])
+    if ident is None or strategy is None:
+        return None
+    print(f"[info] {entry['id']} from cache ({strategy[0]}, {ident.label})")
+    job_event(job, "strategy", name=strategy[0], clients=strategy[1], cached=True)
+    try:
+        with new_ydl(strategy_opts(strategy, ident, job, output)) as ydl:
+            filename = download_and_locate(ydl, copy.deepcopy(entry["info"]), entry["fmt"], output, job)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        job_checkpoint(job)
+        info_cache.drop(entry["id"])
+        metrics.inc("ytmp3_info_cache_total", result="failed", use="download")
+        print(f"[info] cached download {entry['id']} failed ({classify_error(e)}); extracting again")
+        return None
+    return filename
+
+def lookup_info(url: str) -> Tuple[Dict[str, Any], bool]:
+    """(kayıt, önbellekten_mi). Önbellekte yoksa en iyi INFO_MISS_ATTEMPTS strateji bekleme yapmadan
+    denenir (race_extract); istek iş parçacığı INFO_MISS_BUDGET saniyeden uzun tutulmaz."""
+    entry = info_cache.get(extract_video_id(url))
+    if entry:
+        return entry, True
+    if not YTDLP_AVAILABLE:
+        raise RuntimeError("yt-dlp eksik. 'pip install -U yt-dlp'")
+    ident = identity_pool.acquire()
+    strategies = strategy_scheduler.order(STRATEGIES)[:INFO_MISS_ATTEMPTS]
+    winner, _, errors = race_extract(url, strategies, ident, deadline=time.time() + INFO_MISS_BUDGET)
+    if not winner:
+        msg = str(errors[-1][1]) if errors else f"{INFO_MISS_BUDGET:.0f} sn içinde yanıt alınamadı"
+        raise RuntimeError(f"Metadata alınamadı. Son hata: {msg}")
+    st, ydl, info, _, extract_latency = winner
+    ydl.close()
+    strategy_scheduler.record(st[1], True, extract_latency)
+    identity_pool.record(ident, True)
+    entry = info_cache.get(info.get("id"))
+    if entry is None:
+        raise RuntimeError("Metadata önbelleğe alınamadı.")
+    return entry, False
+
+# --------- Core Download ---------
+STRATEGY_PARAM = "ytmp3_strategy"  # ydl.params içinde strateji adı (günlük için)
+
+def strategy_opts(strategy: tuple, ident: Optional[Identity], job: Optional[Job] = None,
+                  output: str = DEFAULT_OUTPUT) -> Dict[str, Any]:
+    name, clients, use_po, aggr, _, extra_opts = strategy
+    opts = build_opts(player_clients=clients, identity=ident, postprocess=True,
+                      use_po_token=use_po, aggressive_bypass=aggr, output=output)
+    for k,v in extra_opts.items():
+        if isinstance(v, dict) and isinstance(opts.get(k), dict):
+            opts[k].update(v)
+        else:
+            opts[k] = v
+    opts[STRATEGY_PARAM] = name
+    return attach_job(opts, job)
+
+def open_strategy(strategy: tuple, url: str, ident: Optional[Identity], job: Optional[Job] = None,
+                  output: str = DEFAULT_OUTPUT):
+    """Stratejinin YoutubeDL'ini kurar ve metadata'yı çıkarır. Açık ydl, info, seçilen format ve
+    extract süresi döner; indirme aynı ydl üzerinden yapılmalı, sonra ydl kapatılmalıdır.
+    Başarılı sonuç bilgi önbelleğine de yazılır."""
+    t0 = time.time()
+    ydl = new_ydl(strategy_opts(strategy, ident, job, output))
+    try:
+        with timed("extract"):
+            info = ydl.extract_info(url, download=False)
+        if not info:
+            raise DownloadError("Video metadata extraction failed")
+        if info.get("is_live"):
+            raise DownloadError("Live streams are not supported")
+        availability = info.get("availability")
+        if availability in {"private","premium_only","subscriber_only","needs_auth","unavailable"}:
+            raise DownloadError(f"Video is not accessible: {availability}")
+        fmt = choose_format(info)
+        info_cache.store(info, fmt, strategy, ident)
+        return ydl, info, fmt, time.time() - t0
+    except BaseException:
+        ydl.close()
+        raise
+
+def download_and_locate(ydl, info: Dict[str, Any], fmt: str, output: str = DEFAULT_OUTPUT,
+                        job: Optional[Job] = None) -> str:
+    """İndirmeyi bu çağrıya özel bir çalışma dizinine yapar; son dosyanın yolu yt-dlp'nin
+    post/postprocessor/progress hook'larından okunur ve dosya DOWNLOAD_DIR'e taşınır.
+    Eşzamanlı indirmeler birbirinin dosyasını göremez; maliyet diskteki dosya sayısından bağımsızdır."""
+    produced: Dict[str, str] = {}
+    marks: Dict[str, float] = {}
+
+    def on_progress(d: Dict[str, Any]) -> None:
+        if d.get("status") == "downloading":
+            marks.setdefault("dl_start", time.perf_counter())
+        if d.get("status") == "finished" and d.get("filename"):
+            produced["download"] = d["filename"]
+            marks["downloaded"] = time.perf_counter()
+            marks["bytes"] = d.get("total_bytes") or d.get("downloaded_bytes") or 0
+            marks["elapsed"] = d.get("elapsed") or (marks["downloaded"] - marks.get("dl_start", marks["downloaded"]))
+
+    def on_postprocess(d: Dict[str, Any]) -> None:
+        transcode = d.get("postprocessor") != "MoveFiles"  # dosya taşıma ffmpeg süresine sayılmaz
+        if d.get("status") == "started" and transcode:
+            marks.setdefault("pp_start", time.perf_counter())
+            marks.setdefault("cpu_start", children_cpu())
+        if d.get("status") == "finished" and (d.get("info_dict") or {}).get("filepath"):
+            produced["postprocess"] = d["info_dict"]["filepath"]
+            if transcode:
+                marks["pp_end"] = time.perf_counter()
+                marks["cpu_end"] = children_cpu()
+
+    def on_final(filepath: str) -> None:
+        produced["final"] = filepath
+
+    # Opus her zaman indirmeden sonra transcode_file ile kodlanır; yt-dlp yalnızca kaynağı getirir
+    fetch = "source" if output.startswith("opus-") and ffmpeg_available() else output
+    reserve_space(estimate_output_bytes(info, fmt, output))
+    work = journal.claim_partial(info["id"], fmt) if info.get("id") else None
+    if work:
+        print(f"[journal] resuming {info['id']} ({fmt}) in {os.path.basename(work)}")
+        job_event(job, "resume", video_id=info["id"], format=fmt)
+    else:
+        work = tempfile.mkdtemp(prefix=WORKDIR_PREFIX, dir=DOWNLOAD_DIR)
+    journal.track_partial(work, job, info, fmt, ydl.params.get(STRATEGY_PARAM))
+    ydl.params.setdefault("paths", {})["home"] = work
+    ydl.add_progress_hook(on_progress)
+    ydl.add_postprocessor_hook(on_postprocess)
+    ydl.add_post_hook(on_final)
+    tuning = ydl.params.get(TUNE_PARAM)
+    try:
+        t0 = time.perf_counter()
+        try:
+            download_from_info(ydl, info, fmt)
+        except Exception as e:
+            if tuning and (classify_error(e) in ("rate_limit", "network") or "http error 403" in str(e).lower()):
+                download_tuner.penalize(*tuning, classify_error(e))
+            raise
+        metrics.observe("ytmp3_stage_seconds", marks.get("downloaded", time.perf_counter()) - t0, stage="download")
+        if tuning and marks.get("bytes", 0) >= TUNE_MIN_BYTES and marks.get("elapsed"):
+            mbps = download_tuner.record(*tuning, marks["bytes"], marks["elapsed"])
+            job_event(job, "throughput", mbps=round(mbps, 2), fragments=tuning[1][0], chunk_kb=tuning[1][1] // 1024)
+            print(f"[tune] {tuning[0]} {tuning[1][0]}x{tuning[1][1] // 1024}K: {mbps:.2f} MB/s")
+        if "pp_start" in marks:
+            metrics.observe("ytmp3_stage_seconds", marks.get("pp_end", time.perf_counter()) - marks["pp_start"],
+                            stage="postprocess")
+        path = produced.get("final") or produced.get("postprocess") or produced.get("download")
+        if not path or not os.path.isfile(path):
+            raise DownloadError("İndirilen dosya bulunamadı.")
+        filename = output_filename(os.path.basename(path), fetch)
+        os.replace(path, os.path.join(DOWNLOAD_DIR, filename))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+        journal.drop_partial(work)
+    index_file(filename)
+    if fetch != output:
+        return transcode_file(filename, output, job)
+    # ffmpeg çocuk süreçlerinin CPU'su (eşzamanlı kodlamalarda yaklaşık; toplamda doğru)
+    cpu = max(0.0, marks.get("cpu_end", 0.0) - marks.get("cpu_start", 0.0))
+    if is_encoded(output) and filename.endswith("." + output.split("-", 1)[0]):
+        produced_output = output
+    else:
+        produced_output = "remux" if output == "remux" else "source"
+    if produced_output == "source" and is_encoded(str((job.kwargs if job else {}).get("output", ""))):
+        return filename  # kodlama havuzu için ara kaynak: maliyeti orada kaydedilir
+    saved = record_output(produced_output, float(info.get("duration") or 0), cpu)
+    job_event(job, "output", output=produced_output, transcoded=is_encoded(produced_output),
+              cpu_s=round(cpu, 2), cpu_saved_s=round(saved, 2))
+    return filename
+
+# --------- Strategy Racing ---------
+# İsteğe bağlı: en iyi k stratejinin extract_info çağrıları kademeli (hedged) başlatılır, ilk
+# kullanılabilir info kazanır. İlk deneme her zaman serbesttir (sıralı moddaki istekle aynı);
+# önceki deneme hâlâ sürerken açılan her ek deneme RACE_BUDGET_PER_MIN bütçesinden yer.
+RACE_TOP_K = int(os.environ.get("STRATEGY_RACE_TOP_K", "0"))               # 0/1 = kapalı
+RACE_CONCURRENCY = max(1, int(os.environ.get("STRATEGY_RACE_CONCURRENCY", "2")))
+RACE_HEDGE_DELAY = float(os.environ.get("STRATEGY_RACE_HEDGE_DELAY", "4"))  # sn
+RACE_BUDGET_PER_MIN = float(os.environ.get("STRATEGY_RACE_BUDGET", "20"))    # ek extract / dk
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, capacity: float):
+        self.rate = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def take(self, n: float = 1.0) -> bool:
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= n:
+                self.tokens -= n
+                return True
+            return False
+
+race_budget = TokenBucket(RACE_BUDGET_PER_MIN / 60.0, max(1.0, RACE_BUDGET_PER_MIN / 6.0))
+_race_pool: Optional[ThreadPoolExecutor] = None
+_race_pool_lock = threading.Lock()
+
+def _race_executor() -> ThreadPoolExecutor:
+    global _race_pool
+    with _race_pool_lock:
+        if _race_pool is None:
+            _race_pool = ThreadPoolExecutor(max_workers=RACE_CONCURRENCY * JOB_WORKERS,
+                                            thread_name_prefix="race")
+        return _race_pool
+
+def _discard_racer(strategy: tuple, t0: float):
+    def cb(fut: Future) -> None:
+        if fut.cancelled():
+            return
+        try:
+            ydl, _, _, extract_latency = fut.result()
+        except Exception as e:
+            strategy_scheduler.record(strategy[1], False, time.time() - t0, classify_error(e))
+            return
+        ydl.close()
+        strategy_scheduler.record(strategy[1], True, extract_latency)
+    return cb
+
+def race_extract(url: str, strategies: List[tuple], ident: Optional[Identity], job: Optional[Job] = None,
+                 output: str = DEFAULT_OUTPUT, deadline: Optional[float] = None):
+    """(kazanan, denenenler, hatalar) döner. kazanan = (strategy, ydl, info, fmt, extract_latency) ya da None.
+    deadline (time.time()) verilirse o ana kadar kazanan çıkmazsa süren denemeler bırakılıp None döner."""
+    pool = _race_executor()
+    todo = list(strategies)
+    pending: Dict[Future, Tuple[tuple, float]] = {}
+    tried: List[tuple] = []
+    errors: List[Tuple[tuple, Exception]] = []
+    winner = None
+    next_hedge = 0.0
+    try:
+        while winner is None and (todo or pending) and (deadline is None or time.time() < deadline):
+            job_checkpoint(job)
+            now = time.time()
+            if todo and not pending:
+                # ilk deneme bütçeyi bekler
+                governor_wait(job, governor_keys(todo[0][1], ident), None if deadline is None else deadline - now)
+                now = time.time()
+            if todo and len(pending) < RACE_CONCURRENCY and (
+                    not pending or (now >= next_hedge and race_budget.take()
+                                    and upstream_governor.reserve(governor_keys(todo[0][1], ident)) == 0)):
+                st = todo.pop(0)
+                tried.append(st)
+                print(f"[race] start {st[0]}" + (" (hedge)" if pending else ""))
+                job_event(job, "strategy", name=st[0], clients=st[1], hedge=bool(pending))
+                pending[pool.submit(open_strategy, st, url, ident, job, output)] = (st, now)
+                next_hedge = now + RACE_HEDGE_DELAY
+                continue
+            timeout = min(0.5, max(0.05, next_hedge - now)) if todo else 0.5
+            if deadline is not None:
+                timeout = max(0.05, min(timeout, deadline - now))
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            for fut in done:
+                st, t0 = pending.pop(fut)
+                try:
+                    result = fut.result()
+                except JobCancelled:
+                    raise
+                except Exception as e:
+                    err_class = classify_error(e)
+                    strategy_scheduler.record(st[1], False, time.time() - t0, err_class)
+                    identity_pool.record(ident, False, err_class)
+                    errors.append((st, e))
+                    print(f"[race] {st[0]} failed ({err_class})")
+                    if err_class == "unavailable":
+                        todo.clear()
+                    continue
+                if winner is None:
+                    winner = (st,) + tuple(result)
+                    print(f"[race] winner {st[0]} in {result[3]:.1f}s")
+                else:
+                    result[0].close()
+    finally:
+        # Kaybedenler: başlamamışsa iptal, sürüyorsa bitince ydl kapatılır.
+        for fut, (st, t0) in pending.items():
+            if not fut.cancel():
+                fut.add_done_callback(_discard_racer(st, t0))
+    return winner, tried, errors
+
+def run_download(url: str, job: Optional[Job] = None, output: str = DEFAULT_OUTPUT) -> str:
+    if not YTDLP_AVAILABLE:
+        raise RuntimeError("yt-dlp bulunamadı. Sunucu yöneticisine iletin: pip install -U yt-dlp\nDetay: " + _YTDLP_IMPORT_ERROR)
+    if not url:
+        raise ValueError("URL boş olamaz.")
+    if not is_valid_youtube_url(url):
+        raise ValueError("Geçerli bir YouTube URL'si giriniz.")
+
+    entry = info_cache.get(extract_video_id(url), for_download=True)
+    if entry:
+        filename = download_cached_info(entry, job, output)
+        if filename:
+            return filename
+
+    ident = identity_pool.acquire(job)
+
+    strategies = strategy_scheduler.order(STRATEGIES)
+    print("[sched] order: " + ", ".join(st[0] for st in strategies))
+
+    last_err: Optional[Exception] = None
+
+    if RACE_TOP_K > 1:
+        winner, tried, errors = race_extract(url, strategies[:RACE_TOP_K], ident, job, output)
+        if errors:
+            last_err = errors[-1][1]
+        if winner:
+            st, ydl, info, fmt, extract_latency = winner
+            try:
+                with ydl:
+                    filename = download_and_locate(ydl, info, fmt, output, job)
+                strategy_scheduler.record(st[1], True, extract_latency)
+                identity_pool.record(ident, True)
+                return filename
+            except JobCancelled:
+                raise
+            except Exception as e:
+                job_checkpoint(job)
+                last_err = e
+                strategy_scheduler.record(st[1], False, extract_latency, classify_error(e))
+                identity_pool.record(ident, False, classify_error(e))
+        if any(classify_error(e) in IDENTITY_FLAG_CLASSES for _, e in errors):
+            ident = identity_pool.acquire(job, exclude=ident)
+        if any(classify_error(e) == "unavailable" for _, e in errors):
+            strategies = []
+        else:
+            strategies = [st for st in strategies if st not in tried]
+
+    for idx, strategy in enumerate(strategies, start=1):
+        name, clients = strategy[:2]
+        governor_wait(job, governor_keys(clients, ident))  # denemeler arası bekleme ortak bütçeden gelir
+        job_event(job, "strategy", name=name, clients=clients, attempt=idx)
+        t0 = time.time()
+        extract_latency: Optional[float] = None
+        try:
+            ydl, info, fmt, extract_latency = open_strategy(strategy, url, ident, job, output)
+            with ydl:
+                # Download (aynı info üzerinden)
+                filename = download_and_locate(ydl, info, fmt, output, job)
+            strategy_scheduler.record(clients, True, extract_latency)
+            identity_pool.record(ident, True)
+            return filename
+
+        except JobCancelled:
+            raise
+        except Exception as e:
+            job_checkpoint(job)  # yt-dlp hook istisnasını sarmalamış olabilir
+            last_err = e
+            err_class = classify_error(e)
+            strategy_scheduler.record(clients, False, extract_latency or (time.time() - t0), err_class)
+            identity_pool.record(ident, False, err_class)
+            print(f"[sched] {name} failed ({err_class})")
+            if err_class in IDENTITY_FLAG_CLASSES:
+                # işaretlenen kimlik soğuyor, ortak bütçe yavaşladı; sıradakiyle devam (bekleme governor'da)
+                ident = identity_pool.acquire(job, exclude=ident)
+            elif err_class == "unavailable":
+                break
+            continue
+
+    # Emergency (multi-client + PO)
+    if YTDLP_AVAILABLE:
+        ident = identity_pool.acquire(job, exclude=ident)
+        governor_wait(job, governor_keys(EMERGENCY_CLIENTS, ident))
+        job_event(job, "strategy", name="Emergency", clients=EMERGENCY_CLIENTS)
+        t0 = time.time()
+        extract_latency = None
+        try:
+            fx, info, fmt, extract_latency = open_strategy(EMERGENCY_STRATEGY, url, ident, job, output)
+            with fx:
+                filename = download_and_locate(fx, info, fmt, output, job)
+            strategy_scheduler.record(EMERGENCY_CLIENTS, True, extract_latency)
+            identity_pool.record(ident, True)
+            return filename
+        except JobCancelled:
+            raise
+        except Exception as e:
+            job_checkpoint(job)
+            strategy_scheduler.record(EMERGENCY_CLIENTS, False, extract_latency or (time.time() - t0), classify_error(e))
+            identity_pool.record(ident, False, classify_error(e))
+
+    msg = str(last_err) if last_err else ("yt-dlp eksik" if not YTDLP_AVAILABLE else "Bilinmeyen hata")
+    low = msg.lower()
+    if not YTDLP_AVAILABLE:
+        hint = "\n\n[SETUP] Sunucuda yt-dlp kurulu değil: pip install -U yt-dlp"
+    elif "failed to extract any player response" in low:
+        hint = ("\n\n[FIX] PLAYER RESPONSE ERROR:"
+                "\n• yt-dlp güncelle"
+                "\n• Chrome'dan cookies.txt export edip yükle"
+                "\n• Residential proxy (YTDLP_PROXY)"
+                "\n• PO token (YTDLP_PO_TOKEN + YTDLP_VISITOR_DATA)")
+    elif "bot" in low or "sign in to confirm" in low:
+        hint = "\n\n[BOT] Doğrulama gerekiyor: taze cookies.txt + residential proxy"
+    elif any(k in low for k in ["private","unavailable"]):
+        hint = "\n\n[UNAVAIL] Video özel/kaldırılmış/geo-engelli olabilir."
+    elif any(k in low for k in ["rate","limit","quota"]):
+        hint = "\n\n[RATE] Limit aşıldı. 30-60 dk sonra tekrar deneyin."
+    else:
+        hint = "\n\n[GENERAL] URL/çerez/proxy ayarlarını kontrol edin; tekrar deneyin."
+    raise RuntimeError(f"Tüm bypass stratejileri başarısız. Son hata: {msg}{hint}")
+
+# --------- Streaming ---------
+# /stream: seçilen ses formatı ffmpeg'e borulanır ve istenen profilde (MP3 ya da Ogg/Opus) parça
+# parça istemciye akar; dosyanın tamamı diske inmeden ilk baytlar gelir. Profil verilmezse
+# STREAM_BITRATE'te MP3. STREAM_TEE açıksa aynı akış önbelleğe de yazılır.
+STREAM_TEE = os.environ.get("STREAM_TEE", "1").lower() in ("1","true","yes","on")
+STREAM_BITRATE = os.environ.get("STREAM_BITRATE", "192k")
+try:
+    STREAM_OUTPUT = parse_output("mp3", STREAM_BITRATE)  # varsayılan akış profili
+except ValueError:
+    print(f"[CFG] invalid STREAM_BITRATE={STREAM_BITRATE!r}; using {DEFAULT_MP3_BITRATE}k")
+    STREAM_OUTPUT = f"mp3-{DEFAULT_MP3_BITRATE}"
+STREAM_MIMETYPES = {"mp3": "audio/mpeg", "opus": "audio/ogg"}
+STREAM_CHUNK = 64 * 1024
+STREAM_MAX_STRATEGIES = max(1, int(os.environ.get("STREAM_MAX_STRATEGIES", "4")))
+
+def extract_for_stream(url: str, output: str = STREAM_OUTPUT) -> Dict[str, Any]:
+    """Önbellekte imzalı URL'leri geçerli bir info varsa onu (aynı kimlikle) kullanır; yoksa
+    stratejileri bekleme yapmadan dener (race_extract, yarış kapalıyken sıralı çalışır).
+    ffmpeg'e verilecek kaynak URL'yi, başlıkları ve hedef dosya adını döner."""
+    if not YTDLP_AVAILABLE:
+        raise RuntimeError("yt-dlp eksik. 'pip install -U yt-dlp'")
+    entry = info_cache.get(extract_video_id(url), for_download=True)
+    ident = identity_pool.find(entry["cookie"], entry["proxy"]) if entry else None
+    st = strategy_by_name(entry["strategy"]) if entry else None
+    if ident is not None and st is not None:
+        ydl = new_ydl(strategy_opts(st, ident, output=output))
+        info, fmt = copy.deepcopy(entry["info"]), entry["fmt"]
+    else:
+        ident = identity_pool.acquire()
+        strategies = strategy_scheduler.order(STRATEGIES)[:max(STREAM_MAX_STRATEGIES, RACE_TOP_K)]
+        winner, _, errors = race_extract(url, strategies, ident)
+        if not winner:
+            msg = str(errors[-1][1]) if errors else "Bilinmeyen hata"
+            raise RuntimeError(f"Akış için metadata alınamadı. Son hata: {msg}")
+        st, ydl, info, fmt, extract_latency = winner
+        strategy_scheduler.record(st[1], True, extract_latency)
+        identity_pool.record(ident, True)
+    with ydl:
+        f = next((x for x in info.get("formats") or [] if x.get("format_id") == fmt), None) or info
+        if not f.get("url"):
+            raise RuntimeError("Seçilen format için doğrudan URL yok.")
+        headers = {k: v for k, v in (f.get("http_headers") or info.get("http_headers") or {}).items()
+                   if k.lower() not in ("accept-encoding", "connection")}  # ffmpeg br/gzip çözmez
+        cookie_header = ydl.cookiejar.get_cookie_header(f["url"])
+        if cookie_header:
+            headers["Cookie"] = cookie_header
+        codec = output.split("-", 1)[0]
+        target = output_filename(os.path.splitext(os.path.basename(ydl.prepare_filename(info)))[0] + "." + codec,
+                                 output)
+    return {"id": info.get("id"), "title": info.get("title") or "audio", "src": f["url"], "output": output,
+            "headers": headers, "proxy": ident.proxy_url, "filename": target, "estimate": estimate_output_bytes(info, fmt, output)}
+
+def ffmpeg_stream_cmd(src: str, headers: Dict[str, str], output: str, proxy: Optional[str] = None) -> List[str]:
+    cmd = [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-nostdin"]
+    if headers:
+        cmd += ["-headers", "".join(f"{k}: {v}\r\n" for k, v in headers.items())]
+    if proxy and proxy.startswith("http"):
+        cmd += ["-http_proxy", proxy]  # çerezler ve URL bu kimliğe bağlı; aynı çıkıştan indirilmeli
+    encoder, muxer = ENCODERS[output.split("-", 1)[0]]
+    cmd += ["-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5",
+            "-i", src, "-vn", "-c:a", encoder, "-b:a", f"{output_kbps(output)}k", "-f", muxer, "pipe:1"]
+    return cmd
+
+def stream_audio(meta: Dict[str, Any], tee: bool = STREAM_TEE):
+    """ffmpeg çıktısını STREAM_CHUNK'lık parçalar halinde verir. İstemci koparsa ffmpeg
+    öldürülür ve yarım dosya silinir; akış temiz biterse dosya önbelleğe kaydedilir."""
+    errlog = tempfile.TemporaryFile()  # stderr borusu dolup stdout akışını kilitlemesin
+    proc = subprocess.Popen(ffmpeg_stream_cmd(meta["src"], meta["headers"], meta["output"], meta.get("proxy")),
+                            stdout=subprocess.PIPE, stderr=errlog)
+    final_path = os.path.join(DOWNLOAD_DIR, meta["filename"])
+    part_path = f"{final_path}.{uuid.uuid4().hex[:8]}.part"  # eşzamanlı akışlar çakışmasın
+    if tee:
+        reserve_space(meta.get("estimate") or 0)
+    out = open(part_path, "wb") if tee else None
+    ok = False
+    sent, t0 = 0, time.perf_counter()
+    try:
+        while True:
+            chunk = proc.stdout.read(STREAM_CHUNK)
+            if not chunk:
+                break
+            if out:
+                out.write(chunk)
+            sent += len(chunk)
+            yield chunk
+        ok = proc.wait() == 0
+        if not ok:
+            errlog.seek(max(0, errlog.seek(0, os.SEEK_END) - 300))
+            print(f"[stream] ffmpeg failed: {errlog.read().decode(errors='ignore').strip()}")
+            info_cache.drop(meta.get("id"))  # imzalı URL reddedilmiş olabilir; sonraki istek yeniden çıkarır
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close(); errlog.close()
+        metrics.inc("ytmp3_served_bytes_total", sent, route="stream")
+        metrics.observe("ytmp3_stage_seconds", time.perf_counter() - t0, stage="stream")
+        if out:
+            out.close()
+            if ok:
+                os.replace(part_path, final_path)
+                index_file(meta["filename"])
+                if meta.get("id"):
+                    cache_store(meta["id"], meta["filename"])
+                print(f"[stream] cached {meta['filename']}")
+            else:
+                try: os.remove(part_path)
+                except OSError: pass
+
+# --------- Batch ---------
+# /batch: link listesi ve/veya playlist linkleri tek bir işte toplanır. Playlist'ler tek bir düz
+# (extract_flat) çağrıyla video ID'lerine açılır; öğeler ayrı alt işler olarak BATCH_CONCURRENCY
+# genişliğinde bir havuzda cached_download ile koşar, yani çerez, proxy, strateji skorları ve
+# sonuç önbelleği tekli indirmelerle ortaktır. Sonuç, öğeler bittikçe yazılan akışlı bir ZIP'tir.
+_PLAYLIST_RE = re.compile(r'[?&]list=([A-Za-z0-9_-]+)')
+
+def is_batch_input(url: str) -> bool:
+    return is_valid_youtube_url(url) or bool(_PLAYLIST_RE.search(url))
+
+def expand_playlist(url: str, job: Optional[Job] = None) -> List[str]:
+    if not YTDLP_AVAILABLE:
+        raise RuntimeError("yt-dlp eksik. 'pip install -U yt-dlp'")
+    clients = strategy_scheduler.order(STRATEGIES)[0][1]
+    ident = identity_pool.acquire(job)
+    governor_wait(job, governor_keys(clients, ident))
+    opts = build_opts(player_clients=clients, identity=ident, postprocess=False)
+    opts.update(noplaylist=False, extract_flat="in_playlist", playlistend=BATCH_MAX_ITEMS)
+    with new_ydl(opts) as ydl:
+        info = ydl.extract_info(url, download=False) or {}
+    urls = []
+    for e in info.get("entries") or []:
+        vid = (e or {}).get("id")
+        if vid and re.fullmatch(r'[A-Za-z0-9_-]{11}', vid):
+            urls.append(f"https://www.youtube.com/watch?v={vid}")
+        elif e and e.get("url"):
+            urls.append(e["url"])
+    print(f"[batch] playlist {_PLAYLIST_RE.search(url).group(1)}: {len(urls)} items")
+    return urls
+
+def expand_batch(inputs: List[str], job: Optional[Job] = None) -> List[str]:
+    """Girdileri tekil, kanonik video linklerine açar (en fazla BATCH_MAX_ITEMS)."""
+    urls: List[str] = []
+    seen = set()
+    for raw in inputs:
+        job_checkpoint(job)
+        if _PLAYLIST_RE.search(raw):
+            try:
+                found = expand_playlist(raw, job)
+            except Exception as e:
+                print(f"[batch] playlist expand failed: {e}")
+                found = [raw] if is_valid_youtube_url(raw) else []
+        else:
+            found = [raw]
+        for u in found:
+            vid = extract_video_id(u)
+            if vid and vid not in seen:
+                seen.add(vid)
+                urls.append(f"https://www.youtube.com/watch?v={vid}")
+                if len(urls) >= BATCH_MAX_ITEMS:
+                    return urls
+    return urls
+
+def run_batch(inputs: List[str], job: Optional[Job] = None, output: str = DEFAULT_OUTPUT) -> Optional[str]:
+    urls = expand_batch(inputs, job)
+    if not urls:
+        raise ValueError("Listede indirilebilir YouTube videosu bulunamadı.")
+    children = [Job(cached_download, (u,), {"output": output}, parent=job) for u in urls]
+    with _jobs_lock:
+        for c in children:
+            jobs[c.id] = c
+    if job is not None:
+        job.children = children
+        job_checkpoint(job)
+    total, ok, failed = len(children), 0, 0
+    job_event(job, "batch", total=total, done=0, ok=0, failed=0)
+    with ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY, thread_name_prefix="batch") as ex:
+        # öğe indirmesi bitince havuz sıradakine geçer; MP3 kodlaması arka planda sürebilir
+        for c in children:
+            c.executor = ex
+            ex.submit(_run_job, c)
+        futures = {c.completion: i for i, c in enumerate(children)}
+        for fut in as_completed(futures):
+            c = children[futures[fut]]
+            if c.state == "done":
+                ok += 1
+            else:
+                failed += 1
+            job_event(job, "batch", total=total, done=ok + failed, ok=ok, failed=failed,
+                      index=futures[fut], state=c.state, filename=c.result, error=c.error)
+    print(f"[batch] {ok}/{total} ok, {failed} failed")
+    job_checkpoint(job)
+    if not ok:
+        raise RuntimeError(f"Listedeki {total} videonun hiçbiri indirilemedi.")
+    return None
+
+def iter_batch_results(job: Job):
+    """Toplu işin biten öğelerini bitiş sırasıyla verir; bitmeyenler için işin olaylarını bekler."""
+    sent = set()
+    while True:
+        seq = job.last_seq
+        for c in list(job.children):
+            if c.terminal and c.id not in sent:
+                sent.add(c.id)
+                yield c
+        if job.terminal and len(sent) == len(job.children):
+            return
+        job.events_since(seq, timeout=5.0)
+
+class _ZipSink(io.RawIOBase):
+    """zipfile'ın yazdığı baytları biriktirir; drain() ile akışa verilir. seek() olmadığından
+    zipfile yerel başlıklardan sonra data descriptor yazar, arşiv tek geçişte oluşur."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def stream_batch_zip(job: Job):
+    """Öğeler bittikçe dosyalarını STREAM_CHUNK'lık parçalarla (sıkıştırmadan) ZIP'e yazar;
+    bellekte en fazla bir parça tutulur."""
+    sink = _ZipSink()
+    names = set()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for child in iter_batch_results(job):
+            if child.state != "done" or not child.result or child.result in names:
+                continue
+            entry = lookup_file(child.result)
+            if not entry:
+                continue
+            try:
+                src = open(os.path.join(DOWNLOAD_DIR, child.result), "rb")
+            except FileNotFoundError:
+                drop_cached_file(child.result)
+                continue
+            names.add(child.result)
+            zinfo = zipfile.ZipInfo(child.result, date_time=time.localtime(entry["mtime"])[:6])
+            with src, zf.open(zinfo, "w", force_zip64=True) as dst:
+                while True:
+                    chunk = src.read(STREAM_CHUNK)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+    metrics.inc("ytmp3_served_bytes_total", sink.tell(), route="zip")
+
+# --------- Flask Routes ---------
+@app.errorhandler(413)
+def too_large(e):
+    return jsonify(error="Dosya çok büyük. Maksimum 16MB."), 413
+
+@app.errorhandler(500)
+def internal_error(e):
+    return jsonify(error="Sunucu hatası. Lütfen tekrar deneyin."), 500
+
+@app.before_request
+def _metrics_start():
+    start_services()
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _metrics_observe(resp):
+    t0 = getattr(g, "t0", None)
+    if t0 is not None:
+        elapsed = time.perf_counter() - t0
+        metrics.observe("ytmp3_http_request_seconds", elapsed,
+                        endpoint=request.endpoint or "unknown", status=str(resp.status_code))
+        if "first_request_s" not in BOOT:
+            BOOT["first_request_s"] = round(elapsed, 4)
+            BOOT["first_request_after_s"] = round(t0 - _services_at, 3)
+    return resp
+
+@app.get("/metrics")
+def metrics_endpoint():
+    stats, cache = job_stats(), disk_cache_stats()
+    sched, pool = strategy_scheduler.snapshot(), transcode_pool.stats()
+    idents, kinds = identity_pool.snapshot(), {"cookies": "cookie", "proxies": "proxy"}
+    gauges = {
+        "ytmp3_jobs_queued": ("Jobs waiting in the queue.", {(): stats["queued"]}),
+        "ytmp3_jobs_running": ("Jobs currently running.", {(): stats["running"]}),
+        "ytmp3_jobs_parked": ("Jobs parked waiting for upstream budget.", {(): stats["parked"]}),
+        "ytmp3_governor_pressure": ("Upstream rate multiplier (1 = full budget).", {(): upstream_governor.pressure()}),
+        "ytmp3_job_queue_capacity": ("Configured queue depth.", {(): JOB_QUEUE_DEPTH}),
+        "ytmp3_inflight_downloads": ("Distinct videos being downloaded.", {(): len(_inflight)}),
+        "ytmp3_transcode_queued": ("MP3 encodes waiting for a transcode slot.", {(): pool["queued"]}),
+        "ytmp3_transcode_running": ("ffmpeg encodes currently running in the pool.", {(): pool["running"]}),
+        "ytmp3_transcode_workers": ("Configured transcode pool size.", {(): pool["workers"]}),
+        "ytmp3_sse_streams": ("Open SSE connections.", {(): _sse_streams}),
+        "ytmp3_cache_files": ("Files in the download cache index.", {(): cache["files"]}),
+        "ytmp3_cache_bytes": ("Bytes used by the download cache.", {(): cache["used_bytes"]}),
+        "ytmp3_cache_quota_bytes": ("Download cache quota.", {(): cache["quota_bytes"]}),
+        "ytmp3_disk_free_bytes": ("Free bytes on the download volume.", {(): _disk_free()}),
+        "ytmp3_identity_score": ("Decayed success score per cookie jar / proxy.",
+                                 {(("kind", kinds[k]), ("key", key)): v["score"] for k, ms in idents.items() for key, v in ms.items()}),
+        "ytmp3_identity_cooldown_seconds": ("Remaining cooldown per cookie jar / proxy.",
+                                            {(("kind", kinds[k]), ("key", key)): v["cooldown_remaining_s"]
+                                             for k, ms in idents.items() for key, v in ms.items()}),
+        "ytmp3_strategy_score": ("Decayed success score per player client.",
+                                 {(("client", k),): v["score"] for k, v in sched.items()}),
+        "ytmp3_strategy_cooldown_seconds": ("Remaining cooldown per player client.",
+                                            {(("client", k),): v["cooldown_remaining_s"] for k, v in sched.items()}),
+        "ytmp3_boot_seconds": ("Worker boot profile by stage (see /health boot).",
+                               {(("stage", k[:-2]),): v for k, v in BOOT.items()}),
+        "ytmp3_download_best_mbps": ("Best measured download throughput per path (MB/s).",
+                                     {(("path", k),): v["best"]["mbps"] for k, v in download_tuner.snapshot().items()}),
+    }
+    return Response(metrics.render(gauges), mimetype="text/plain; version=0.0.4")
+
+@app.get("/health")
+def health():
+    return jsonify(
+        ok=True,
+        server_mode=SERVER_MODE,
+        yt_dlp=YTDLP_AVAILABLE,
+        yt_dlp_error=(None if YTDLP_AVAILABLE else _YTDLP_IMPORT_ERROR),
+        ffmpeg=ffmpeg_available(),
+        ffmpeg_version=ffmpeg_version(),
+        boot=dict(BOOT, preload=PRELOAD, pid=os.getpid()),
+        download_dir=DOWNLOAD_DIR,
+        proxy=any(p.value for p in identity_pool.proxies),
+        identities={kind: len(members) for kind, members in identity_pool.snapshot().items()},
+        disk_free_gb=(shutil.disk_usage(DOWNLOAD_DIR).free // (1024**3)) if os.path.exists(DOWNLOAD_DIR) else 0,
+        jobs=job_stats(),
+        cached_videos=len(result_cache),
+        transcode=dict(transcode_stats, cpu_per_audio_s=round(mp3_cpu_per_audio_s(), 4), renditions=RENDITIONS),
+        disk_cache=disk_cache_stats(),
+        inflight_downloads=len(_inflight),
+        info_cache=len(info_cache),
+        journal=journal.stats(),
+        ytdlp_cache=dict(dir=YTDLP_CACHE_DIR or None, players=len(_yt_code_cache)),
+        transcode_pool=transcode_pool.stats(),
+    )
+
+@app.get("/strategies")
+def strategies():
+    return jsonify(
+        order=[st[0] for st in strategy_scheduler.order(STRATEGIES)],
+        clients=strategy_scheduler.snapshot(),
+        half_life_s=STRATEGY_HALF_LIFE,
+        dead_after=STRATEGY_DEAD_AFTER,
+        cooldown_s=STRATEGY_COOLDOWN,
+    )
+
+@app.get("/tuning")
+def tuning():
+    return jsonify(
+        enabled=DOWNLOAD_TUNING,
+        fragments=download_tuner.fragments,
+        chunk_kb=[c // 1024 for c in download_tuner.chunks],
+        explore=TUNE_EXPLORE,
+        paths=download_tuner.snapshot(),
+    )
+
+@app.get("/identities")
+def identities():
+    return jsonify(
+        **identity_pool.snapshot(),
+        half_life_s=IDENTITY_HALF_LIFE,
+        cooldown_s=IDENTITY_COOLDOWN,
+        max_cooldown_s=IDENTITY_MAX_COOLDOWN,
+    )
+
+@app.get("/cookie_check")
+def cookie_check():
+    identity_pool.reload(force=True)
+    with identity_pool._lock:
+        jars = [(m.key, m.source, m.summary) for m in identity_pool.cookies.values()]
+    if not jars:
+        return jsonify(ok=False, reason="cookies.txt yok"), 404
+    required = {"SID","__Secure-3PSID","SAPISID","APISID","HSID","SSID"}
+    important = {"CONSENT","VISITOR_INFO1_LIVE","YSC"}
+    return jsonify(ok=True, jars=[{
+        "key": key,
+        "source": source,
+        "total_lines": summary["total_lines"],
+        "youtube_domain_lines": summary["youtube_domain_lines"],
+        "required_found": sorted(required & set(summary["names"])),
+        "important_found": sorted(important & set(summary["names"])),
+        "missing_required": sorted(required - set(summary["names"])),
+        "missing_important": sorted(important - set(summary["names"])),
+    } for key, source, summary in jars])
+
+@app.route("/", methods=["GET","POST"])
+def index():
+    yt_note = ""
+    if not YTDLP_AVAILABLE:
+        yt_note = "<div class='msg err'>⚠️ Sunucuda yt-dlp kurulu değil. Yöneticiye iletin: <code>pip install -U yt-dlp</code></div>"
+    content_shell = HTML_SHELL.format(yt_note=yt_note)
+
+    if request.method == "POST":
+        if not check_rate_limit(client_ip()):
+            msg_html = f'<div class="msg err">⏳ {RATE_LIMIT_MSG}</div>'
+            content = FORM_CONTENT.format(url="", msg_block=msg_html)
+            return render_template_string(content_shell.replace("<!--CONTENT-->", content)), 429
+
+        url = (request.form.get("url") or "").strip()
+
+        try:
+            cookies = read_uploaded_cookies()
+        except ValueError as e:
+            msg_html = f'<div class="msg err">❌ Cookie hatası: {e}</div>'
+            content = FORM_CONTENT.format(url=url, msg_block=msg_html)
+            return render_template_string(content_shell.replace("<!--CONTENT-->", content)), 400
+
+        if not is_valid_youtube_url(url):
+            msg_html = '<div class="msg err">❌ Geçerli bir YouTube URL\'si giriniz.</div>'
+            content = FORM_CONTENT.format(url=url, msg_block=msg_html)
+            return render_template_string(content_shell.replace("<!--CONTENT-->", content)), 400
+        try:
+            output = effective_output(output_from(request.form))
+        except ValueError as e:
+            msg_html = f'<div class="msg err">❌ {e}</div>'
+            content = FORM_CONTENT.format(url=url, msg_block=msg_html)
+            return render_template_string(content_shell.replace("<!--CONTENT-->", content)), 400
+        cached = cache_lookup(extract_video_id(url), output)
+        if cached:
+            return redirect(url_for("done", filename=cached))
+        try:
+            job = submit_job(cached_download, url, output=output, cookies=cookies)
+        except JobQueueFull as e:
+            msg_html = f'<div class="msg err">⏳ {e}</div>'
+            content = FORM_CONTENT.format(url=url, msg_block=msg_html)
+            return render_template_string(content_shell.replace("<!--CONTENT-->", content)), 503
+        return redirect(url_for("job_page", job_id=job.id))
+
+    content = FORM_CONTENT.format(url="", msg_block="")
+    return render_template_string(HTML_SHELL.format(yt_note="")\
+                                  .replace("<!--CONTENT-->", content))
+
+@app.get("/done")
+def done():
+    filename = request.args.get("filename")
+    if not filename:
+        return redirect(url_for("index"))
+    if ".." in filename or "/" in filename or "\\" in filename or not lookup_file(filename, touch=False):
+        msg_html = '<div class="msg err">❌ Dosya bulunamadı. Lütfen tekrar indirin.</div>'
+        content = FORM_CONTENT.format(url="", msg_block=msg_html)
+        return render_template_string(HTML_SHELL.format(yt_note="").replace("<!--CONTENT-->", content)), 404
+    safe_filename = filename.replace("'", "\\'").replace('"','\\"')
+    content = DONE_CONTENT.format(filename=safe_filename)
+    return HTML_SHELL.format(yt_note="").replace("<!--CONTENT-->", content)
+
+@app.get("/wait/<job_id>")
+def job_page(job_id):
+    if not get_job(job_id):
+        msg_html = '<div class="msg err">❌ İş bulunamadı ya da süresi doldu.</div>'
+        content = FORM_CONTENT.format(url="", msg_block=msg_html)
+        return render_template_string(HTML_SHELL.format(yt_note="").replace("<!--CONTENT-->", content)), 404
+    content = JOB_CONTENT.format(job_id=job_id, sse="true" if SSE_MAX_STREAMS else "false")
+    return HTML_SHELL.format(yt_note="").replace("<!--CONTENT-->", content)
+
+@app.post("/jobs")
+def job_submit():
+    data = request.get_json(silent=True) or request.form
+    url = (data.get("url") or "").strip()
+    if not check_rate_limit(client_ip()):
+        return jsonify(ok=False, error=RATE_LIMIT_MSG), 429
+    if not is_valid_youtube_url(url):
+        return jsonify(ok=False, error="Geçerli bir YouTube URL'si giriniz."), 400
+    try:
+        output = effective_output(output_from(data))
+        cookies = read_uploaded_cookies(data)
+    except ValueError as e:
+        return jsonify(ok=False, error=str(e)), 400
+    cached = cache_lookup(extract_video_id(url), output)
+    if cached:
+        return jsonify(ok=True, cached=True, output=output, filename=cached,
+                       download_url=url_for("download", filename=cached))
+    try:
+        job = submit_job(cached_download, url, output=output, cookies=cookies)
+    except JobQueueFull as e:
+        return jsonify(ok=False, error=str(e)), 503
+    return jsonify(ok=True, job_id=job.id, status_url=url_for("job_status", job_id=job.id),
+                   result_url=url_for("job_result", job_id=job.id)), 202
+
+@app.post("/batch")
+def batch_submit():
+    data = request.get_json(silent=True)
+    if data is not None:
+        raw = data.get("urls") or ([data["url"]] if data.get("url") else [])
+        if isinstance(raw, str):
+            raw = raw.splitlines()
+    else:
+        raw = (request.form.get("urls") or request.form.get("url") or "").splitlines()
+    inputs = [u.strip() for u in raw if isinstance(u, str) and u.strip()]
+    wants_html = data is None
+
+    def fail(msg, code):
+        if not wants_html:
+            return jsonify(ok=False, error=msg), code
+        content = FORM_CONTENT.format(url="", msg_block=f'<div class="msg err">❌ {msg}</div>')
+        return render_template_string(HTML_SHELL.format(yt_note="").replace("<!--CONTENT-->", content)), code
+
+    if not check_rate_limit(client_ip()):
+        return fail(RATE_LIMIT_MSG, 429)
+    invalid = [u for u in inputs if not is_batch_input(u)]
+    if not inputs or invalid:
+        return fail(f"Geçersiz YouTube linki: {invalid[0]}" if invalid else "En az bir link giriniz.", 400)
+    if len(inputs) > BATCH_MAX_ITEMS:
+        return fail(f"Toplu indirmede en fazla {BATCH_MAX_ITEMS} link verilebilir.", 400)
+    try:
+        output = effective_output(output_from(data if data is not None else request.form))
+        cookies = read_uploaded_cookies(data)
+    except ValueError as e:
+        return fail(str(e), 400)
+    try:
+        job = submit_job(run_batch, inputs, output=output, job_timeout=BATCH_TIMEOUT, cookies=cookies)
+    except JobQueueFull as e:
+        return fail(str(e), 503)
+    if wants_html:
+        return redirect(url_for("job_page", job_id=job.id))
+    return jsonify(ok=True, job_id=job.id, status_url=url_for("job_status", job_id=job.id),
+                   zip_url=url_for("job_zip", job_id=job.id)), 202
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify(ok=False, error="İş bulunamadı."), 404
+    return jsonify(job.to_dict())
+
+_sse_streams = 0
+_sse_lock = threading.Lock()
+
+@app.get("/jobs/<job_id>/events")
+def job_events(job_id):
+    global _sse_streams
+    job = get_job(job_id)
+    if not job:
+        return jsonify(ok=False, error="İş bulunamadı."), 404
+    if not SSE_MAX_STREAMS:
+        return Response(status=204)  # SSE kapalı (gthread varsayılanı): istemci /jobs/<id> yoklar
+    with _sse_lock:
+        if _sse_streams >= SSE_MAX_STREAMS:
+            return jsonify(ok=False, error="Canlı akış kapasitesi dolu; /jobs/<id> yoklayın."), 503
+        _sse_streams += 1
+    try:
+        since = int(request.headers.get("Last-Event-ID") or request.args.get("since") or 0)
+    except ValueError:
+        since = 0
+
+    def gen():
+        last, deadline = since, time.time() + SSE_MAX_DURATION
+        yield "retry: 1500\n\n"
+        while True:
+            events = job.events_since(last, timeout=min(10.0, max(0.1, deadline - time.time())))
+            for ev in events:
+                last = ev["seq"]
+                yield f"id: {ev['seq']}\nevent: {ev['type']}\ndata: {json.dumps(ev)}\n\n"
+            if job.terminal and not events:
+                return
+            if time.time() >= deadline:
+                return  # tarayıcı Last-Event-ID ile yeniden bağlanır
+            if not events:
+                yield ": ping\n\n"
+
+    def release():
+        global _sse_streams
+        with _sse_lock:
+            _sse_streams -= 1
+
+    resp = Response(gen(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",
+    })
+    resp.call_on_close(release)
+    return resp
+
+@app.get("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify(ok=False, error="İş bulunamadı."), 404
+    if job.state in ("queued", "running"):
+        return jsonify(job.to_dict()), 202
+    if job.state != "done":
+        return jsonify(job.to_dict()), 400
+    if job.is_batch:
+        return redirect(url_for("job_zip", job_id=job.id))
+    return redirect(url_for("done", filename=job.result))
+
+@app.get("/jobs/<job_id>/zip")
+def job_zip(job_id):
+    job = get_job(job_id)
+    if not job or not job.is_batch:
+        return jsonify(ok=False, error="Toplu iş bulunamadı."), 404
+    if job.terminal and not any(c.state == "done" for c in job.children):
+        return jsonify(job.to_dict()), 400
+    # İş sürerken de istenebilir: arşiv öğeler bittikçe uzar.
+    return Response(stream_with_context(stream_batch_zip(job)), mimetype="application/zip", headers={
+        "Content-Disposition": attachment_header(f"ytmp3-{job.id[:8]}.zip"),
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",
+    })
+
+@app.post("/jobs/<job_id>/cancel")
+def job_cancel(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify(ok=False, error="İş bulunamadı."), 404
+    job.cancel()
+    return jsonify(ok=True, state=job.state)
+
+@app.get("/info")
+def video_info():
+    """Metadata JSON'u: başlık, süre, choose_format'ın seçeceği ses formatı (önbellekten ya da tek
+    extract) ve önbellekte hazır çıktılar (variants: tür -> indirme linki)."""
+    url = (request.args.get("url") or "").strip()
+    if not is_valid_youtube_url(url):
+        return jsonify(ok=False, error="Geçerli bir YouTube URL'si giriniz."), 400
+    # önbellek isabeti ücretsiz; ıska YouTube'a gider ve diğer uçlar gibi rate limit'e tabidir
+    if info_cache.get(extract_video_id(url)) is None and not check_rate_limit(client_ip()):
+        return jsonify(ok=False, error=RATE_LIMIT_MSG), 429
+    try:
+        entry, cached = lookup_info(url)
+    except Exception as e:
+        return jsonify(ok=False, error=str(e)), 400
+    info, fmt = entry["info"], entry["fmt"]
+    f = next((x for x in info.get("formats") or [] if x.get("format_id") == fmt), None) or {}
+    return jsonify(
+        ok=True,
+        id=entry["id"],
+        title=info.get("title"),
+        duration=info.get("duration"),
+        uploader=info.get("uploader") or info.get("channel"),
+        format={"format_id": fmt, "ext": f.get("ext"), "acodec": f.get("acodec"), "abr": f.get("abr"),
+                "filesize": f.get("filesize") or f.get("filesize_approx")},
+        strategy=entry["strategy"],
+        player_clients=entry["clients"],
+        cached=cached,
+        fetched_at=entry["stored"],
+        urls_expire=entry["urls_expire"],
+        variants={k: url_for("download", filename=fn) for k, fn in cached_variants(entry["id"]).items()},
+    )
+
+@app.get("/stream")
+def stream():
+    url = (request.args.get("url") or "").strip()
+    if not is_valid_youtube_url(url):
+        return jsonify(ok=False, error="Geçerli bir YouTube URL'si giriniz."), 400
+    args = request.args
+    try:
+        output = parse_output(args.get("output") or args.get("mode") or (None if args.get("bitrate") else STREAM_OUTPUT),
+                              args.get("bitrate"))
+    except ValueError as e:
+        return jsonify(ok=False, error=str(e)), 400
+    if not is_encoded(output):
+        return jsonify(ok=False, error="Akış yalnızca MP3/Opus çıktısıyla kullanılabilir; "
+                                       "dönüştürmeden/orijinal dosya için normal indirmeyi kullanın."), 400
+    codec = output.split("-", 1)[0]
+    cached = cache_lookup(extract_video_id(url), output)
+    if cached and cached.endswith("." + codec):
+        return redirect(url_for("download", filename=cached))
+    if not ffmpeg_available():
+        return jsonify(ok=False, error="Akış modu için sunucuda FFmpeg gerekli."), 503
+    if not check_rate_limit(client_ip()):
+        return jsonify(ok=False, error=RATE_LIMIT_MSG), 429
+    try:
+        meta = extract_for_stream(url, output)
+    except Exception as e:
+        return jsonify(ok=False, error=str(e)), 400
+    return Response(stream_with_context(stream_audio(meta)), mimetype=STREAM_MIMETYPES[codec], headers={
+        "Content-Disposition": attachment_header(meta["filename"]),
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",
+    })
+
+@app.route("/download/<path:filename>")
+def download(filename):
+    if ".." in filename or "/" in filename or "\\" in filename:
+        return "Geçersiz dosya adı", 400
+    if filename.startswith("."):
+        return "Dosya bulunamadı", 404  # uygulama durumu (.jobs.sqlite3, .info-cache, ...)
+    entry = lookup_file(filename)
+    if not entry: return "Dosya bulunamadı", 404
+    if DOWNLOAD_OFFLOAD == "x-accel":
+        # nginx internal location'ı Range/ETag/304'ü kendisi uygular; Python bayt kopyalamaz.
+        resp = Response(mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        resp.headers["X-Accel-Redirect"] = f"{DOWNLOAD_ACCEL_PREFIX}/{url_quote(filename)}"
+        resp.headers["Content-Disposition"] = attachment_header(filename)
+        metrics.inc("ytmp3_served_bytes_total", entry["size"], route="download")  # nginx'e devredilen üst sınır
+        return resp
+    try:
+        # conditional=True: Range (206), If-None-Match / If-Modified-Since (304). Gunicorn'un
+        # wsgi.file_wrapper'ı tam gövdeli yanıtlarda sendfile() kullanır.
+        resp = send_file(os.path.join(DOWNLOAD_DIR, filename), as_attachment=True, conditional=True,
+                         etag=entry["etag"], last_modified=entry["mtime"], max_age=DOWNLOAD_MAX_AGE)
+        if resp.status_code in (200, 206):
+            metrics.inc("ytmp3_served_bytes_total", resp.content_length or 0, route="download")
+        return resp
+    except FileNotFoundError:
+        drop_cached_file(filename)
+        return "Dosya bulunamadı", 404
+    except Exception as e:
+        return "Dosya indirilemedi", 500
+
+# Force route (manuel client test)
+def run_download_with_clients(url: str, clients: List[str], *, use_po_token: bool = False, aggressive_bypass: bool = True,
+                              job: Optional[Job] = None, output: str = DEFAULT_OUTPUT) -> str:
+    if not YTDLP_AVAILABLE:
+        raise RuntimeError("yt-dlp eksik. 'pip install -U yt-dlp'")
+    if not is_valid_youtube_url(url):
+        raise ValueError("Geçerli bir YouTube URL'si giriniz.")
+    ident = identity_pool.acquire(job)
+    governor_wait(job, governor_keys(clients, ident))
+    from yt_dlp.utils import DownloadError
+    output = effective_output(output)
+    opts = build_opts(player_clients=clients, identity=ident, postprocess=True,
+                      use_po_token=use_po_token, aggressive_bypass=aggressive_bypass, output=output)
+    attach_job(opts, job)
+    try:
+        with new_ydl(opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            if not info: raise DownloadError("Video metadata extraction failed")
+            if info.get("is_live"): raise DownloadError("Live streams are not supported")
+            fmt = choose_format(info)
+            filename = download_and_locate(ydl, info, fmt, output, job)
+    except JobCancelled:
+        raise
+    except Exception as e:
+        identity_pool.record(ident, False, classify_error(e))
+        raise
+    identity_pool.record(ident, True)
+    return filename
+
+@app.get("/force")
+def force():
+    url = (request.args.get("url") or "").strip()
+    if not url:
+        return jsonify(ok=False, error="url parametresi gerekli"), 400
+    clients = [c.strip() for c in (request.args.get("clients","tv").split(",")) if c.strip()]
+    use_po = (request.args.get("po","0").lower() in ("1","true","yes","on"))
+    aggr = (request.args.get("aggr","1").lower() in ("1","true","yes","on"))
+    if not is_valid_youtube_url(url):
+        return jsonify(ok=False, error="Geçerli bir YouTube URL'si giriniz."), 400
+    try:
+        output = output_from(request.args)
+    except ValueError as e:
+        return jsonify(ok=False, error=str(e)), 400
+    try:
+        job = submit_job(run_download_with_clients, url, clients, use_po_token=use_po, aggressive_bypass=aggr,
+                         output=output)
+    except JobQueueFull as e:
+        return jsonify(ok=False, error=str(e)), 503
+    return redirect(url_for("job_page", job_id=job.id))
+
+# Warm-up: worker açılışında en iyi strateji ile YTDLP_WARMUP_URL'nin metadata'sı bir kez çekilir;
+# player JS, sts ve imza/nsig verisi hem süreç içi hem disk önbelleğine girer. Hata yalnızca loglanır.
+def prune_ytdlp_cache(max_age: float = 3600) -> None:
+    """Yarıda kesilmiş yazımlardan kalan *.tmp dosyalarını siler."""
+    if not YTDLP_CACHE_DIR:
+        return
+    now = time.time()
+    for root, _, files in os.walk(YTDLP_CACHE_DIR):
+        for fn in files:
+            path = os.path.join(root, fn)
+            try:
+                if fn.endswith(".tmp") and now - os.path.getmtime(path) > max_age:
+                    os.remove(path)
+            except OSError:
+                pass
+
+def warm_up() -> None:
+    load_ytdlp()
+    prune_ytdlp_cache()
+    if not (YTDLP_WARMUP_URL and YTDLP_AVAILABLE):
+        return
+    strategy = strategy_scheduler.order(STRATEGIES)[0]
+    ident = identity_pool.acquire()
+    try:
+        with timed("warmup"):
+            governor_wait(None, governor_keys(strategy[1], ident))
+            ydl, _, _, extract_latency = open_strategy(strategy, YTDLP_WARMUP_URL, ident)
+            ydl.close()
+    except Exception as e:
+        identity_pool.record(ident, False, classify_error(e))
+        print(f"[warmup] failed: {str(e)[:200]}")
+        return
+    identity_pool.record(ident, True)
+    print(f"[warmup] {strategy[0]} ready in {extract_latency:.1f}s (players cached: {len(_yt_code_cache)})")
+
+def start_warm_up() -> None:
+    # start_services() worker içinde (fork sonrası) çağrılır; her worker kendi süreç içi önbelleğini ısıtır.
+    threading.Thread(target=warm_up, name="ytdlp-warmup", daemon=True).start()
+
+# Background cleanup: indeksteki bir sonraki TTL dolma anına kadar uyur (dizin taraması yok).
+def background_cleanup():
+    def worker():
+        load_disk_index()
+        sweep = True
+        while True:
+            try:
+                journal.resume(sweep=sweep)
+                sweep = False
+                wait_s = expire_files()
+                info_cache.prune()
+            except Exception as e:
+                print(f"[evict] sweep error: {e}")
+                wait_s = 60
+            time.sleep(min(max(wait_s, 1.0), 600))
+    threading.Thread(target=worker, name="cache-sweeper", daemon=True).start()
+
+# --------- Boot ---------
+# Arka plan servisleri (önbellek süpürücü, yt_dlp yükleme + warm-up) süreç başına bir kez
+# start_services() ile başlar. --preload'da modül master'da yüklenir; orada başlayan iş parçacıkları
+# fork'ta worker'a geçmez, bu yüzden servisler fork sonrası her worker'da başlatılır. before_request
+# kancası, servisleri başka bir süreçte başlatılmış olan worker için yedektir.
+_services_pid: Optional[int] = None
+_services_at = 0.0
+_services_lock = threading.Lock()
+
+def start_services() -> None:
+    global _services_pid, _services_at
+    if _services_pid == os.getpid():
+        return
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        t0 = time.perf_counter()
+        background_cleanup()
+        start_warm_up()
+        _services_pid, _services_at = os.getpid(), time.perf_counter()
+        BOOT["services_s"] = round(_services_at - t0, 4)
+    print(f"[boot] pid {_services_pid}: module {BOOT['module_s']}s, services {BOOT['services_s']}s"
+          f" ({'preloaded' if PRELOAD else 'loaded in worker'})")
+
+def _after_fork() -> None:
+    global _services_lock
+    _services_lock = threading.Lock()
+    for store in (rate_limiter, upstream_governor, journal):
+        store.reset_connections()
+    start_services()
+
+BOOT["module_s"] = round(time.perf_counter() - _BOOT_T0, 3)
+if PRELOAD:
+    load_ytdlp()
+    os.register_at_fork(after_in_child=_after_fork)
+else:
+    start_services()
 
 if __name__ == "__main__":
     print("[START] Safe Boot — Flask app")
+    print(f"[CFG] Server mode: {SERVER_MODE}")
     print(f"[CFG] yt-dlp: {YTDLP_AVAILABLE}")
     if not YTDLP_AVAILABLE:
         print(f"[CFG] yt-dlp import error: {_YTDLP_IMPORT_ERROR}")
     print(f"[CFG] Download dir: {DOWNLOAD_DIR}")
-    print(f"[CFG] FFmpeg: {ffmpeg_available()}")
-    print(f"[CFG] Proxy: {'Evet' if PROXY else 'Hayır'}")
+    print(f"[CFG] FFmpeg: {ffmpeg_version() or ffmpeg_available()}")
+    print(f"[CFG] Proxy: {len(PROXY_LIST)} adet" if PROXY_LIST else "[CFG] Proxy: Hayır")
     try:
         test_file = os.path.join(DOWNLOAD_DIR, "test_write.tmp")
         with open(test_file,"w") as f: f.write("ok")
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark için yerel YouTube/medya taklidi.
+- GET /youtubei/v1/player?id=<video_id>  -> hazır (sadeleştirilmiş) player yanıtı (JSON)
+- GET /media/<video_id>.m4a              -> ses fikstürü (Range destekli, isteğe bağlı bant sınırı)
+- GET /stats                             -> istek sayaçları
+Uygulama bu sunucuya bench/yt_dlp_plugins altındaki extractor eklentisi üzerinden ulaşır;
+app.py'de hiçbir şey değişmez. Tek başına da çalışır: python bench/fake_youtube.py --port 8900
+"""
+
+import os
+import re
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Optional, Dict, Any
+
+CHUNK = 64 * 1024
+BOT_ERROR = "Sign in to confirm you're not a bot. This helps protect our community."
+
+def make_fixture(path: str, duration: int = 60) -> str:
+    """ffmpeg varsa gerçek bir AAC (m4a) sinüs dosyası üretir; yoksa rastgele baytlar yazar
+    (bu durumda uygulama da dönüştürme yapmaz, dosyayı olduğu gibi bırakır)."""
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        return path
+    if shutil.which("ffmpeg"):
+        subprocess.run(["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-f", "lavfi",
+                        "-i", f"sine=frequency=440:duration={duration}", "-c:a", "aac", "-b:a", "128k", path],
+                       check=True)
+    else:
+        with open(path, "wb") as f:
+            f.write(os.urandom(duration * 16000))
+    return path
+
+class FakeYoutube:
+    def __init__(self, fixture: str, duration: int, player_latency: float = 0.0,
+                 bandwidth: int = 0, fail_rate: float = 0.0):
+        self.fixture = fixture
+        self.size = os.path.getsize(fixture)
+        self.duration = duration
+        self.player_latency = player_latency
+        self.bandwidth = bandwidth          # bayt/sn, 0 = sınırsız
+        self.fail_rate = fail_rate
+        self.stats: Dict[str, int] = {"player": 0, "player_failed": 0, "media": 0, "media_bytes": 0}
+        self._lock = threading.Lock()
+        self.httpd: Optional[ThreadingHTTPServer] = None
+
+    def count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += n
+
+    def player_response(self, video_id: str, base: str) -> Dict[str, Any]:
+        return {
+            "id": video_id,
+            "title": f"Bench {video_id}",
+            "duration": self.duration,
+            "formats": [{
+                "format_id": "140",
+                "url": f"{base}/media/{video_id}.m4a",
+                "ext": "m4a",
+                "acodec": "mp4a.40.2",
+                "vcodec": "none",
+                "abr": 128,
+                "filesize": self.size,
+                "protocol": "http",
+            }],
+        }
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, name="fake-youtube", daemon=True).start()
+        return f"http://{host}:{self.httpd.server_address[1]}"
+
+    def stop(self) -> None:
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):  # sessiz
+                pass
+
+            def _json(self, code: int, payload: Dict[str, Any]) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                u = urlparse(self.path)
+                if u.path == "/youtubei/v1/player":
+                    return self._player(parse_qs(u.query).get("id", [""])[0])
+                m = re.fullmatch(r"/media/([A-Za-z0-9_-]{11})\.m4a", u.path)
+                if m:
+                    return self._media()
+                if u.path == "/stats":
+                    return self._json(200, dict(fake.stats))
+                self._json(404, {"error": "not found"})
+
+            def _player(self, video_id: str) -> None:
+                fake.count("player")
+                if fake.player_latency:
+                    time.sleep(fake.player_latency)
+                if fake.fail_rate and random.random() < fake.fail_rate:
+                    fake.count("player_failed")
+                    return self._json(200, {"error": BOT_ERROR})
+                base = f"http://{self.headers.get('Host')}"
+                self._json(200, fake.player_response(video_id, base))
+
+            def _media(self) -> None:
+                fake.count("media")
+                start, end = 0, fake.size - 1
+                m = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+                if m and (m.group(1) or m.group(2)):
+                    if m.group(1):
+                        start = int(m.group(1))
+                        end = min(int(m.group(2)), end) if m.group(2) else end
+                    else:
+                        start = max(0, fake.size - int(m.group(2)))
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{fake.size}")
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Type", "audio/mp4")
+                self.send_header("Accept-Ranges", "bytes")
+                self.send_header("Content-Length", str(end - start + 1))
+                self.end_headers()
+                with open(fake.fixture, "rb") as f:
+                    f.seek(start)
+                    left = end - start + 1
+                    while left > 0:
+                        t0 = time.perf_counter()
+                        chunk = f.read(min(CHUNK, left))
+                        if not chunk:
+                            break
+                        try:
+                            self.wfile.write(chunk)
+                        except (BrokenPipeError, ConnectionResetError):
+                            return
+                        left -= len(chunk)
+                        fake.count("media_bytes", len(chunk))
+                        if fake.bandwidth:
+                            time.sleep(max(0.0, len(chunk) / fake.bandwidth - (time.perf_counter() - t0)))
+
+        return Handler
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Yerel YouTube/medya taklidi")
+    ap.add_argument("--port", type=int, default=8900)
+    ap.add_argument("--fixture", default=os.path.join(tempfile.gettempdir(), "ytmp3-bench-fixture.m4a"))
+    ap.add_argument("--duration", type=int, default=60, help="fikstür süresi (sn)")
+    ap.add_argument("--player-latency", type=float, default=0.0, help="player yanıtı gecikmesi (sn)")
+    ap.add_argument("--bandwidth", type=int, default=0, help="medya bant sınırı (bayt/sn, 0 = sınırsız)")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="bot hatası dönen player oranı (0-1)")
+    args = ap.parse_args()
+    fake = FakeYoutube(make_fixture(args.fixture, args.duration), args.duration,
+                       args.player_latency, args.bandwidth, args.fail_rate)
+    print(f"[fake-yt] {fake.start(port=args.port)} (BENCH_FAKE_YT)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""
+Çevrimdışı uçtan uca benchmark: YouTube'a hiç gitmeden app.py'nin verimini ve gecikmesini ölçer.
+
+- bench/fake_youtube.py ile yerel player/medya sunucusu açılır,
+- uygulama ayrı bir süreçte (varsayılan: Dockerfile'daki gunicorn ayarları) başlatılır; YouTube
+  linkleri bench/yt_dlp_plugins eklentisiyle taklit sunucuya gider,
+- yük sürücüsü "/", "/force" ve "/download" uçlarını verilen eşzamanlılıkla çağırır,
+- istek/sn, p50/p95/p99 gecikme, ortalama dönüştürme (ffmpeg) süresi, tepe RSS ve disk kullanımı
+  raporlanır. --json ile sonuç kaydedilir, --compare ile önceki sonuca göre gerileme aranır.
+
+Örnek:
+    python bench/run.py --requests 24 --concurrency 4 --json bench-base.json
+    python bench/run.py --requests 24 --concurrency 4 --compare bench-base.json
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import quote, urlencode, urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_youtube import FakeYoutube, make_fixture  # noqa: E402
+
+SCENARIOS = ("submit", "force", "download")
+TERMINAL = ("done", "error", "cancelled", "timeout")
+
+# --------- HTTP ---------
+def http_request(port: int, method: str, path: str, body: Optional[bytes] = None,
+                 headers: Optional[Dict[str, str]] = None, timeout: float = 600) -> Tuple[int, Dict[str, str], bytes]:
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        data = resp.read()
+        return resp.status, {k.lower(): v for k, v in resp.getheaders()}, data
+    finally:
+        conn.close()
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def video_id(prefix: str, n: int) -> str:
+    return f"{prefix}{n:0{11 - len(prefix)}d}"
+
+def percentile(values: List[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, max(0, int(round(p / 100.0 * len(s) + 0.5)) - 1))]
+
+# --------- Process sampling ---------
+def _proc_tree(pid: int) -> List[int]:
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    out, todo = [], [pid]
+    while todo:
+        p = todo.pop()
+        out.append(p)
+        todo += children.get(p, [])
+    return out
+
+def _rss_bytes(pids: List[int]) -> int:
+    total = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                m = re.search(r"VmRSS:\s+(\d+) kB", f.read())
+            total += int(m.group(1)) * 1024 if m else 0
+        except OSError:
+            pass
+    return total
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for base, _, files in os.walk(path):
+        for fn in files:
+            try:
+                total += os.path.getsize(os.path.join(base, fn))
+            except OSError:
+                pass
+    return total
+
+class Sampler:
+    """Uygulama süreç ağacının RSS'ini ve indirme dizininin boyutunu periyodik örnekler."""
+
+    def __init__(self, pid: int, download_dir: str, interval: float = 0.2):
+        self.pid, self.download_dir, self.interval = pid, download_dir, interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def sample(self) -> None:
+        if sys.platform.startswith("linux"):
+            self.peak_rss = max(self.peak_rss, _rss_bytes(_proc_tree(self.pid)))
+        self.peak_disk = max(self.peak_disk, _dir_bytes(self.download_dir))
+
+    def start(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+# --------- App process ---------
+def start_app(port: int, fake_url: str, download_dir: str, server: str, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = {k: v for k, v in os.environ.items()
+           if k not in ("YTDLP_PROXY", "HTTPS_PROXY", "HTTP_PROXY", "PROXY", "YTDLP_COOKIES")}
+    env.update({
+        "PORT": str(port),
+        "DOWNLOAD_DIR": download_dir,
+        "BENCH_FAKE_YT": fake_url,
+        "PYTHONPATH": os.pathsep.join([BENCH_DIR, env.get("PYTHONPATH", "")]).rstrip(os.pathsep),
+        "RATE_LIMIT_COUNT": "1000000",
+        "RATE_LIMIT_DB": os.path.join(os.path.dirname(download_dir), "ratelimit.sqlite3"),
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.update(extra_env)
+    if server == "gunicorn":
+        # Dockerfile CMD ile aynı ayarlar; WEB_CONCURRENCY/THREADS ile değiştirilebilir
+        cmd = ["gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+               "--workers", env.get("WEB_CONCURRENCY", "1"), "--threads", env.get("THREADS", "2"),
+               "--timeout", "300", "--graceful-timeout", "30", "--keep-alive", "75", "--log-level", "warning"]
+    else:
+        cmd = [sys.executable, "app.py"]
+    log = open(os.path.join(os.path.dirname(download_dir), "app.log"), "wb")
+    proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"uygulama açılamadı (çıkış {proc.returncode}); bkz. {log.name}")
+        try:
+            if http_request(port, "GET", "/health", timeout=2)[0] == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("uygulama 60 sn içinde /health'e yanıt vermedi")
+
+def stop_app(proc: subprocess.Popen) -> None:
+    proc.terminate()
+    try:
+        proc.wait(15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+# --------- Scenarios ---------
+def wait_job(port: int, location: str, poll: float) -> Tuple[bool, Optional[str], str]:
+    """/wait/<id> ya da /done?filename=... yönlendirmesini sonuca çevirir: (ok, dosya adı, hata)."""
+    u = urlparse(location)
+    if u.path == "/done":
+        return True, parse_qs(u.query).get("filename", [None])[0], ""
+    m = re.fullmatch(r"/wait/([0-9a-f]+)", u.path)
+    if not m:
+        return False, None, f"beklenmeyen yönlendirme: {location}"
+    while True:
+        status, _, body = http_request(port, "GET", f"/jobs/{m.group(1)}")
+        job = json.loads(body or b"{}")
+        if status != 200:
+            return False, None, job.get("error") or f"HTTP {status}"
+        if job.get("state") in TERMINAL:
+            return job["state"] == "done", job.get("filename"), job.get("error") or ""
+        time.sleep(poll)
+
+def run_submit(port: int, vid: str, poll: float) -> Tuple[bool, Optional[str], str]:
+    body = urlencode({"url": f"https://www.youtube.com/watch?v={vid}"}).encode()
+    status, headers, _ = http_request(port, "POST", "/", body,
+                                      {"Content-Type": "application/x-www-form-urlencoded"})
+    if status != 302:
+        return False, None, f"HTTP {status}"
+    return wait_job(port, headers.get("location", ""), poll)
+
+def run_force(port: int, vid: str, poll: float, clients: str) -> Tuple[bool, Optional[str], str]:
+    qs = urlencode({"url": f"https://www.youtube.com/watch?v={vid}", "clients": clients})
+    status, headers, _ = http_request(port, "GET", f"/force?{qs}")
+    if status != 302:
+        return False, None, f"HTTP {status}"
+    return wait_job(port, headers.get("location", ""), poll)
+
+def run_fetch(port: int, filename: str) -> Tuple[bool, int, str]:
+    status, _, body = http_request(port, "GET", f"/download/{quote(filename)}")
+    return status == 200, len(body), ("" if status == 200 else f"HTTP {status}")
+
+def run_scenario(name: str, args, port: int, files: List[str]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors: List[str] = []
+    nbytes = 0
+    lock = threading.Lock()
+    prefix = {"submit": "bs", "force": "bf"}.get(name, "")
+
+    def one(i: int) -> None:
+        nonlocal nbytes
+        t0 = time.perf_counter()
+        if name == "download":
+            ok, size, err = run_fetch(port, files[i % len(files)])
+            filename = None
+        else:
+            vid = video_id(prefix, i % args.videos)
+            if name == "submit":
+                ok, filename, err = run_submit(port, vid, args.poll)
+            else:
+                ok, filename, err = run_force(port, vid, args.poll, args.force_clients)
+            size = 0
+        dt = time.perf_counter() - t0
+        with lock:
+            if ok:
+                latencies.append(dt)
+                nbytes += size
+                if filename and filename not in files:
+                    files.append(filename)
+            else:
+                errors.append(err)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+        list(ex.map(one, range(args.requests)))
+    wall = time.perf_counter() - t0
+    return {
+        "requests": args.requests,
+        "ok": len(latencies),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:3],
+        "wall_s": round(wall, 3),
+        "rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "p50_s": round(percentile(latencies, 50), 4),
+        "p95_s": round(percentile(latencies, 95), 4),
+        "p99_s": round(percentile(latencies, 99), 4),
+        "mb_per_s": round(nbytes / 1024**2 / wall, 2) if name == "download" and wall else None,
+    }
+
+# --------- Report ---------
+def stage_means(port: int) -> Dict[str, float]:
+    """app /metrics'ten aşama başına ortalama süreler (sn)."""
+    try:
+        _, _, body = http_request(port, "GET", "/metrics")
+    except OSError:
+        return {}
+    sums: Dict[str, float] = {}
+    counts: Dict[str, float] = {}
+    for line in body.decode().splitlines():
+        m = re.match(r'ytmp3_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)', line)
+        if m:
+            (sums if m.group(1) == "sum" else counts)[m.group(2)] = float(m.group(3))
+    return {k: round(sums[k] / counts[k], 4) for k in sums if counts.get(k)}
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\n{'scenario':<10}{'ok/req':>9}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}  extra")
+    for name, r in report["scenarios"].items():
+        extra = f"{r['mb_per_s']} MB/s" if r.get("mb_per_s") is not None else ""
+        if r["errors"]:
+            extra += f" errors: {r['error_samples']}"
+        print(f"{name:<10}{str(r['ok']) + '/' + str(r['requests']):>9}{r['rps']:>9.2f}"
+              f"{r['p50_s']:>9.3f}{r['p95_s']:>9.3f}{r['p99_s']:>9.3f}  {extra}")
+    st = report["stages"]
+    print(f"\ntranscode (postprocess) mean: {st.get('postprocess', 0.0):.3f}s | "
+          f"extract: {st.get('extract', 0.0):.3f}s | download: {st.get('download', 0.0):.3f}s | "
+          f"queue_wait: {st.get('queue_wait', 0.0):.3f}s")
+    print(f"peak RSS: {report['peak_rss_mb']} MB | peak disk: {report['peak_disk_mb']} MB | "
+          f"final disk: {report['final_disk_mb']} MB | ffmpeg: {report['ffmpeg']}")
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    for name, r in report["scenarios"].items():
+        b = baseline.get("scenarios", {}).get(name)
+        if not b:
+            continue
+        if b["rps"] and r["rps"] < b["rps"] * (1 - threshold):
+            regressions.append(f"{name}: rps {b['rps']} -> {r['rps']}")
+        for key in ("p50_s", "p95_s"):
+            if b[key] and r[key] > b[key] * (1 + threshold):
+                regressions.append(f"{name}: {key} {b[key]} -> {r[key]}")
+        if r["errors"] > b["errors"]:
+            regressions.append(f"{name}: errors {b['errors']} -> {r['errors']}")
+    if baseline.get("peak_rss_mb") and report["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + threshold):
+        regressions.append(f"peak RSS {baseline['peak_rss_mb']} -> {report['peak_rss_mb']} MB")
+    return regressions
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="ytmp3 çevrimdışı benchmark")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help="virgülle: submit,force,download")
+    ap.add_argument("--requests", type=int, default=20, help="senaryo başına istek")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--videos", type=int, default=10_000,
+                    help="farklı video ID sayısı (--requests'ten küçükse önbellek isabetleri ölçülür)")
+    ap.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn" if shutil.which("gunicorn") else "flask")
+    ap.add_argument("--force-clients", default="tv")
+    ap.add_argument("--poll", type=float, default=0.1, help="iş durumu yoklama aralığı (sn)")
+    ap.add_argument("--duration", type=int, default=60, help="ses fikstürü süresi (sn)")
+    ap.add_argument("--player-latency", type=float, default=0.0)
+    ap.add_argument("--bandwidth", type=int, default=0, help="medya bant sınırı (bayt/sn)")
+    ap.add_argument("--fail-rate", type=float, default=0.0)
+    ap.add_argument("-e", "--env", action="append", default=[], help="uygulamaya KEY=VALUE ortam değişkeni")
+    ap.add_argument("--json", help="sonucu bu dosyaya yaz")
+    ap.add_argument("--compare", help="önceki --json çıktısı; gerileme varsa çıkış kodu 1")
+    ap.add_argument("--threshold", type=float, default=0.15, help="gerileme eşiği (oran)")
+    ap.add_argument("--keep", action="store_true", help="geçici dizini silme")
+    args = ap.parse_args()
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"bilinmeyen senaryo: {', '.join(sorted(unknown))}")
+
+    work = tempfile.mkdtemp(prefix="ytmp3-bench-")
+    download_dir = os.path.join(work, "dl")
+    os.makedirs(download_dir)
+    fixture = make_fixture(os.path.join(work, "fixture.m4a"), args.duration)
+    fake = FakeYoutube(fixture, args.duration, args.player_latency, args.bandwidth, args.fail_rate)
+    fake_url = fake.start()
+    extra_env = dict(kv.split("=", 1) for kv in args.env)
+    port = free_port()
+    print(f"[bench] fake youtube {fake_url}, app :{port} ({args.server}), work {work}")
+    proc = start_app(port, fake_url, download_dir, args.server, extra_env)
+    sampler = Sampler(proc.pid, download_dir).start()
+    files: List[str] = []
+    results: Dict[str, Any] = {}
+    try:
+        for name in scenarios:
+            if name == "download" and not files:
+                run_submit(port, video_id("bd", 0), args.poll)  # servis edilecek bir dosya hazırla
+                files += [fn for fn in os.listdir(download_dir) if os.path.isfile(os.path.join(download_dir, fn))]
+                if not files:
+                    results[name] = {"requests": 0, "ok": 0, "errors": 1, "error_samples": ["dosya yok"],
+                                     "wall_s": 0, "rps": 0, "p50_s": 0, "p95_s": 0, "p99_s": 0, "mb_per_s": 0}
+                    continue
+            print(f"[bench] {name}: {args.requests} requests @ {args.concurrency}")
+            results[name] = run_scenario(name, args, port, files)
+        stages = stage_means(port)
+    finally:
+        sampler.stop()
+        stop_app(proc)
+        fake.stop()
+    report = {
+        "created": time.time(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "compare", "keep")},
+        "ffmpeg": bool(shutil.which("ffmpeg")),
+        "scenarios": results,
+        "stages": stages,
+        "upstream": dict(fake.stats),
+        "peak_rss_mb": round(sampler.peak_rss / 1024**2, 1),
+        "peak_disk_mb": round(sampler.peak_disk / 1024**2, 1),
+        "final_disk_mb": round(_dir_bytes(download_dir) / 1024**2, 1),
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if not args.keep:
+        shutil.rmtree(work, ignore_errors=True)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for r in regressions:
+            print(f"[bench] REGRESSION {r}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+yt-dlp extractor eklentisi: BENCH_FAKE_YT tanımlıysa YouTube video linklerini yerel taklit
+sunucuya yönlendirir. Eklentiler yerleşik extractor'lardan önce denendiği için app.py'deki
+strateji/indirme/ffmpeg hattı olduğu gibi çalışır. bench/ dizini PYTHONPATH'te olmalıdır.
+"""
+
+import os
+
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.utils import ExtractorError
+
+
+class FakeYoutubeIE(InfoExtractor):
+    IE_NAME = "fakeyoutube"
+    _VALID_URL = (r'https?://(?:(?:www|m)\.)?(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/|embed/)|youtu\.be/)'
+                  r'(?P<id>[A-Za-z0-9_-]{11})')
+
+    @classmethod
+    def suitable(cls, url):
+        return bool(os.environ.get("BENCH_FAKE_YT")) and super().suitable(url)
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        base = os.environ["BENCH_FAKE_YT"].rstrip("/")
+        data = self._download_json(f"{base}/youtubei/v1/player", video_id, query={"id": video_id},
+                                   note="Downloading fake player response")
+        if data.get("error"):
+            raise ExtractorError(data["error"], expected=True)
+        return data